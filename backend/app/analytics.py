@@ -0,0 +1,420 @@
+"""Аналитика записей на курсы: заранее посчитанные агрегаты для /stats.
+
+    python -m app.analytics refresh
+    python -m app.analytics backfill [--since 2024-01-01] [--until 2024-06-01]
+
+Агрегаты (таблицы analytics_* в models) обновляет воркер фоновых задач:
+crud и массовый импорт после commit ставят задачу с измененными парами
+(user_id, course_id), транзакция записи в агрегаты не ходит. Итоги
+пользователя задача пересчитывает по user_courses (повтор и порядок задач
+не важны); записи по уровням и счетчики дня прибавляются один раз на пачку
+(analytics_applied_batches). Смена часов или уровня курса массовым
+импортом (merge_courses) ставит задачу пересчета записанных на эти курсы и
+затронутых уровней. Строки, которые задевает почти каждая запись (уровень
+курса, текущий день, число учащихся), разбиты на ANALYTICS_SHARDS частей
+по user_id. Эндпоинты /stats читают по индексу ограниченное число строк и
+не зависят от размера user_courses; агрегаты отстают от записей на время
+очереди задач.
+
+refresh (по расписанию, k8s/analytics-refresh.yaml) пересчитывает агрегаты
+по user_courses и courses.enrolled_count пачками, блокируя строки пачки так
+же, как app.reconcile, - он исправляет и задачи, потерянные без Redis.
+Пачка, которая ждала в очереди во время refresh, прибавится к уровням
+второй раз; расхождение исправит следующий refresh.
+backfill дополнительно восстанавливает историю по дням из audit_events за
+завершенные дни.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .database import SessionLocal, wait_for_database
+from .jobs import enqueue
+
+ANALYTICS_SHARDS = int(os.getenv("ANALYTICS_SHARDS", "16"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "1000"))
+# Сколько дней хранить, кто уже учтен в active_learners
+ANALYTICS_LEARNERS_RETENTION_DAYS = int(os.getenv("ANALYTICS_LEARNERS_RETENTION_DAYS", "7"))
+ANALYTICS_MAX_DAYS = 366
+
+user_hours = models.AnalyticsUserHours.__table__
+learners = models.AnalyticsLearners.__table__
+levels = models.AnalyticsLevel.__table__
+daily = models.AnalyticsDaily.__table__
+daily_learners = models.AnalyticsDailyLearner.__table__
+applied_batches = models.AnalyticsAppliedBatch.__table__
+
+def shard_of(user_id):
+    return user_id % ANALYTICS_SHARDS
+
+def add_counters(db: Session, table, keys, rows):
+    """Прибавляет значения к счетчикам; недостающие строки создаются.
+
+    Строки обновляются в порядке ключей, чтобы пачки не блокировали друг друга.
+    """
+    if not rows:
+        return []
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    stmt = crud.insert_ignore(db, table)
+    counters = [name for name in rows[0] if name not in keys]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: table.c[name] + stmt.excluded[name] for name in counters},
+    )
+    return db.execute(stmt.values(rows).returning(*table.primary_key.columns, *(table.c[name] for name in counters))).all()
+
+def sync_user_hours(db: Session, user_ids):
+    """Пересчитывает курсы и часы пользователей по user_courses; возвращает число исправленных.
+
+    Строки users блокируются FOR NO KEY UPDATE - это не мешает записям на
+    курсы (внешний ключ берет KEY SHARE), но параллельные пересчеты одного
+    пользователя идут по очереди и читают уже зафиксированное.
+    Число учащихся меняется на разницу, если пользователь получил первый
+    курс или лишился последнего.
+    """
+    users = models.User.__table__
+    enrollment = models.user_course_association
+    courses = models.Course.__table__
+    ids = db.execute(
+        select(users.c.id).where(users.c.id.in_(user_ids)).order_by(users.c.id).with_for_update(key_share=True)
+    ).scalars().all()
+    if not ids:
+        return 0
+    current = {
+        row.user_id: (row.courses, row.hours)
+        for row in db.execute(select(user_hours).where(user_hours.c.user_id.in_(ids)).with_for_update())
+    }
+    actual = {
+        row.user_id: (row.courses, row.hours)
+        for row in db.execute(
+            select(enrollment.c.user_id, func.count().label("courses"), func.sum(courses.c.hours).label("hours"))
+            .join(courses, courses.c.id == enrollment.c.course_id)
+            .where(enrollment.c.user_id.in_(ids))
+            .group_by(enrollment.c.user_id)
+        )
+    }
+    changed = [
+        {"user_id": user_id, "courses": actual.get(user_id, (0, 0))[0], "hours": actual.get(user_id, (0, 0))[1]}
+        for user_id in ids
+        if current.get(user_id, (0, 0)) != actual.get(user_id, (0, 0))
+    ]
+    if not changed:
+        return 0
+    stmt = crud.insert_ignore(db, user_hours)
+    db.execute(stmt.values(changed).on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"courses": stmt.excluded.courses, "hours": stmt.excluded.hours},
+    ))
+    learner_deltas = Counter()
+    for row in changed:
+        before = current.get(row["user_id"], (0, 0))[0]
+        learner_deltas[shard_of(row["user_id"])] += (row["courses"] > 0) - (before > 0)
+    add_counters(db, learners, ["shard"], [
+        {"shard": shard, "learners": delta} for shard, delta in learner_deltas.items() if delta
+    ])
+    return len(changed)
+
+# Задачи воркера. Запрос записи на курс только ставит задачу после commit
+def enqueue_enrollments(pairs, sign):
+    """Вызывается после commit записи (sign=1) или выхода (sign=-1) по парам (user_id, course_id)"""
+    if not pairs:
+        return
+    enqueue(
+        "analytics.enrollments",
+        batch_id=uuid.uuid4().hex,
+        pairs=[[user_id, course_id] for user_id, course_id in pairs],
+        sign=sign,
+        day=datetime.utcnow().date().isoformat(),
+    )
+
+def enqueue_course_changes(changed):
+    """Курсы сменили часы или уровень (массовый импорт): пары (course_id, прежний уровень)"""
+    if changed:
+        enqueue(
+            "analytics.courses",
+            course_ids=[course_id for course_id, _ in changed],
+            old_levels=sorted({level for _, level in changed}),
+        )
+
+def apply_enrollments(db: Session, batch_id, pairs, sign, day):
+    """Учитывает пачку записей; возвращает False, если она уже учтена"""
+    day = date.fromisoformat(day)
+    applied = db.execute(
+        crud.insert_ignore(db, applied_batches)
+        .values(batch_id=batch_id, day=day)
+        .on_conflict_do_nothing()
+        .returning(applied_batches.c.batch_id)
+    ).first()
+    if applied is None:
+        db.rollback()
+        return False
+
+    user_ids = sorted({user_id for user_id, _ in pairs})
+    for start in range(0, len(user_ids), ANALYTICS_BATCH_SIZE):
+        sync_user_hours(db, user_ids[start:start + ANALYTICS_BATCH_SIZE])
+    courses = models.Course.__table__
+    level_of = dict(db.execute(
+        select(courses.c.id, courses.c.level).where(courses.c.id.in_({course_id for _, course_id in pairs}))
+    ).all())
+    # Удаленные с тех пор курсы пропускаются
+    level_deltas = Counter(
+        (level_of[course_id], shard_of(user_id)) for user_id, course_id in pairs if course_id in level_of
+    )
+    add_counters(db, levels, ["level", "shard"], [
+        {"level": level, "shard": shard, "enrollments": sign * n} for (level, shard), n in level_deltas.items()
+    ])
+
+    new_active = db.execute(
+        crud.insert_ignore(db, daily_learners)
+        .values([{"day": day, "user_id": user_id} for user_id in user_ids])
+        .on_conflict_do_nothing()
+        .returning(daily_learners.c.user_id)
+    ).scalars().all()
+    active = Counter(shard_of(user_id) for user_id in new_active)
+    per_shard = Counter(shard_of(user_id) for user_id, _ in pairs)
+    counter = "enrollments" if sign > 0 else "unenrollments"
+    add_counters(db, daily, ["day", "shard"], [
+        {"day": day, "shard": shard, "enrollments": 0, "unenrollments": 0, counter: n, "active_learners": active[shard]}
+        for shard, n in per_shard.items()
+    ])
+    db.commit()
+    return True
+
+def apply_course_changes(db: Session, course_ids, old_levels):
+    """Пересчитывает пользователей, записанных на курсы, и прежние и новые уровни курсов"""
+    enrollment = models.user_course_association
+    user_ids = db.execute(
+        select(enrollment.c.user_id).where(enrollment.c.course_id.in_(course_ids)).distinct().order_by(enrollment.c.user_id)
+    ).scalars().all()
+    fixed = 0
+    for start in range(0, len(user_ids), ANALYTICS_BATCH_SIZE):
+        fixed += sync_user_hours(db, user_ids[start:start + ANALYTICS_BATCH_SIZE])
+        db.commit()
+    courses = models.Course.__table__
+    current = db.execute(select(courses.c.level).where(courses.c.id.in_(course_ids)).distinct()).scalars().all()
+    refresh_levels(db, sorted(set(old_levels) | set(current)))
+    db.commit()
+    return fixed
+
+# Чтение для /stats
+def get_overview(db: Session):
+    today = get_activity(db, 1)
+    return {
+        "enrollments": db.execute(select(func.coalesce(func.sum(levels.c.enrollments), 0))).scalar(),
+        "learners": db.execute(select(func.coalesce(func.sum(learners.c.learners), 0))).scalar(),
+        "levels": get_level_stats(db),
+        "today": today[0] if today else None,
+    }
+
+def get_level_stats(db: Session):
+    total = func.sum(levels.c.enrollments).label("enrollments")
+    return [
+        {"level": level, "enrollments": enrollments}
+        for level, enrollments in db.execute(
+            select(levels.c.level, total).group_by(levels.c.level).order_by(total.desc(), levels.c.level)
+        )
+    ]
+
+def get_course_stats(db: Session, limit: int):
+    """Курсы с наибольшим числом записей (индекс ix_courses_enrolled_count_id)"""
+    courses = models.Course.__table__
+    rows = db.execute(
+        select(courses.c.id, courses.c.name, courses.c.level, courses.c.hours, courses.c.enrolled_count)
+        .order_by(courses.c.enrolled_count.desc(), courses.c.id)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in rows]
+
+def get_learner_stats(db: Session, limit: int):
+    """Пользователи с наибольшим числом часов обучения (ix_analytics_user_hours_hours)"""
+    users = models.User.__table__
+    rows = db.execute(
+        select(user_hours.c.user_id, users.c.name, user_hours.c.courses, user_hours.c.hours)
+        .join(users, users.c.id == user_hours.c.user_id)
+        .where(user_hours.c.hours > 0)
+        .order_by(user_hours.c.hours.desc(), user_hours.c.user_id)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in rows]
+
+def get_user_stats(db: Session, user_id: int):
+    row = db.execute(
+        select(user_hours.c.user_id, user_hours.c.courses, user_hours.c.hours).where(user_hours.c.user_id == user_id)
+    ).first()
+    return dict(row._mapping) if row else {"user_id": user_id, "courses": 0, "hours": 0}
+
+def get_activity(db: Session, days: int, until=None):
+    """По дню за последние days дней, новые первыми; дни без записей пропускаются"""
+    until = until or datetime.utcnow().date()
+    rows = db.execute(
+        select(
+            daily.c.day,
+            func.sum(daily.c.enrollments).label("enrollments"),
+            func.sum(daily.c.unenrollments).label("unenrollments"),
+            func.sum(daily.c.active_learners).label("active_learners"),
+        )
+        .where(daily.c.day > until - timedelta(days=days), daily.c.day <= until)
+        .group_by(daily.c.day)
+        .order_by(daily.c.day.desc())
+    )
+    return [dict(row._mapping) for row in rows]
+
+# Пересчет
+def refresh_user_hours(db: Session, batch_size: int = ANALYTICS_BATCH_SIZE):
+    """Пересчитывает курсы и часы всех пользователей пачками; возвращает число исправленных"""
+    users = models.User.__table__
+    fixed = 0
+    last_id = 0
+    while True:
+        ids = db.execute(
+            select(users.c.id).where(users.c.id > last_id).order_by(users.c.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        fixed += sync_user_hours(db, ids)
+        db.commit()
+        last_id = ids[-1]
+    return fixed
+
+def replace_sharded(db: Session, table, counter, rows, where=None):
+    """Записывает итоги в часть 0, остальные части обнуляет; строки уже заблокированы"""
+    reset = update(table).values({counter: 0})
+    db.execute(reset if where is None else reset.where(where))
+    if rows:
+        stmt = crud.insert_ignore(db, table)
+        db.execute(stmt.values([{**row, "shard": 0} for row in rows]).on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key.columns],
+            set_={counter: stmt.excluded[counter]},
+        ))
+
+def refresh_learners(db: Session):
+    """Число учащихся по analytics_user_hours; запускается после refresh_user_hours"""
+    db.execute(select(learners.c.shard).with_for_update()).all()
+    count = db.execute(select(func.count()).select_from(user_hours).where(user_hours.c.courses > 0)).scalar()
+    replace_sharded(db, learners, "learners", [{"learners": count}])
+    db.commit()
+    return count
+
+def refresh_levels(db: Session, only_levels=None):
+    """Записи по уровням из courses.enrolled_count (его сверяет app.reconcile).
+
+    only_levels - пересчитать только эти уровни (курсы сменили уровень при
+    импорте). Commit выполняет вызывающий.
+    """
+    courses = models.Course.__table__
+    locked = select(levels.c.level).with_for_update()
+    totals_query = select(courses.c.level, func.sum(courses.c.enrolled_count)).group_by(courses.c.level)
+    where = None
+    if only_levels is not None:
+        if not only_levels:
+            return {}
+        where = levels.c.level.in_(only_levels)
+        locked = locked.where(where)
+        totals_query = totals_query.where(courses.c.level.in_(only_levels))
+    db.execute(locked).all()
+    totals = dict(db.execute(totals_query).all())
+    replace_sharded(db, levels, "enrollments", [
+        {"level": level, "enrollments": n} for level, n in totals.items()
+    ], where)
+    return totals
+
+def prune_daily_learners(db: Session, today=None):
+    today = today or datetime.utcnow().date()
+    oldest = today - timedelta(days=ANALYTICS_LEARNERS_RETENTION_DAYS)
+    result = db.execute(delete(daily_learners).where(daily_learners.c.day < oldest))
+    # Повторы задач приходят в пределах минут - учтенные пачки хранятся столько же дней
+    db.execute(delete(applied_batches).where(applied_batches.c.day < oldest))
+    db.commit()
+    return result.rowcount
+
+# Действия журнала, из которых восстанавливается история: (записи, выходы)
+AUDIT_ENROLLMENT_ACTIONS = ("enrollment.added", "enrollment.removed", "enrollment.batch")
+
+def audit_counts(action, details):
+    if action == "enrollment.added":
+        return 1, 0
+    if action == "enrollment.removed":
+        return 0, 1
+    details = json.loads(details) if details else {}
+    return details.get("enrolled", 0), details.get("left", 0)
+
+def backfill_daily(db: Session, since: date, until: date):
+    """Пересобирает analytics_daily за дни [since, until) из audit_events.
+
+    Учитываются записи самих пользователей; пакетные изменения
+    администратора и импорт в журнале не разбиты по пользователям.
+    """
+    audit = models.AuditEvent.__table__
+    rows = db.execute(
+        select(audit.c.created_at, audit.c.user_id, audit.c.action, audit.c.details)
+        .where(
+            audit.c.action.in_(AUDIT_ENROLLMENT_ACTIONS),
+            audit.c.user_id.is_not(None),
+            audit.c.created_at >= datetime.combine(since, datetime.min.time()),
+            audit.c.created_at < datetime.combine(until, datetime.min.time()),
+        )
+        .execution_options(yield_per=10000)
+    )
+    totals = defaultdict(lambda: [0, 0, set()])
+    for created_at, user_id, action, details in rows:
+        enrolled, left = audit_counts(action, details)
+        if not enrolled and not left:
+            continue
+        day_totals = totals[(created_at.date(), shard_of(user_id))]
+        day_totals[0] += enrolled
+        day_totals[1] += left
+        day_totals[2].add(user_id)
+
+    db.execute(delete(daily).where(daily.c.day >= since, daily.c.day < until))
+    values = [
+        {"day": day, "shard": shard, "enrollments": enrolled, "unenrollments": left, "active_learners": len(active)}
+        for (day, shard), (enrolled, left, active) in sorted(totals.items())
+    ]
+    for start in range(0, len(values), ANALYTICS_BATCH_SIZE):
+        db.execute(daily.insert(), values[start:start + ANALYTICS_BATCH_SIZE])
+    db.commit()
+    return len({day for day, _ in totals})
+
+def refresh(db: Session):
+    start = time.perf_counter()
+    fixed = refresh_user_hours(db)
+    count = refresh_learners(db)
+    totals = refresh_levels(db)
+    db.commit()
+    pruned = prune_daily_learners(db)
+    print(
+        f"Analytics refreshed: {fixed} users fixed, {count} learners, {sum(totals.values())} enrollments, "
+        f"{pruned} old activity rows pruned in {time.perf_counter() - start:.1f}s"
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пересчет агрегатов аналитики")
+    parser.add_argument("command", choices=["refresh", "backfill"])
+    parser.add_argument("--since", type=date.fromisoformat, help="первый день истории (backfill)")
+    parser.add_argument("--until", type=date.fromisoformat, help="день после последнего; по умолчанию сегодня")
+    args = parser.parse_args(argv)
+
+    asyncio.run(wait_for_database())
+    db = SessionLocal()
+    try:
+        refresh(db)
+        if args.command == "backfill":
+            until = args.until or datetime.utcnow().date()
+            since = args.since or until - timedelta(days=ANALYTICS_MAX_DAYS)
+            start = time.perf_counter()
+            days = backfill_daily(db, since, until)
+            print(f"Analytics history rebuilt: {days} days from {since} to {until} in {time.perf_counter() - start:.1f}s")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,33 @@
-from fastapi import FastAPI
+"""Сервис авторизации: вход, регистрация и выпуск токенов.
+
+Хэширование argon2 и подпись токенов живут здесь и масштабируются отдельно
+от API. API проверяет токены сам по ключам из /.well-known/jwks.json
+(см. app.tokens).
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, hashing, metrics, schemas, tasks, tokens
+from .compression import CompressionMiddleware
+from .database import dispose_engines, get_async_db, run_crud, wait_for_database
+from .ratelimit import rate_limiter, retry_after_header
 
-app = FastAPI(title="Auth Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await wait_for_database()
+    # Ключ загружается до первого входа; без ключа сервис не запускается
+    await asyncio.to_thread(tokens.signing_keys)
+    yield
+    await dispose_engines()
+
+app = FastAPI(title="Auth Service", lifespan=lifespan)
+security = HTTPBearer()
 
 # CORS middleware
 app.add_middleware(
@@ -12,6 +38,131 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(CompressionMiddleware)
+metrics.install(app, "auth")
+
+@metrics.collector
+def collect_auth_metrics():
+    yield "argon2_pending", "gauge", "Hashing jobs queued or running", {}, hashing.pending()
+
+def credentials_exception(detail="Could not validate credentials"):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def hashing_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many authentication requests, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+async def enforce_rate_limit(route: str, request: Request, email: Optional[str] = None):
+    """Отклоняет запрос до обращения к БД и argon2, если исчерпан лимит"""
+    retry_after = await rate_limiter.check(route, request, email)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, try again later",
+            headers={"Retry-After": retry_after_header(retry_after)},
+        )
+
+async def login_response(user):
+    # Подпись RS256 на чистом Python занимает десятки мс - не в event loop
+    response = await asyncio.to_thread(tokens.issue_tokens, user)
+    response["user"] = schemas.User.from_orm(user)
+    return response
+
+# Авторизация. Хэширование argon2 выполняется в отдельном ограниченном пуле,
+# а не в общем threadpool, который обслуживает остальные эндпоинты.
+@app.post("/auth/login", response_model=schemas.LoginResponse)
+async def login(request: Request, user_data: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    await enforce_rate_limit("login", request, user_data.email)
+    user = await run_crud(db, crud.get_user_by_email, user_data.email)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password"
+        )
+
+    try:
+        is_valid, new_hash = await hashing.verify_password(user_data.password, user.password)
+    except hashing.HashingBusy:
+        raise hashing_busy_exception()
+    if not is_valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password"
+        )
+
+    # Параметры argon2 изменились - прозрачно пересчитываем хэш
+    if new_hash:
+        await run_crud(db, crud.set_password_hash, user.id, new_hash)
+
+    return await login_response(user)
+
+@app.post("/auth/register", response_model=schemas.LoginResponse)
+async def register(request: Request, user_data: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    await enforce_rate_limit("register", request, user_data.email)
+    # Проверка существования пользователя
+    db_user = await run_crud(db, crud.get_user_by_email, user_data.email)
+    if db_user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+
+    # Создание
+    try:
+        hashed_password = await hashing.hash_password(user_data.password)
+    except hashing.HashingBusy:
+        raise hashing_busy_exception()
+    user = await run_crud(db, crud.create_user_with_hash, user_data, hashed_password)
+    # Побочные эффекты регистрации выполняет воркер
+    await tasks.audit_async("user.registered", user.id)
+
+    return await login_response(user)
+
+@app.post("/auth/refresh", response_model=schemas.LoginResponse)
+async def refresh(request: Request, data: schemas.RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    """Обменивает токен обновления на новую пару токенов"""
+    await enforce_rate_limit("refresh", request)
+    stored = await asyncio.to_thread(tokens.refresh_tokens.consume, data.refresh_token)
+    if stored is None:
+        raise credentials_exception("Invalid refresh token")
+    user_id, token_version = stored
+    user = await run_crud(db, crud.get_user, user_id)
+    # После /auth/revoke токены обновления со старой версией не принимаются
+    if user is None or user.token_version != token_version:
+        raise credentials_exception("Invalid refresh token")
+    return await login_response(user)
+
+@app.post("/auth/logout")
+async def logout(data: schemas.RefreshRequest):
+    await asyncio.to_thread(tokens.refresh_tokens.consume, data.refresh_token)
+    return {"message": "Logged out"}
+
+@app.post("/auth/revoke")
+async def revoke_tokens(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Отзывает все токены пользователя, в том числе токены обновления"""
+    payload = await asyncio.to_thread(tokens.verify_access_token, credentials.credentials, tokens.local_key)
+    if payload is None or payload.get("uid") is None:
+        raise credentials_exception()
+    user = await run_crud(db, crud.get_user, payload["uid"])
+    if user is None or user.token_version != payload.get("ver"):
+        raise credentials_exception()
+    await run_crud(db, crud.revoke_user_tokens, user.id)
+    return {"message": "All tokens revoked"}
+
+@app.get("/.well-known/jwks.json")
+def jwks():
+    return tokens.signing_keys().jwks()
+
 # Health check endpoint
 @app.get("/health")
 def health_check():
@@ -19,4 +170,4 @@ def health_check():
 
 @app.get("/")
 def root():
-    return {"message": "Auth Service API"}
\ No newline at end of file
+    return {"message": "Auth Service API"}
@@ -1,68 +1,240 @@
+import json
 import os
-import time
+import shutil
 import subprocess
+import tempfile
+import time
+import zlib
 from datetime import datetime
+from urllib.parse import unquote, urlsplit, urlunsplit
 
-def create_backup():
-    """Создает резервную копию базы данных"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = f"/backups/backup_{timestamp}.sql"
-    
-    # Команда для создания бэкапа PostgreSQL
-    cmd = [
-        "pg_dump",
-        "-h", "db",
-        "-U", "user", 
-        "-d", "education_platform",
-        "-f", backup_file
-    ]
-    
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него используется gzip
+    zstandard = None
+
+# Конфигурация бэкапов
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/education_platform")
+BACKUP_DIR = os.getenv("BACKUP_DIR", "/backups")
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "120"))
+# custom - один файл, поток pg_dump сжимается на лету;
+# directory - параллельный дамп (BACKUP_JOBS), сжатие выполняет сам pg_dump
+BACKUP_FORMAT = os.getenv("BACKUP_FORMAT", "custom")
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip")  # gzip | zstd | none
+BACKUP_COMPRESSION_LEVEL = int(os.getenv("BACKUP_COMPRESSION_LEVEL", "6"))
+BACKUP_JOBS = int(os.getenv("BACKUP_JOBS", "2"))
+CHUNK_SIZE = 1024 * 1024
+
+# Политика хранения: последние N плюс по одному бэкапу на час/день/неделю
+KEEP_LAST = int(os.getenv("BACKUP_KEEP_LAST", "3"))
+KEEP_HOURLY = int(os.getenv("BACKUP_KEEP_HOURLY", "24"))
+KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", "7"))
+KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", "4"))
+
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+def manifest_path():
+    return os.path.join(BACKUP_DIR, "manifest.json")
+
+def load_manifest():
+    """Записи манифеста; пока его нет, в него один раз попадают старые бэкапы"""
     try:
-        # Запускаем команду с паролем в переменной окружения
-        env = {**os.environ, 'PGPASSWORD': 'password'}
-        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            print(f"Backup created successfully: {backup_file}")
-            
-            # Очистка старых бэкапов (оставляем последние 3)
-            cleanup_old_backups()
-        else:
-            print(f"Backup failed: {result.stderr}")
-            
-    except Exception as e:
-        print(f"Backup error: {e}")
+        with open(manifest_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return adopt_legacy_backups([])
+
+def save_manifest(entries):
+    """Атомарно перезаписывает манифест"""
+    tmp_path = manifest_path() + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp_path, manifest_path())
+
+def adopt_legacy_backups(entries):
+    """Добавляет в манифест бэкапы backup_*.sql, созданные до появления манифеста.
+
+    Иначе политика хранения их не видит и они никогда не удаляются.
+    """
+    known = {entry["name"] for entry in entries}
+    for name in sorted(os.listdir(BACKUP_DIR)):
+        if name in known or not (name.startswith("backup_") and name.endswith(".sql")):
+            continue
+        try:
+            created_at = datetime.strptime(name[len("backup_"):-len(".sql")], "%Y%m%d_%H%M%S")
+        except ValueError:
+            continue
+        entries.append({
+            "name": name,
+            "format": "plain",
+            "compression": "none",
+            "created_at": created_at.isoformat(timespec="seconds"),
+            "size_bytes": os.path.getsize(os.path.join(BACKUP_DIR, name)),
+        })
+    return entries
+
+def resolve_compression():
+    if BACKUP_COMPRESSION == "zstd" and zstandard is None:
+        print("zstandard is not installed, falling back to gzip")
+        return "gzip"
+    return BACKUP_COMPRESSION
+
+def pg_dump_connection():
+    """Адрес БД без пароля для аргументов pg_dump и окружение с PGPASSWORD.
 
-def cleanup_old_backups():
-    """Удаляет старые бэкапы, оставляя только 3 последних"""
+    Пароль в командной строке виден всем процессам узла (ps), переменная
+    окружения - нет.
+    """
+    parts = urlsplit(DATABASE_URL)
+    env = dict(os.environ)
+    if parts.password is not None:
+        env["PGPASSWORD"] = unquote(parts.password)
+        credentials, host = parts.netloc.rsplit("@", 1)
+        parts = parts._replace(netloc=f"{credentials.split(':', 1)[0]}@{host}")
+    return urlunsplit(parts), env
+
+def make_compressor(compression):
+    """Потоковый компрессор с методами compress()/flush()"""
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=BACKUP_COMPRESSION_LEVEL).compressobj()
+    if compression == "gzip":
+        # wbits=31 - формат gzip, совместимый с gunzip
+        return zlib.compressobj(BACKUP_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    return None
+
+def dump_custom(path, compression):
+    """pg_dump -Fc в stdout, поток сжимается и пишется в файл без промежуточного .sql"""
+    dbname, env = pg_dump_connection()
+    cmd = ["pg_dump", "--format=custom", "--compress=0", f"--dbname={dbname}"]
+    compressor = make_compressor(compression)
+    tmp_path = path + ".part"
+    # stderr пишется во временный файл, чтобы заполненный pipe не блокировал pg_dump
+    try:
+        with tempfile.TemporaryFile() as errors, open(tmp_path, "wb") as out:
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors, env=env) as proc:
+                for chunk in iter(lambda: proc.stdout.read(CHUNK_SIZE), b""):
+                    out.write(compressor.compress(chunk) if compressor else chunk)
+                if compressor:
+                    out.write(compressor.flush())
+            errors.seek(0)
+            stderr = errors.read().decode(errors="replace")
+        if proc.returncode != 0:
+            raise RuntimeError(stderr.strip() or f"pg_dump exited with {proc.returncode}")
+        os.replace(tmp_path, path)
+    finally:
+        # Недописанный файл не остается ни при ошибке pg_dump, ни при ошибке запуска
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.getsize(path)
+
+def dump_directory(path, compression):
+    """pg_dump -Fd с параллельными процессами, каждая таблица сжимается отдельно"""
+    dbname, env = pg_dump_connection()
+    cmd = ["pg_dump", "--format=directory", f"--jobs={BACKUP_JOBS}", f"--file={path}", f"--dbname={dbname}"]
+    if compression == "zstd":
+        cmd.append(f"--compress=zstd:{BACKUP_COMPRESSION_LEVEL}")  # требуется pg_dump 16+
+    elif compression == "gzip":
+        cmd.append(f"--compress={BACKUP_COMPRESSION_LEVEL}")
+    else:
+        cmd.append("--compress=0")
+    result = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        shutil.rmtree(path, ignore_errors=True)
+        raise RuntimeError(result.stderr.strip() or f"pg_dump exited with {result.returncode}")
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+def create_backup():
+    """Создает резервную копию базы данных и записывает ее в манифест"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    started_at = datetime.now()
+    timestamp = started_at.strftime("%Y%m%d_%H%M%S")
+    compression = resolve_compression()
+
+    if BACKUP_FORMAT == "directory":
+        name = f"backup_{timestamp}.dir"
+        dump = dump_directory
+    else:
+        name = f"backup_{timestamp}.dump{EXTENSIONS[compression]}"
+        dump = dump_custom
+    path = os.path.join(BACKUP_DIR, name)
+
+    start = time.perf_counter()
     try:
-        if os.path.exists("/backups"):
-            backups = []
-            for filename in os.listdir("/backups"):
-                if filename.startswith("backup_") and filename.endswith(".sql"):
-                    filepath = os.path.join("/backups", filename)
-                    backups.append((filepath, os.path.getctime(filepath)))
-            
-            # Сортируем по дате создания (новые в конце)
-            backups.sort(key=lambda x: x[1])
-            
-            # Удаляем все кроме 3 последних
-            if len(backups) > 3:
-                for i in range(len(backups) - 3):
-                    old_backup = backups[i][0]
-                    os.remove(old_backup)
-                    print(f"Removed old backup: {os.path.basename(old_backup)}")
-                    
+        size = dump(path, compression)
     except Exception as e:
-        print(f"Cleanup error: {e}")
+        print(f"Backup failed: {e}")
+        return None
+    duration = time.perf_counter() - start
+
+    entry = {
+        "name": name,
+        "format": BACKUP_FORMAT,
+        "compression": compression,
+        "created_at": started_at.isoformat(timespec="seconds"),
+        "size_bytes": size,
+        "duration_seconds": round(duration, 3),
+        "throughput_bytes_per_second": round(size / duration) if duration else None,
+    }
+    manifest = load_manifest()
+    manifest.append(entry)
+    save_manifest(apply_retention(manifest))
+    print(f"Backup created successfully: {name} ({size} bytes in {duration:.1f}s)")
+    return entry
+
+def select_kept(entries):
+    """Имена бэкапов, которые нужно сохранить по политике хранения"""
+    ordered = sorted(entries, key=lambda e: e["created_at"], reverse=True)
+    kept = {entry["name"] for entry in ordered[:KEEP_LAST]}
+
+    tiers = [
+        (KEEP_HOURLY, lambda dt: dt.strftime("%Y%m%d%H")),
+        (KEEP_DAILY, lambda dt: dt.strftime("%Y%m%d")),
+        (KEEP_WEEKLY, lambda dt: dt.strftime("%G%V")),
+    ]
+    for limit, bucket_of in tiers:
+        buckets = set()
+        for entry in ordered:
+            bucket = bucket_of(datetime.fromisoformat(entry["created_at"]))
+            if bucket in buckets:
+                continue
+            if len(buckets) >= limit:
+                break
+            # Самый новый бэкап каждого периода
+            buckets.add(bucket)
+            kept.add(entry["name"])
+    return kept
+
+def apply_retention(entries):
+    """Удаляет бэкапы вне политики хранения и возвращает оставшиеся записи"""
+    kept = select_kept(entries)
+    remaining = []
+    for entry in entries:
+        if entry["name"] in kept:
+            remaining.append(entry)
+            continue
+        path = os.path.join(BACKUP_DIR, entry["name"])
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            print(f"Removed old backup: {entry['name']}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Cleanup error: {e}")
+            remaining.append(entry)
+    return remaining
 
 if __name__ == "__main__":
     print("Backup service started")
-    print("Will create backups every 2 minutes for demonstration")
-    
-    backup_interval = 120
-    
+    print(f"Format: {BACKUP_FORMAT}, compression: {BACKUP_COMPRESSION}, interval: {BACKUP_INTERVAL}s")
+
     while True:
         create_backup()
-        print(f"Next backup in {backup_interval // 60} minutes...")
-        time.sleep(backup_interval)
\ No newline at end of file
+        print(f"Next backup in {BACKUP_INTERVAL}s...")
+        time.sleep(BACKUP_INTERVAL)
@@ -0,0 +1,415 @@
+"""Массовый импорт пользователей, курсов и записей на курсы из CSV/NDJSON.
+
+    python -m app.bulk_import users students.csv
+    python -m app.bulk_import enrollments enrollments.ndjson --batch-size 10000
+    python -m app.bulk_import --resume <id>
+
+Файл читается потоково пачками по IMPORT_BATCH_SIZE строк. Пароли новых
+пользователей хэшируются параллельно в пуле процессов; пачка загружается во
+временную таблицу (в Postgres - командой COPY) и переносится в основные
+таблицы несколькими INSERT ... SELECT / UPDATE ... FROM. Каждая пачка
+вместе с отметкой прогресса в import_runs фиксируется одной транзакцией,
+поэтому прерванный импорт продолжается со следующей пачки, а повтор пачки
+ничего не дублирует.
+
+Поля строк:
+    users        email, name, password или password_hash (argon2)
+    courses      name, description, hours, level
+    enrollments  email, course_id или course (название курса)
+
+Существующие пользователи получают новое имя, пароль не меняется; курсы
+сопоставляются по названию. Одновременно выполняется один импорт: остальные
+ждут advisory lock в статусе queued.
+
+Импорты, загруженные через API, выполняет воркер фоновых задач (задача
+"import" в app.tasks), а не процесс API: файл лежит в IMPORT_DIR на общем
+томе, поэтому импорт продолжается на любом поде и после перезапуска.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import math
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, exists, func, insert, or_, select, text, update
+from sqlalchemy.orm import Session
+
+from . import analytics, events, models
+from .cache import catalog_cache
+from .crud import apply_enrolled_deltas, insert_ignore
+from .database import SessionLocal, get_engine, mark_recent_write, wait_for_database
+from .etags import bump_enrollment_versions
+from .hashing import _hash, pwd_context
+from .principal import principal_cache
+from .server import available_cpus
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# По умолчанию - по квоте CPU контейнера, а не по числу ядер узла
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", "0")) or max(1, math.ceil(available_cpus()))
+# Файлы, загруженные через POST /admin/imports/{kind}; том, общий для API и воркеров
+IMPORT_DIR = os.getenv("IMPORT_DIR", "/imports")
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(512 * 1024 * 1024)))
+IMPORT_LOCK_ID = 7310002
+
+KINDS = ("users", "courses", "enrollments")
+FORMATS = ("csv", "ndjson")
+
+# Временные таблицы живут в соединении импорта; в Postgres очищаются при коммите
+staging = MetaData()
+users_staging = Table(
+    "import_users", staging,
+    Column("email", String), Column("name", String), Column("password", String),
+    prefixes=["TEMPORARY"], postgresql_on_commit="DELETE ROWS",
+)
+courses_staging = Table(
+    "import_courses", staging,
+    Column("name", String), Column("description", String), Column("hours", Integer), Column("level", String),
+    prefixes=["TEMPORARY"], postgresql_on_commit="DELETE ROWS",
+)
+enrollments_staging = Table(
+    "import_enrollments", staging,
+    Column("email", String), Column("course_id", Integer), Column("course_name", String),
+    prefixes=["TEMPORARY"], postgresql_on_commit="DELETE ROWS",
+)
+
+def detect_format(path):
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+def read_records(path, fmt):
+    """Словари строк файла; битая строка NDJSON дает None"""
+    if fmt == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield record if isinstance(record, dict) else None
+
+def _text(record, field):
+    value = record.get(field)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+def parse_user(record):
+    email, name = _text(record, "email"), _text(record, "name")
+    password, password_hash = _text(record, "password"), _text(record, "password_hash")
+    if not email or "@" not in email or not name:
+        raise ValueError("email and name are required")
+    if password_hash and not pwd_context.identify(password_hash):
+        raise ValueError("unsupported password_hash")
+    if not password and not password_hash:
+        raise ValueError("password or password_hash is required")
+    return email, name, password, password_hash
+
+def parse_course(record):
+    name, level = _text(record, "name"), _text(record, "level")
+    hours = int(_text(record, "hours") or "")
+    if not name or not level or hours < 0:
+        raise ValueError("name, level and hours are required")
+    return name, _text(record, "description"), hours, level
+
+def parse_enrollment(record):
+    email, course_name = _text(record, "email"), _text(record, "course")
+    course_id = _text(record, "course_id")
+    if not email or not (course_id or course_name):
+        raise ValueError("email and course_id or course are required")
+    return email, int(course_id) if course_id else None, None if course_id else course_name
+
+PARSERS = {"users": parse_user, "courses": parse_course, "enrollments": parse_enrollment}
+
+def parse_batch(kind, records):
+    """Проверенные строки без повторов (побеждает последняя) и число пропущенных"""
+    parser = PARSERS[kind]
+    rows = {}
+    skipped = 0
+    for record in records:
+        try:
+            row = parser(record)
+        except (AttributeError, TypeError, ValueError):
+            skipped += 1
+            continue
+        # Ключ: email пользователя, название курса, пара для записи
+        rows[row if kind == "enrollments" else row[0]] = row
+    return list(rows.values()), skipped
+
+def load_staging(db: Session, table, rows):
+    """Заливает пачку во временную таблицу: COPY в Postgres, executemany иначе"""
+    db.execute(delete(table))
+    if not rows:
+        return
+    conn = db.connection()
+    if conn.dialect.driver == "psycopg2":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        columns = ", ".join(column.name for column in table.columns)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            # У временных таблиц нет статистики, без нее планировщик ошибается в соединениях
+            cursor.execute(f"ANALYZE {table.name}")
+        finally:
+            cursor.close()
+    else:
+        columns = [column.name for column in table.columns]
+        db.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+def merge_users(db: Session, rows, pool):
+    """Хэширует пароли только новых пользователей; возвращает id обновленных"""
+    users = models.User.__table__
+    emails = [row[0] for row in rows]
+    existing = set(db.execute(select(users.c.email).where(users.c.email.in_(emails))).scalars())
+    to_hash = [row for row in rows if row[0] not in existing and not row[3]]
+    chunksize = max(1, len(to_hash) // (IMPORT_HASH_WORKERS * 4))
+    hashed = dict(zip(
+        (row[0] for row in to_hash),
+        pool.map(_hash, [row[2] for row in to_hash], chunksize=chunksize),
+    ))
+    load_staging(db, users_staging, [
+        (email, name, None if email in existing else password_hash or hashed[email])
+        for email, name, _, password_hash in rows
+    ])
+    s = users_staging
+    updated = db.execute(
+        update(users)
+        .where(users.c.email == s.c.email, users.c.name != s.c.name)
+        .values(name=s.c.name)
+        .returning(users.c.id)
+    ).scalars().all()
+    db.execute(
+        insert_ignore(db, users)
+        .from_select(["email", "name", "password"], select(s.c.email, s.c.name, s.c.password).where(s.c.password.is_not(None)))
+        # Параллельная регистрация с тем же email побеждает
+        .on_conflict_do_nothing(index_elements=["email"])
+    )
+    return updated
+
+def merge_courses(db: Session, rows):
+    """Обновляет курсы с тем же названием и добавляет новые.
+
+    Возвращает (изменился ли каталог, пары (id, прежний уровень) курсов со
+    сменой часов или уровня) - по ним после commit пересчитывается аналитика.
+    """
+    courses = models.Course.__table__
+    load_staging(db, courses_staging, rows)
+    s = courses_staging
+    regrouped = db.execute(
+        select(courses.c.id, courses.c.level)
+        .where(courses.c.name == s.c.name, or_(courses.c.hours != s.c.hours, courses.c.level != s.c.level))
+        .distinct()
+    ).all()
+    updated = db.execute(
+        update(courses)
+        .where(
+            courses.c.name == s.c.name,
+            or_(
+                courses.c.description.is_distinct_from(s.c.description),
+                courses.c.hours != s.c.hours,
+                courses.c.level != s.c.level,
+            ),
+        )
+        .values(description=s.c.description, hours=s.c.hours, level=s.c.level)
+    )
+    inserted = db.execute(
+        insert(courses).from_select(
+            ["name", "description", "hours", "level"],
+            select(s.c.name, s.c.description, s.c.hours, s.c.level)
+            .where(~exists().where(courses.c.name == s.c.name)),
+        )
+    )
+    return bool(updated.rowcount or inserted.rowcount), regrouped
+
+def merge_enrollments(db: Session, rows):
+    """Добавляет записи, которых еще нет; возвращает новые пары (user_id, course_id)"""
+    users = models.User.__table__
+    courses = models.Course.__table__
+    enrollment = models.user_course_association
+    load_staging(db, enrollments_staging, rows)
+    s = enrollments_staging
+    db.execute(
+        update(s)
+        .where(s.c.course_id.is_(None))
+        .values(course_id=select(func.min(courses.c.id)).where(courses.c.name == s.c.course_name).scalar_subquery())
+    )
+    pairs = (
+        select(users.c.id, courses.c.id)
+        .select_from(s)
+        .join(users, users.c.email == s.c.email)
+        .join(courses, courses.c.id == s.c.course_id)
+        .where(s.c.course_id.is_not(None))
+    )
+    inserted = db.execute(
+        insert_ignore(db, enrollment)
+        .from_select(["user_id", "course_id"], pairs)
+        .on_conflict_do_nothing()
+        .returning(enrollment.c.user_id, enrollment.c.course_id)
+    ).all()
+    apply_enrolled_deltas(db, [course_id for _, course_id in inserted], 1)
+    return inserted
+
+def create_run(db: Session, kind, source, fmt=None, batch_size=IMPORT_BATCH_SIZE):
+    if kind not in KINDS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    fmt = fmt or detect_format(source)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown import format: {fmt}")
+    run = models.ImportRun(
+        id=uuid.uuid4().hex, kind=kind, source=source, format=fmt,
+        batch_size=batch_size, status="queued",
+    )
+    db.add(run)
+    db.commit()
+    db.refresh(run)
+    return run
+
+def set_status(db: Session, run_id, status, error=None):
+    runs = models.ImportRun.__table__
+    db.execute(update(runs).where(runs.c.id == run_id).values(status=status, error=error, updated_at=func.now()))
+    db.commit()
+
+def run_import(run_id):
+    """Выполняет или продолжает импорт; возвращает итоговую запись import_runs"""
+    # Одно соединение на весь импорт: в нем живут временные таблицы и блокировка
+    with get_engine().connect() as conn:
+        db = Session(bind=conn)
+        postgres = conn.dialect.name == "postgresql"
+        try:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": IMPORT_LOCK_ID})
+                conn.commit()
+            try:
+                staging.create_all(conn)
+                conn.commit()
+                import_batches(db, run_id)
+            except Exception as e:
+                db.rollback()
+                set_status(db, run_id, "failed", f"{type(e).__name__}: {e}")
+                raise
+            finally:
+                if postgres:
+                    conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": IMPORT_LOCK_ID})
+                    conn.commit()
+            return db.get(models.ImportRun, run_id)
+        finally:
+            db.close()
+
+def run_uploaded_import(run_id):
+    """Импорт из задачи воркера; загруженный через API файл удаляется после успеха"""
+    run = run_import(run_id)
+    if os.path.dirname(run.source) == os.path.abspath(IMPORT_DIR) and os.path.exists(run.source):
+        os.remove(run.source)
+    return run
+
+def import_batches(db: Session, run_id):
+    runs = models.ImportRun.__table__
+    run = db.get(models.ImportRun, run_id)
+    if run is None:
+        raise ValueError(f"Unknown import: {run_id}")
+    if run.status == "completed":
+        return
+    kind, batch_size, batch_no = run.kind, run.batch_size, run.batches_done
+    rows_done, rows_skipped = run.rows_done, run.rows_skipped
+    set_status(db, run_id, "running")
+
+    records = read_records(run.source, run.format)
+    # Пачки, зафиксированные до остановки, пропускаются без разбора
+    for _ in islice(records, batch_no * batch_size):
+        pass
+    if batch_no:
+        print(f"Import {run_id}: resuming after batch {batch_no} ({rows_done} rows)")
+
+    pool = None
+    if kind == "users":
+        # spawn: в процессе воркера работают потоки (heartbeat задач)
+        pool = ProcessPoolExecutor(IMPORT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    start = time.perf_counter()
+    imported = 0
+    try:
+        while True:
+            records_batch = list(islice(records, batch_size))
+            if not records_batch:
+                break
+            batch_start = time.perf_counter()
+            rows, skipped = parse_batch(kind, records_batch)
+            changed_users, catalog_changed, regrouped, enrolled = [], False, [], []
+            if kind == "users":
+                changed_users = merge_users(db, rows, pool)
+            elif kind == "courses":
+                catalog_changed, regrouped = merge_courses(db, rows)
+            else:
+                enrolled = merge_enrollments(db, rows)
+
+            batch_no += 1
+            rows_done += len(records_batch)
+            rows_skipped += skipped
+            db.execute(
+                update(runs).where(runs.c.id == run_id)
+                .values(batches_done=batch_no, rows_done=rows_done, rows_skipped=rows_skipped, updated_at=func.now())
+            )
+            db.commit()
+
+            enrolled_users = [user_id for user_id, _ in enrolled]
+            mark_recent_write(changed_users + enrolled_users)
+            for user_id in changed_users:
+                principal_cache.invalidate(user_id)
+            if catalog_changed:
+                catalog_cache.invalidate()
+                # Пачка может менять тысячи курсов: клиенты перечитывают каталог целиком
+                events.publish("catalog.changed", {})
+            bump_enrollment_versions(enrolled_users)
+            events.publish_enrollments(enrolled, "added")
+            analytics.enqueue_enrollments(enrolled, 1)
+            analytics.enqueue_course_changes(regrouped)
+
+            imported += len(records_batch)
+            elapsed = time.perf_counter() - start
+            print(
+                f"Import {run_id}: batch {batch_no}, {rows_done} rows ({rows_skipped} skipped), "
+                f"{len(records_batch) / (time.perf_counter() - batch_start):.0f} rows/s, "
+                f"{imported / elapsed:.0f} rows/s overall"
+            )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    set_status(db, run_id, "completed")
+    print(f"Import {run_id}: completed, {rows_done} rows ({rows_skipped} skipped)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import from CSV/NDJSON")
+    parser.add_argument("kind", nargs="?", choices=KINDS)
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--resume", metavar="IMPORT_ID", help="продолжить прерванный импорт")
+    args = parser.parse_args()
+
+    asyncio.run(wait_for_database())
+    run_id = args.resume
+    if run_id is None:
+        if not args.kind or not args.path:
+            parser.error("kind and path are required unless --resume is given")
+        db = SessionLocal()
+        try:
+            run_id = create_run(db, args.kind, os.path.abspath(args.path), args.format, args.batch_size).id
+        finally:
+            db.close()
+        print(f"Import {run_id} created; resume with --resume {run_id}")
+    run_import(run_id)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from .redis_client import get_redis, mark_redis_down
+
+# Конфигурация кэша каталога
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "300"))
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "256"))
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш в памяти процесса с TTL на запись"""
+
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class CatalogCache:
+    """Read-through кэш каталога курсов.
+
+    Ключи данных содержат номер версии каталога, поэтому инвалидация —
+    это просто увеличение версии: старые записи больше не читаются и
+    истекают по TTL. Основное хранилище — Redis, при его недоступности
+    используется LRU в памяти процесса. Инвалидация во время недоступности
+    Redis запоминается и применяется к версии в Redis, как только он
+    вернется, иначе Redis отдавал бы старую версию до истечения TTL.
+    """
+
+    VERSION_KEY = "catalog:version"
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL, maxsize=LOCAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.local = LRUCache(maxsize)
+        self.local_version = 0
+        self.hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+        self._pending_invalidation = False
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _version(self, client):
+        if client is None:
+            return f"l{self.local_version}"
+        self.apply_pending_invalidation(client)
+        return (client.get(self.VERSION_KEY) or b"0").decode()
+
+    def apply_pending_invalidation(self, client):
+        """Увеличивает версию в Redis, если инвалидация пришлась на его недоступность"""
+        if self._pending_invalidation:
+            client.incr(self.VERSION_KEY)
+            self._pending_invalidation = False
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Возвращает значение из кэша или вызывает loader() и кэширует результат"""
+        ttl = ttl or self.ttl
+        client = get_redis()
+        if client is not None:
+            try:
+                full_key = f"catalog:v{self._version(client)}:{key}"
+                cached = client.get(full_key)
+            except redis.RedisError:
+                self._count("redis_errors")
+                mark_redis_down()
+            else:
+                if cached is not None:
+                    self._count("hits")
+                    return json.loads(cached)
+                self._count("misses")
+                value = loader()
+                try:
+                    client.set(full_key, json.dumps(value), ex=ttl)
+                except redis.RedisError:
+                    self._count("redis_errors")
+                    mark_redis_down()
+                return value
+
+        full_key = f"catalog:v{self._version(None)}:{key}"
+        cached = self.local.get(full_key)
+        if cached is not None:
+            self._count("hits")
+            return cached
+        self._count("misses")
+        value = loader()
+        self.local.set(full_key, value, ttl)
+        return value
+
+    def invalidate(self):
+        """Инвалидирует весь каталог увеличением номера версии"""
+        with self._lock:
+            self.local_version += 1
+        self.local.clear()
+        client = get_redis()
+        if client is not None:
+            try:
+                client.incr(self.VERSION_KEY)
+                self._pending_invalidation = False
+                return
+            except redis.RedisError:
+                self._count("redis_errors")
+                mark_redis_down()
+        self._pending_invalidation = True
+
+    def stats(self):
+        return {
+            "backend": "redis" if get_redis() is not None else "local",
+            "hits": self.hits,
+            "misses": self.misses,
+            "redis_errors": self.redis_errors,
+            "local_entries": len(self.local),
+        }
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,137 @@
+"""Сжатие ответов с выбором кодировки по Accept-Encoding.
+
+Поддерживаются zstd, br и gzip (zstd и brotli - если установлены пакеты).
+Сжимаются только целые (не потоковые) ответы текстовых типов не меньше
+COMPRESSION_MIN_SIZE байт. Ответы с ETag сжимаются один раз: результат
+хранится в LRU по (хэш тела, кодировка), поэтому горячий каталог не
+пережимается на каждый запрос. Ключ - хэш самого тела, а не ETag: ETag
+личных ответов разных пользователей могут совпасть, а тело чужого ответа
+отдавать нельзя.
+"""
+import gzip
+import hashlib
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+COMPRESSION_CACHE_SIZE = int(os.getenv("COMPRESSION_CACHE_SIZE", "256"))
+COMPRESSION_CACHE_TTL = int(os.getenv("COMPRESSION_CACHE_TTL", "3600"))
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml")
+
+def _compressors():
+    compressors = {"gzip": lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        compressors["br"] = lambda body: brotli.compress(body, quality=BROTLI_LEVEL)
+    if zstandard is not None:
+        zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        compressors["zstd"] = zstd.compress
+    return compressors
+
+COMPRESSORS = _compressors()
+# Порядок предпочтения при одинаковом q
+PREFERENCE = ("zstd", "br", "gzip")
+
+def negotiate(accept_encoding):
+    """Выбирает кодировку из Accept-Encoding или None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for name in PREFERENCE:
+        if name not in COMPRESSORS:
+            continue
+        quality = weights.get(name, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+def is_compressible(headers, body):
+    if "content-encoding" in headers or len(body) < COMPRESSION_MIN_SIZE:
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+class CompressionMiddleware:
+    def __init__(self, app, cache_size=COMPRESSION_CACHE_SIZE):
+        self.app = app
+        self.cache = LRUCache(cache_size)
+
+    def compress(self, body, encoding, etag):
+        if etag is None:
+            return COMPRESSORS[encoding](body)
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = COMPRESSORS[encoding](body)
+            self.cache.set(key, compressed, COMPRESSION_CACHE_TTL)
+        return compressed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            # Первый фрагмент тела: решаем, сжимать ли ответ
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body", False) or not is_compressible(headers, body):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            etag = headers.get("etag")
+            compressed = self.compress(body, encoding, etag)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            if etag and not etag.startswith("W/"):
+                # Сжатое представление отличается побайтно - ETag становится слабым
+                headers["ETag"] = "W/" + etag
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,9 +1,15 @@
+import base64
+import json
+import re
+from collections import Counter
+from sqlalchemy import and_, bindparam, case, delete, func, literal_column, or_, select, true, update
 from sqlalchemy.orm import Session
-from . import models, schemas
-from passlib.context import CryptContext
-
-# Password hashing - используем argon2 вместо bcrypt
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+from . import analytics, events, models, schemas
+from .cache import catalog_cache
+from .database import mark_recent_write
+from .principal import principal_cache
+from .etags import ENROLLED_COUNT_MAX_AGE, bump_enrollment_versions, enrollment_version
+from .hashing import pwd_context
 
 def get_password_hash(password):
     return pwd_context.hash(password)
@@ -12,11 +18,16 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 # User operations
+def get_user(db: Session, user_id: int):
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+    return create_user_with_hash(db, user, get_password_hash(user.password))
+
+def create_user_with_hash(db: Session, user: schemas.UserCreate, hashed_password: str):
     db_user = models.User(
         email=user.email,
         password=hashed_password,
@@ -25,6 +36,8 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    # Токен нового пользователя проверяется по реплике, которая могла еще не получить запись
+    mark_recent_write([db_user.id])
     return db_user
 
 def update_user(db: Session, user_id: int, user_update: schemas.UserCreate):
@@ -36,11 +49,55 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserCreate):
             db_user.password = get_password_hash(user_update.password)
         db.commit()
         db.refresh(db_user)
+        mark_recent_write([user_id])
+        principal_cache.invalidate(user_id)
     return db_user
 
+def set_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update({models.User.password: hashed_password})
+    db.commit()
+
+def revoke_user_tokens(db: Session, user_id: int):
+    """Отзывает все выданные пользователю токены увеличением token_version"""
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.token_version: models.User.token_version + 1}
+    )
+    db.commit()
+    mark_recent_write([user_id])
+    principal_cache.invalidate(user_id)
+
 # Course operations
-def get_courses(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Course).offset(skip).limit(limit).all()
+def encode_cursor(value: int, field: str = "id"):
+    """Непрозрачный курсор: id последнего курса (keyset) или смещение (поиск)"""
+    return base64.urlsafe_b64encode(json.dumps({field: value}).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, field: str = "id"):
+    """Возвращает значение курсора; ValueError для битого курсора"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value = int(json.loads(base64.urlsafe_b64decode(padded.encode()))[field])
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if value < 0:
+        raise ValueError("Invalid cursor")
+    return value
+
+def filter_courses(query, after_id=None, level=None, min_hours=None, max_hours=None):
+    """Фильтры каталога и условие keyset-пагинации (id > after_id)"""
+    if after_id is not None:
+        query = query.filter(models.Course.id > after_id)
+    if level is not None:
+        query = query.filter(models.Course.level == level)
+    if min_hours is not None:
+        query = query.filter(models.Course.hours >= min_hours)
+    if max_hours is not None:
+        query = query.filter(models.Course.hours <= max_hours)
+    return query
+
+def get_courses(db: Session, after_id: int = None, limit: int = 100, level: str = None,
+                min_hours: int = None, max_hours: int = None):
+    query = filter_courses(db.query(models.Course), after_id, level, min_hours, max_hours)
+    return query.order_by(models.Course.id).limit(limit).all()
 
 def get_course(db: Session, course_id: int):
     return db.query(models.Course).filter(models.Course.id == course_id).first()
@@ -50,33 +107,300 @@ def create_course(db: Session, course: schemas.CourseCreate):
     db.add(db_course)
     db.commit()
     db.refresh(db_course)
+    catalog_cache.invalidate()
+    events.publish("course.created", schemas.Course.from_orm(db_course).dict())
     return db_course
 
+# Кэшированный каталог (словари, готовые к сериализации)
+def get_cached_courses(db: Session, after_id: int = None, limit: int = 100, level: str = None,
+                       min_hours: int = None, max_hours: int = None):
+    return catalog_cache.get_or_load(
+        f"courses:{after_id}:{limit}:{level}:{min_hours}:{max_hours}",
+        lambda: [
+            schemas.Course.from_orm(course).dict()
+            for course in get_courses(db, after_id, limit, level, min_hours, max_hours)
+        ],
+        # Страницы содержат счетчики записей, которые меняются без смены версии каталога
+        ttl=ENROLLED_COUNT_MAX_AGE,
+    )
+
+def get_enrolled_course_ids(db: Session, user_id: int):
+    """id курсов пользователя (по первичному ключу user_courses)"""
+    enrollment = models.user_course_association
+    return [row.course_id for row in db.query(enrollment.c.course_id).filter(enrollment.c.user_id == user_id)]
+
+def get_cached_courses_with_enrollment(db: Session, user_id: int, after_id: int = None, limit: int = 100,
+                                       level: str = None, min_hours: int = None, max_hours: int = None):
+    """Страница каталога с флагом is_enrolled для пользователя.
+
+    Общая часть страницы одинакова для всех и берется из кэша каталога,
+    флаг - из списка курсов пользователя, закэшированного под версией его
+    записей. Без Redis версии нет и общий кэш мог бы отдать устаревший
+    список - тогда страница и флаг читаются одним запросом с LEFT JOIN.
+    """
+    version = enrollment_version(user_id)
+    if version is None:
+        return [
+            dict(row._mapping)
+            for row in get_courses_with_enrollment(db, user_id, after_id, limit, level, min_hours, max_hours)
+        ]
+    courses = get_cached_courses(db, after_id, limit, level, min_hours, max_hours)
+    enrolled = set(catalog_cache.get_or_load(
+        f"enrolled:{user_id}:{version}", lambda: get_enrolled_course_ids(db, user_id)
+    ))
+    return [{**course, "is_enrolled": course["id"] in enrolled} for course in courses]
+
+def get_courses_with_enrollment(db: Session, user_id: int, after_id: int = None, limit: int = 100,
+                                level: str = None, min_hours: int = None, max_hours: int = None):
+    """Курсы с флагом is_enrolled для пользователя одним запросом (LEFT JOIN)"""
+    enrollment = models.user_course_association
+    query = (
+        db.query(
+            models.Course.id,
+            models.Course.name,
+            models.Course.description,
+            models.Course.hours,
+            models.Course.level,
+            models.Course.enrolled_count,
+            case((enrollment.c.user_id.isnot(None), True), else_=False).label("is_enrolled"),
+        )
+        .outerjoin(
+            enrollment,
+            and_(enrollment.c.course_id == models.Course.id, enrollment.c.user_id == user_id),
+        )
+    )
+    query = filter_courses(query, after_id, level, min_hours, max_hours)
+    return query.order_by(models.Course.id).limit(limit).all()
+
+def get_popular_courses(db: Session, limit: int = 10):
+    """Курсы с наибольшим числом записей (индекс ix_courses_enrolled_count_id)"""
+    return catalog_cache.get_or_load(
+        f"popular:{limit}",
+        lambda: [
+            schemas.Course.from_orm(course).dict()
+            for course in db.query(models.Course)
+            .order_by(models.Course.enrolled_count.desc(), models.Course.id)
+            .limit(limit)
+        ],
+        ttl=ENROLLED_COUNT_MAX_AGE,
+    )
+
+# Полнотекстовый поиск
+SEARCH_CONFIG = "russian"
+SEARCH_MAX_TERMS = 8
+
+def search_terms(q: str):
+    """Слова запроса без операторов tsquery и символов LIKE"""
+    return re.findall(r"\w+", q.lower())[:SEARCH_MAX_TERMS]
+
+def search_courses(db: Session, user_id: int, q: str, offset: int = 0, limit: int = 20,
+                   level: str = None, min_hours: int = None, max_hours: int = None):
+    """Курсы по словам запроса, лучшие совпадения первыми, с флагом is_enrolled.
+
+    В Postgres используется сгенерированный столбец search_vector с GIN-индексом
+    (название весит больше описания), последнее слово ищется как префикс.
+    На SQLite (тесты) - подстроки в названии или описании.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return []
+    enrollment = models.user_course_association
+    query = (
+        db.query(
+            models.Course.id,
+            models.Course.name,
+            models.Course.description,
+            models.Course.hours,
+            models.Course.level,
+            models.Course.enrolled_count,
+            case((enrollment.c.user_id.isnot(None), True), else_=False).label("is_enrolled"),
+        )
+        .outerjoin(
+            enrollment,
+            and_(enrollment.c.course_id == models.Course.id, enrollment.c.user_id == user_id),
+        )
+    )
+    query = filter_courses(query, None, level, min_hours, max_hours)
+
+    if db.get_bind().dialect.name == "postgresql":
+        vector = literal_column("courses.search_vector")
+        tsquery = func.to_tsquery(SEARCH_CONFIG, " & ".join(terms[:-1] + [terms[-1] + ":*"]))
+        query = query.filter(vector.op("@@")(tsquery))
+        rank = func.ts_rank_cd(vector, tsquery)
+    else:
+        for term in terms:
+            query = query.filter(or_(
+                models.Course.name.icontains(term, autoescape=True),
+                models.Course.description.icontains(term, autoescape=True),
+            ))
+        rank = sum(case((models.Course.name.icontains(term, autoescape=True), 2), else_=1) for term in terms)
+
+    return query.order_by(rank.desc(), models.Course.id).offset(offset).limit(limit).all()
+
 # User-Course operations
 def get_user_courses(db: Session, user_id: int):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     return user.courses if user else []
 
+def get_user_course_rows(db: Session, user_id: int):
+    """Курсы пользователя строками (без загрузки User и ORM-объектов)"""
+    enrollment = models.user_course_association
+    return (
+        db.query(
+            models.Course.id,
+            models.Course.name,
+            models.Course.description,
+            models.Course.hours,
+            models.Course.level,
+            models.Course.enrolled_count,
+        )
+        .join(enrollment, enrollment.c.course_id == models.Course.id)
+        .filter(enrollment.c.user_id == user_id)
+        .order_by(models.Course.id)
+        .all()
+    )
+
+def insert_ignore(db: Session, table):
+    """INSERT ... ON CONFLICT DO NOTHING для диалекта текущей сессии"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def apply_enrolled_deltas(db: Session, course_ids, sign):
+    """Меняет счетчики курсов на число добавленных/удаленных записей.
+
+    Выполняется в транзакции самой записи; относительное обновление не
+    теряет параллельные изменения, а порядок по id исключает взаимные
+    блокировки между пакетами.
+    """
+    deltas = Counter(course_ids)
+    if not deltas:
+        return
+    courses = models.Course.__table__
+    db.execute(
+        update(courses)
+        .where(courses.c.id == bindparam("course_id"))
+        .values(enrolled_count=courses.c.enrolled_count + bindparam("delta")),
+        [{"course_id": course_id, "delta": sign * deltas[course_id]} for course_id in sorted(deltas)],
+    )
+
+def enroll_users_in_courses(db: Session, user_ids, course_ids):
+    """Записывает всех пользователей на все курсы одним INSERT ... SELECT.
+
+    Несуществующие id пропускаются, существующие записи не дублируются.
+    Возвращает число новых записей.
+    """
+    if not user_ids or not course_ids:
+        return 0
+    enrollment = models.user_course_association
+    pairs = (
+        select(models.User.id, models.Course.id)
+        .join(models.Course, true())
+        .where(models.User.id.in_(set(user_ids)), models.Course.id.in_(set(course_ids)))
+    )
+    stmt = (
+        insert_ignore(db, enrollment)
+        .from_select(["user_id", "course_id"], pairs)
+        .on_conflict_do_nothing()
+        .returning(enrollment.c.user_id, enrollment.c.course_id)
+    )
+    inserted = db.execute(stmt).all()
+    apply_enrolled_deltas(db, [course_id for _, course_id in inserted], 1)
+    db.commit()
+    if inserted:
+        mark_recent_write(user_ids)
+        bump_enrollment_versions(user_ids)
+        events.publish_enrollments(inserted, "added")
+        analytics.enqueue_enrollments(inserted, 1)
+    return len(inserted)
+
+def remove_users_from_courses(db: Session, user_ids, course_ids):
+    """Удаляет записи всех пользователей со всех курсов одним DELETE"""
+    if not user_ids or not course_ids:
+        return 0
+    enrollment = models.user_course_association
+    removed = db.execute(
+        delete(enrollment)
+        .where(
+            enrollment.c.user_id.in_(set(user_ids)),
+            enrollment.c.course_id.in_(set(course_ids)),
+        )
+        .returning(enrollment.c.user_id, enrollment.c.course_id)
+    ).all()
+    apply_enrolled_deltas(db, [course_id for _, course_id in removed], -1)
+    db.commit()
+    if removed:
+        mark_recent_write(user_ids)
+        bump_enrollment_versions(user_ids)
+        events.publish_enrollments(removed, "removed")
+        analytics.enqueue_enrollments(removed, -1)
+    return len(removed)
+
 def enroll_user_in_course(db: Session, user_id: int, course_id: int):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    course = db.query(models.Course).filter(models.Course.id == course_id).first()
-    
-    if user and course and course not in user.courses:
-        user.courses.append(course)
-        db.commit()
-    
+    course = get_course(db, course_id)
+    if course:
+        enroll_users_in_courses(db, [user_id], [course_id])
     return course
 
 def leave_course(db: Session, user_id: int, course_id: int):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    course = db.query(models.Course).filter(models.Course.id == course_id).first()
-    
-    if user and course and course in user.courses:
-        user.courses.remove(course)
-        db.commit()
-    
+    course = get_course(db, course_id)
+    if course:
+        remove_users_from_courses(db, [user_id], [course_id])
     return course
 
+RECONCILE_BATCH_SIZE = 1000
+
+def reconcile_enrolled_counts(db: Session, batch_size: int = RECONCILE_BATCH_SIZE):
+    """Пересчитывает enrolled_count по user_courses пачками курсов.
+
+    Строки курсов пачки сначала блокируются: незавершенная запись на курс
+    либо дождется пересчета и применит свою дельту поверх, либо завершится
+    раньше и попадет в подсчет следующей командой. Возвращает число
+    исправленных счетчиков.
+    """
+    courses = models.Course.__table__
+    enrollment = models.user_course_association
+    actual = (
+        select(func.count())
+        .where(enrollment.c.course_id == courses.c.id)
+        .scalar_subquery()
+    )
+    fixed = 0
+    last_id = 0
+    while True:
+        ids = db.execute(
+            select(courses.c.id)
+            .where(courses.c.id > last_id)
+            .order_by(courses.c.id)
+            .limit(batch_size)
+            .with_for_update(key_share=True)
+        ).scalars().all()
+        if not ids:
+            break
+        result = db.execute(
+            update(courses)
+            .where(courses.c.id.in_(ids), courses.c.enrolled_count != actual)
+            .values(enrolled_count=actual)
+        )
+        db.commit()
+        fixed += result.rowcount
+        last_id = ids[-1]
+    if fixed:
+        catalog_cache.invalidate()
+    return fixed
+
+def set_admin(db: Session, email: str, is_admin: bool = True):
+    """Выдает или снимает права администратора; False, если пользователя нет"""
+    user = get_user_by_email(db, email)
+    if user is None:
+        return False
+    user.is_admin = is_admin
+    db.commit()
+    principal_cache.invalidate(user.id)
+    return True
+
 # Initialize sample data
 def init_sample_data(db: Session):
     # Create sample users
@@ -1,29 +1,407 @@
-from sqlalchemy import create_engine, text  # ← ДОБАВИТЬ text
+from sqlalchemy import create_engine, text, exc
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from collections import deque
+from contextlib import contextmanager
+import asyncio
+import itertools
 import os
+import random
+import threading
 import time
 
+import redis
+
+from .cache import LRUCache
+from .redis_client import get_async_redis, get_redis, mark_redis_down
+
 # Конфигурация БД
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/education_platform")
 
-def create_engine_with_retry():
-    """Создает engine с простыми повторными попытками"""
-    for i in range(10):
+def to_async_url(url):
+    """URL того же сервера для асинхронного драйвера"""
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Параметры пула соединений (env или ConfigMap app-config)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+class PoolStats:
+    """Время ожидания соединения из пула и число таймаутов"""
+
+    def __init__(self, window=1024):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.waits = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.waits.append(seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self, pool):
+        with self._lock:
+            waits = sorted(self.waits)
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "saturation": round(pool.checkedout() / capacity, 3) if capacity else 0.0,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_p99_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 3) if waits else 0.0,
+        }
+
+def timed_pool(base, stats):
+    """Подкласс пула, замеряющий ожидание свободного соединения"""
+    class TimedPool(base):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                stats.record(time.perf_counter() - start, timed_out=True)
+                raise
+            stats.record(time.perf_counter() - start)
+            return connection
+    return TimedPool
+
+sync_pool_stats = PoolStats()
+async_pool_stats = PoolStats()
+
+def engine_options(url, pool_class, stats):
+    # SQLite (тесты) использует собственные пулы без этих параметров
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": timed_pool(pool_class, stats),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# Повторы подключения при старте: экспоненциальная задержка с джиттером
+DB_CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", "8"))
+DB_CONNECT_BASE_DELAY = float(os.getenv("DB_CONNECT_BASE_DELAY", "0.5"))
+DB_CONNECT_MAX_DELAY = float(os.getenv("DB_CONNECT_MAX_DELAY", "10"))
+
+# Реплики для чтения: синхронные URL через запятую, асинхронные выводятся из них.
+# Реплика получает запросы, только пока проверка видит отставание не больше
+# REPLICA_MAX_LAG; окно read-your-writes не меньше этого отставания, поэтому
+# пользователь после своей записи читает с primary, пока реплики не догонят.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "2"))
+REPLICA_CHECK_TIMEOUT = float(os.getenv("REPLICA_CHECK_TIMEOUT", "1"))
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", str(REPLICA_MAX_LAG * 2)))
+
+# Engine создаются при первом обращении, импорт модуля ничего не подключает
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+# Async engine, замененные в configure_database: закрыть их можно только
+# в event loop, поэтому они закрываются в dispose_engines
+_retired = []
+_session_factory = sessionmaker(autocommit=False, autoflush=False)
+_async_session_factory = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def configure_database(url, async_url=None, replica_urls=()):
+    """Переключает модуль на другую БД (тесты, утилиты); старые engine закрываются.
+
+    Синхронные engine закрываются сразу, асинхронные - в dispose_engines.
+    """
+    global DATABASE_URL, ASYNC_DATABASE_URL, _engine, _async_engine, _replicas
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        if _async_engine is not None:
+            _retired.append(_async_engine)
+        for replica in _replicas:
+            replica.dispose_sync()
+            _retired.append(replica)
+        DATABASE_URL = url
+        ASYNC_DATABASE_URL = async_url or to_async_url(url)
+        _engine = _async_engine = None
+        _replicas = make_replicas(replica_urls)
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL, QueuePool, sync_pool_stats))
+    return _engine
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                _async_engine = create_async_engine(
+                    ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, AsyncAdaptedQueuePool, async_pool_stats)
+                )
+    return _async_engine
+
+class Replica:
+    """Реплика для чтения: свои engine и состояние последней проверки"""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.async_url = to_async_url(url)
+        # Реплика не получает запросы, пока проверка не подтвердит, что она догнала primary
+        self.healthy = False
+        self.lag = None
+        self.sync_stats = PoolStats()
+        self.async_stats = PoolStats()
+        self._engine = None
+        self._async_engine = None
+
+    def get_engine(self):
+        if self._engine is None:
+            with _engine_lock:
+                if self._engine is None:
+                    self._engine = create_engine(self.url, **engine_options(self.url, QueuePool, self.sync_stats))
+        return self._engine
+
+    def get_async_engine(self):
+        if self._async_engine is None:
+            with _engine_lock:
+                if self._async_engine is None:
+                    self._async_engine = create_async_engine(
+                        self.async_url, **engine_options(self.async_url, AsyncAdaptedQueuePool, self.async_stats)
+                    )
+        return self._async_engine
+
+    def mark_down(self, error):
+        if self.healthy:
+            print(f"Replica {self.name} is unavailable, reading from primary: {error}")
+        self.healthy = False
+
+    def dispose_sync(self):
+        if self._engine is not None:
+            self._engine.dispose()
+        self._engine = None
+
+    async def dispose(self):
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+        self._async_engine = None
+        self.dispose_sync()
+
+def make_replicas(urls):
+    return [Replica(f"replica{i}", url) for i, url in enumerate(urls, 1)]
+
+_replicas = make_replicas(DATABASE_REPLICA_URLS)
+_round_robin = itertools.count()
+
+# Отставание реплики в секундах: 0, если все полученное WAL уже применено
+# (на простаивающем primary время последней транзакции не растет)
+# Без потоковой репликации (WAL receiver отключен) receive_lsn = replay_lsn
+# означает лишь, что проиграно все полученное, - отставание неизвестно (NULL).
+# Статус WAL receiver видят суперпользователь и роли с pg_read_all_stats.
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+async def replica_lag(replica):
+    async with replica.get_async_engine().connect() as conn:
+        if conn.dialect.name != "postgresql":
+            await conn.execute(text("SELECT 1"))
+            return 0.0
+        lag = (await conn.execute(text(REPLICA_LAG_SQL))).scalar()
+    if lag is None:
+        raise RuntimeError("WAL receiver is not streaming")
+    return float(lag)
+
+async def check_replica(replica):
+    try:
+        replica.lag = await asyncio.wait_for(replica_lag(replica), REPLICA_CHECK_TIMEOUT)
+    except Exception as e:
+        replica.lag = None
+        replica.mark_down(repr(e))
+        return
+    if replica.lag > REPLICA_MAX_LAG:
+        replica.mark_down(f"lag {replica.lag:.1f}s")
+    elif not replica.healthy:
+        print(f"Replica {replica.name} is healthy (lag {replica.lag:.1f}s)")
+        replica.healthy = True
+
+async def monitor_replicas():
+    """Фоновая проверка реплик; запускается в lifespan приложения"""
+    while True:
+        await asyncio.gather(*(check_replica(replica) for replica in _replicas))
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+def replicas_configured():
+    return bool(_replicas)
+
+def pick_replica():
+    """Следующая здоровая реплика по кругу или None"""
+    healthy = [replica for replica in _replicas if replica.healthy]
+    if not healthy:
+        return None
+    return healthy[next(_round_robin) % len(healthy)]
+
+def replica_status():
+    return {replica.name: {"healthy": replica.healthy, "lag": replica.lag} for replica in _replicas}
+
+# Read-your-writes: после записи пользователь на время окна читает с primary.
+# Отметки хранятся в Redis, чтобы их видели все воркеры и поды, и дублируются
+# в памяти процесса на случай недоступности Redis.
+_recent_writes = LRUCache(4096)
+
+def recent_write_key(user_id):
+    return f"rw:recent:{user_id}"
+
+def mark_recent_write(user_ids):
+    """Вызывается после записи, которую пользователь должен сразу увидеть"""
+    if not _replicas or not user_ids:
+        return
+    user_ids = set(user_ids)
+    for user_id in user_ids:
+        _recent_writes.set(user_id, True, READ_YOUR_WRITES_WINDOW)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.set(recent_write_key(user_id), 1, px=int(READ_YOUR_WRITES_WINDOW * 1000))
+        pipe.execute()
+    except redis.RedisError:
+        mark_redis_down()
+
+def wrote_recently(user_id):
+    if _recent_writes.get(user_id):
+        return True
+    client = get_redis()
+    if client is None:
+        return False
+    try:
+        return bool(client.exists(recent_write_key(user_id)))
+    except redis.RedisError:
+        mark_redis_down()
+        # Без Redis не знаем о записях в других процессах - читаем с primary
+        return True
+
+async def wrote_recently_async(user_id):
+    """То же для event loop: синхронный запрос в Redis блокировал бы цикл"""
+    if _recent_writes.get(user_id):
+        return True
+    client = get_async_redis()
+    if client is None:
+        return False
+    try:
+        return bool(await client.exists(recent_write_key(user_id)))
+    except redis.RedisError:
+        mark_redis_down()
+        return True
+
+def read_replica_for(user_id=None):
+    """Реплика для запроса или None, если читать нужно с primary"""
+    if not _replicas:
+        return None
+    if user_id is not None and wrote_recently(user_id):
+        return None
+    return pick_replica()
+
+async def read_replica_for_async(user_id=None):
+    if not _replicas:
+        return None
+    if user_id is not None and await wrote_recently_async(user_id):
+        return None
+    return pick_replica()
+
+def ReadSessionLocal(user_id=None):
+    """Сессия только для чтения: здоровая реплика или primary.
+
+    Соединение берется сразу, чтобы недоступная реплика заменилась
+    primary до выполнения запросов.
+    """
+    replica = read_replica_for(user_id)
+    if replica is None:
+        return SessionLocal()
+    db = _session_factory(bind=replica.get_engine())
+    try:
+        db.connection()
+    except (exc.DBAPIError, exc.TimeoutError) as e:
+        db.close()
+        replica.mark_down(e)
+        return SessionLocal()
+    return db
+
+async def AsyncReadSessionLocal(user_id=None):
+    replica = await read_replica_for_async(user_id)
+    if replica is None:
+        return AsyncSessionLocal()
+    db = _async_session_factory(bind=replica.get_async_engine())
+    try:
+        await db.connection()
+    except (exc.DBAPIError, exc.TimeoutError) as e:
+        await db.close()
+        replica.mark_down(e)
+        return AsyncSessionLocal()
+    return db
+
+def SessionLocal():
+    """Синхронная сессия; вызывается так же, как прежний sessionmaker"""
+    return _session_factory(bind=get_engine())
+
+def AsyncSessionLocal():
+    return _async_session_factory(bind=get_async_engine())
+
+async def wait_for_database(attempts=DB_CONNECT_ATTEMPTS):
+    """Ждет доступности БД, не блокируя event loop; после attempts неудач - исключение"""
+    delay = DB_CONNECT_BASE_DELAY
+    for attempt in range(1, attempts + 1):
         try:
-            engine = create_engine(DATABASE_URL)
-            with engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
+            async with get_async_engine().connect() as conn:
+                await conn.execute(text("SELECT 1"))
             print("Database connection established")
-            return engine
+            return
         except Exception as e:
-            print(f"Database connection attempt {i+1}/10 failed: {e}")
-            if i < 9:
-                print(f"Retrying in 5 seconds...")
-                time.sleep(5)
-    raise Exception("Could not connect to database after 10 attempts")
+            print(f"Database connection attempt {attempt}/{attempts} failed: {e}")
+            if attempt == attempts:
+                raise
+        await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        delay = min(delay * 2, DB_CONNECT_MAX_DELAY)
 
-engine = create_engine_with_retry()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async def dispose_engines():
+    global _engine, _async_engine
+    while _retired:
+        await _retired.pop().dispose()
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+    _engine = _async_engine = None
+    for replica in _replicas:
+        await replica.dispose()
 
 def get_db():
     db = SessionLocal()
@@ -32,8 +410,69 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db(user_id=None):
+    async with await AsyncReadSessionLocal(user_id) as db:
+        yield db
+
+async def run_crud(db: AsyncSession, func, *args, **kwargs):
+    """Совместимость: вызывает синхронную функцию crud на асинхронной сессии"""
+    return await db.run_sync(lambda session: func(session, *args, **kwargs))
+
+def pool_status():
+    status = {}
+    if _engine is not None and not DATABASE_URL.startswith("sqlite"):
+        status["sync"] = sync_pool_stats.snapshot(_engine.pool)
+    if _async_engine is not None and not ASYNC_DATABASE_URL.startswith("sqlite"):
+        status["async"] = async_pool_stats.snapshot(_async_engine.pool)
+    for replica in _replicas:
+        if replica._engine is not None and not replica.url.startswith("sqlite"):
+            status[f"{replica.name}:sync"] = replica.sync_stats.snapshot(replica._engine.pool)
+        if replica._async_engine is not None and not replica.async_url.startswith("sqlite"):
+            status[f"{replica.name}:async"] = replica.async_stats.snapshot(replica._async_engine.pool)
+    return status
+
 def init_db():
-    from .models import Base
+    from .models import Base, POSTGRES_DDL
     print("Creating database tables...")
+    engine = get_engine()
     Base.metadata.create_all(bind=engine)
-    print("Database tables created successfully")
\ No newline at end of file
+    if engine.dialect.name == "postgresql":
+        # Идемпотентно: доводит до текущей схемы и базы, созданные раньше
+        with engine.begin() as conn:
+            for statement in POSTGRES_DDL:
+                conn.execute(text(statement))
+    print("Database tables created successfully")
+
+# Идентификатор pg_advisory_lock для создания схемы и тестовых данных
+BOOTSTRAP_LOCK_ID = 7310001
+
+@contextmanager
+def advisory_lock(lock_id):
+    """Выполняет блок в одном процессе из всех воркеров и подов (только Postgres)"""
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": lock_id})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": lock_id})
+
+async def warm_up_pools(connections=DB_POOL_SIZE):
+    """Заранее открывает соединения, чтобы первые запросы не ждали подключения к БД"""
+    def open_sync():
+        conns = [get_engine().connect() for _ in range(connections)]
+        for conn in conns:
+            conn.close()
+
+    # Соединения открываются одновременно и сразу возвращаются в пул
+    async_engine = get_async_engine()
+    conns = await asyncio.gather(*(async_engine.connect().start() for _ in range(connections)))
+    await asyncio.gather(*(conn.close() for conn in conns))
+    await asyncio.to_thread(open_sync)
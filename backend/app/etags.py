@@ -0,0 +1,136 @@
+"""ETag и условные GET для эндпоинтов чтения.
+
+Если Redis доступен, ETag строится из счетчиков версий (каталог и записи
+пользователя), которые увеличивают пути записи в crud, - тогда повторный
+запрос с совпавшим If-None-Match отвечает 304 без обращения к БД. Без
+Redis локальные счетчики разных процессов расходятся, поэтому ETag
+считается по содержимому ответа: это дороже, но никогда не дает
+устаревший 304.
+"""
+import hashlib
+import os
+import time
+import uuid
+
+import redis
+from starlette.responses import Response
+
+from .cache import CatalogCache, catalog_cache
+from .redis_client import get_redis, mark_redis_down
+
+EPOCH_KEY = "etag:epoch"
+CACHE_CONTROL = "private, no-cache"
+# Счетчики записей меняются при записи любого пользователя, поэтому вместо
+# версии в ETag входит номер окна: ответы со счетчиками отстают не больше окна
+ENROLLED_COUNT_MAX_AGE = int(os.getenv("ENROLLED_COUNT_MAX_AGE", "60"))
+
+# Увеличение версий, пропущенное без Redis; при его возвращении меняется эпоха
+_missed_bumps = False
+
+def counts_window():
+    return int(time.time() // ENROLLED_COUNT_MAX_AGE)
+
+def enrollment_version_key(user_id):
+    return f"enrollment:version:{user_id}"
+
+def make_etag(*parts):
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+def content_etag(body):
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def ensure_epoch(client):
+    """Задает эпоху; после пропущенных увеличений версий - новую.
+
+    Запись, сделанная во время недоступности Redis, не увеличила версию
+    пользователя, и старый ETag совпадал бы со старыми данными. Новая эпоха
+    делает недействительными все ETag, выданные до сбоя.
+    """
+    global _missed_bumps
+    if _missed_bumps:
+        client.set(EPOCH_KEY, uuid.uuid4().hex)
+        _missed_bumps = False
+    else:
+        client.set(EPOCH_KEY, uuid.uuid4().hex, nx=True)
+
+def versioned_etag(*parts, user_id=None):
+    """ETag из версий каталога и записей пользователя; None, если Redis недоступен.
+
+    Эпоха задается один раз на экземпляр Redis: если данные Redis потеряны,
+    счетчики начнутся заново, но все старые ETag перестанут совпадать.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        ensure_epoch(client)
+        catalog_cache.apply_pending_invalidation(client)
+        keys = [EPOCH_KEY, CatalogCache.VERSION_KEY]
+        if user_id is not None:
+            keys.append(enrollment_version_key(user_id))
+        versions = client.mget(keys)
+    except redis.RedisError:
+        mark_redis_down()
+        return None
+    # Номер пользователя входит в ETag: при равных счетчиках у разных
+    # пользователей ETag их ответов не должны совпадать
+    return make_etag(*(version or b"0" for version in versions), *parts, user_id)
+
+def enrollment_version(user_id):
+    """Версия записей пользователя вместе с эпохой; None, если Redis недоступен"""
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        ensure_epoch(client)
+        epoch, version = client.mget([EPOCH_KEY, enrollment_version_key(user_id)])
+    except redis.RedisError:
+        mark_redis_down()
+        return None
+    return f"{(epoch or b'0').decode()}:{(version or b'0').decode()}"
+
+def bump_enrollment_versions(user_ids):
+    """Вызывается после изменения записей на курсы"""
+    global _missed_bumps
+    if not user_ids:
+        return
+    client = get_redis()
+    if client is None:
+        _missed_bumps = True
+        return
+    try:
+        ensure_epoch(client)
+        pipe = client.pipeline(transaction=False)
+        for user_id in set(user_ids):
+            pipe.incr(enrollment_version_key(user_id))
+        pipe.execute()
+    except redis.RedisError:
+        _missed_bumps = True
+        mark_redis_down()
+
+def if_none_match(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates
+
+def set_cache_headers(response, etag):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.headers["Vary"] = "Authorization"
+    return response
+
+def not_modified(etag):
+    return set_cache_headers(Response(status_code=304), etag)
+
+def conditional(request, response, etag=None):
+    """Добавляет ETag к готовому ответу и превращает его в 304 при совпадении"""
+    if etag is None:
+        etag = content_etag(response.body)
+    if if_none_match(request, etag):
+        return not_modified(etag)
+    return set_cache_headers(response, etag)
@@ -0,0 +1,266 @@
+"""События для клиентов (Server-Sent Events, GET /events).
+
+Событие записывается в поток Redis EVENTS_LOG и публикуется в канал
+EVENTS_CHANNEL одним Lua-скриптом, поэтому id события - это id записи
+потока. Каждый процесс API держит одну подписку на канал и раздает события
+своим клиентам через очереди asyncio: соединение клиента - это корутина без
+отдельного потока и без своего соединения с Redis. Клиент, переподключаясь
+с Last-Event-ID, получает пропущенное из потока; если нужная часть потока
+уже обрезана, приходит событие reset и клиент перечитывает данные целиком.
+
+Без Redis события и их история хранятся в памяти процесса (один узел,
+разработка и тесты).
+
+События: course.created (курс целиком), catalog.changed (массовые
+изменения каталога), enrollment ({"added": [...]} или {"removed": [...]} -
+только своему пользователю).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import redis
+import redis.asyncio as aioredis
+
+from . import redis_client
+from .redis_client import get_async_redis, get_redis, mark_redis_down
+
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "events")
+EVENTS_LOG = f"{EVENTS_CHANNEL}:log"
+# Сколько последних событий доступно для продолжения с Last-Event-ID
+EVENTS_HISTORY = int(os.getenv("EVENTS_HISTORY", "10000"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+
+Event = namedtuple("Event", "id type data user_id")
+
+PUBLISH_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'event', ARGV[2])
+redis.call('PUBLISH', KEYS[2], id .. ' ' .. ARGV[2])
+return id
+"""
+
+def parse_id(event_id):
+    """Id события ("мс-номер") в виде, пригодном для сравнения; ValueError для чужого"""
+    ms, _, seq = str(event_id).partition("-")
+    return int(ms), int(seq or 0)
+
+def encode_payload(event_type, data, user_id):
+    return json.dumps({"type": event_type, "data": data, "user_id": user_id}, ensure_ascii=False, separators=(",", ":"))
+
+def decode_event(event_id, payload):
+    if isinstance(event_id, bytes):
+        event_id = event_id.decode()
+    fields = json.loads(payload)
+    return Event(event_id, fields["type"], fields["data"], fields["user_id"])
+
+def format_event(event_type, data, event_id=None):
+    """Кадр SSE"""
+    lines = [f"id: {event_id}"] if event_id else []
+    lines += [f"event: {event_type}", f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}"]
+    return "\n".join(lines) + "\n\n"
+
+class EventHub:
+    """Подписчики процесса и доставка им событий"""
+
+    def __init__(self, history_size=EVENTS_HISTORY):
+        self.loop = None
+        self.subscribers = {}  # user_id -> множество очередей
+        self.last_id = None  # последнее разосланное событие
+        self.history = deque(maxlen=history_size)  # только без Redis
+        self._listener = None
+        self._script = None
+        self._local_last = (0, 0)
+        self._lock = threading.Lock()
+
+    # Публикация
+    def publish_many(self, events):
+        """[(тип, данные, user_id или None)]; вызывается из синхронного кода"""
+        if not events:
+            return
+        client = get_redis()
+        if client is not None:
+            try:
+                if self._script is None:
+                    self._script = client.register_script(PUBLISH_SCRIPT)
+                pipe = client.pipeline(transaction=False)
+                for event_type, data, user_id in events:
+                    self._script(
+                        keys=[EVENTS_LOG, EVENTS_CHANNEL],
+                        args=[EVENTS_HISTORY, encode_payload(event_type, data, user_id)],
+                        client=pipe,
+                    )
+                pipe.execute()
+                return
+            except redis.RedisError:
+                mark_redis_down()
+        for event in events:
+            self.publish_local(*event)
+
+    def publish_local(self, event_type, data, user_id=None):
+        with self._lock:
+            ms = int(time.time() * 1000)
+            last_ms, last_seq = self._local_last
+            self._local_last = (ms, 0) if ms > last_ms else (last_ms, last_seq + 1)
+            event = Event("%d-%d" % self._local_last, event_type, data, user_id)
+            self.history.append(event)
+            loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.dispatch, event)
+        return event
+
+    # Подписчики
+    def subscribe(self, user_id):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.subscribers = {}
+            self._listener = None
+        if self._listener is None and redis_client.REDIS_URL:
+            self._listener = loop.create_task(self.listen())
+        queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def subscriber_count(self):
+        return sum(len(queues) for queues in self.subscribers.values())
+
+    def dispatch(self, event):
+        if self.last_id is not None and parse_id(event.id) <= parse_id(self.last_id):
+            # Уже разослано: повтор при догонянии после переподключения
+            return
+        self.last_id = event.id
+        if event.user_id is None:
+            targets = [queue for queues in self.subscribers.values() for queue in queues]
+        else:
+            targets = list(self.subscribers.get(event.user_id, ()))
+        for queue in targets:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: закрываем поток, он продолжит по Last-Event-ID
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def listen(self):
+        """Подписка процесса на канал; после разрыва догоняет пропущенное из потока"""
+        delay = 1
+        while True:
+            # Отдельный клиент без таймаута чтения: подписка простаивает долго
+            client = aioredis.from_url(redis_client.REDIS_URL, health_check_interval=30)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(EVENTS_CHANNEL)
+                    if self.last_id is not None:
+                        for event_id, fields in await client.xrange(EVENTS_LOG, min=f"({self.last_id}"):
+                            self.dispatch(decode_event(event_id, fields[b"event"]))
+                    delay = 1
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            event_id, _, payload = message["data"].partition(b" ")
+                            self.dispatch(decode_event(event_id, payload))
+            except (redis.RedisError, OSError) as e:
+                print(f"Event subscription error: {e}")
+            finally:
+                await client.aclose()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    # История
+    async def replay(self, last_event_id, user_id):
+        """(события после last_event_id, id для reset или None, если история полна)"""
+        client = get_async_redis()
+        if client is not None:
+            try:
+                return await self.replay_redis(client, last_event_id, user_id)
+            except redis.RedisError:
+                mark_redis_down()
+        with self._lock:
+            history = list(self.history)
+        newest = history[-1].id if history else "0-0"
+        try:
+            last = parse_id(last_event_id)
+        except ValueError:
+            return [], newest
+        # История начинается позже last_event_id (процесс перезапущен) или id чужой
+        if (history and parse_id(history[0].id) > last) or parse_id(newest) < last:
+            return [], newest
+        return [e for e in history if parse_id(e.id) > last and e.user_id in (None, user_id)], None
+
+    async def replay_redis(self, client, last_event_id, user_id):
+        newest_entries = await client.xrevrange(EVENTS_LOG, count=1)
+        newest = newest_entries[0][0].decode() if newest_entries else "0-0"
+        try:
+            last = parse_id(last_event_id)
+        except ValueError:
+            return [], newest
+        oldest_entries = await client.xrange(EVENTS_LOG, count=1)
+        # Нужная часть потока обрезана или id из другой жизни Redis
+        if oldest_entries and (parse_id(oldest_entries[0][0].decode()) > last or parse_id(newest) < last):
+            return [], newest
+        entries = await client.xrange(EVENTS_LOG, min=f"({last_event_id}", count=EVENTS_HISTORY)
+        events = [decode_event(event_id, fields[b"event"]) for event_id, fields in entries]
+        return [e for e in events if e.user_id in (None, user_id)], None
+
+    async def stream(self, user_id, last_event_id=None, until=None):
+        """Кадры SSE для пользователя: пропущенное, затем новые события и heartbeat.
+
+        Поток закрывается к моменту until (срок действия токена): клиент
+        переподключится и пройдет проверку заново.
+        """
+        queue = self.subscribe(user_id)
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n"
+            seen = None
+            if last_event_id:
+                events, reset_id = await self.replay(last_event_id, user_id)
+                if reset_id is not None:
+                    yield format_event("reset", {}, reset_id)
+                    seen = parse_id(reset_id)
+                for event in events:
+                    yield format_event(event.type, event.data, event.id)
+                    seen = parse_id(event.id)
+            while True:
+                timeout = EVENTS_HEARTBEAT
+                if until is not None:
+                    timeout = min(timeout, until - time.time())
+                    if timeout <= 0:
+                        break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    break
+                if seen is not None and parse_id(event.id) <= seen:
+                    continue
+                yield format_event(event.type, event.data, event.id)
+        finally:
+            self.unsubscribe(user_id, queue)
+
+event_hub = EventHub()
+
+def publish(event_type, data, user_id=None):
+    event_hub.publish_many([(event_type, data, user_id)])
+
+def publish_enrollments(pairs, key):
+    """Событие enrollment каждому пользователю по парам (user_id, course_id)"""
+    by_user = {}
+    for user_id, course_id in pairs:
+        by_user.setdefault(user_id, []).append(course_id)
+    event_hub.publish_many([
+        ("enrollment", {key: sorted(course_ids)}, user_id) for user_id, course_ids in by_user.items()
+    ])
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from . import metrics
+
+# Профили стоимости argon2. "default" — параметры passlib по умолчанию,
+# "low" подходит для подов с небольшой квотой CPU (рекомендация OWASP).
+ARGON2_PROFILES = {
+    "low": {"time_cost": 2, "memory_cost": 19456, "parallelism": 1},
+    "default": {},
+    "high": {"time_cost": 4, "memory_cost": 131072, "parallelism": 4},
+}
+ARGON2_PROFILE = os.getenv("ARGON2_PROFILE", "default")
+
+# Пул для хэширования: размер и максимальная глубина очереди
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "thread")  # thread | process
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "16"))
+
+def argon2_settings():
+    """Параметры argon2 из профиля с переопределением через ARGON2_* переменные"""
+    settings = dict(ARGON2_PROFILES[ARGON2_PROFILE])
+    for name in ("time_cost", "memory_cost", "parallelism"):
+        value = os.getenv(f"ARGON2_{name.upper()}")
+        if value:
+            settings[name] = int(value)
+    return {f"argon2__{name}": value for name, value in settings.items()}
+
+# Password hashing - используем argon2 вместо bcrypt
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto", **argon2_settings())
+
+class HashingBusy(Exception):
+    """Очередь хэширования переполнена, запрос нужно отклонить"""
+
+def _hash(password):
+    return pwd_context.hash(password)
+
+def _verify_and_update(password, hashed_password):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+HASH_DURATION = metrics.Histogram(
+    "argon2_duration_seconds", "Argon2 hash/verify time including queueing", ("operation",)
+)
+HASH_REJECTED = metrics.Counter("argon2_rejected_total", "Hashing requests rejected because the queue was full")
+
+_executor = None
+_pending = 0
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="argon2")
+    return _executor
+
+async def _submit(operation, func, *args):
+    # Счетчик меняется только в event loop, поэтому блокировка не нужна
+    global _pending
+    if _pending >= HASH_MAX_PENDING:
+        HASH_REJECTED.inc()
+        raise HashingBusy()
+    _pending += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        _pending -= 1
+        HASH_DURATION.observe(time.perf_counter() - start, operation)
+
+async def hash_password(password):
+    return await _submit("hash", _hash, password)
+
+async def verify_password(password, hashed_password):
+    """Возвращает (ok, new_hash); new_hash не None, если хэш пора пересчитать"""
+    return await _submit("verify", _verify_and_update, password, hashed_password)
+
+def pending():
+    return _pending
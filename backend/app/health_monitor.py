@@ -1,103 +1,217 @@
+import asyncio
+import json
+import os
 import time
-import requests
-import psycopg2
-import redis
-
-def check_web_service(service_name, host, port, health_endpoint="/health"):
-    """Проверяет доступность веб-сервиса"""
-    try:
-        url = f"http://{host}:{port}{health_endpoint}"
-        response = requests.get(url, timeout=5)
+from collections import deque
+
+import asyncpg
+import httpx
+import redis.asyncio as aioredis
+
+# Конфигурация мониторинга
+CHECK_INTERVAL = int(os.getenv("HEALTH_CHECK_INTERVAL", "30"))  # секунды
+CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "5"))
+HISTORY_SIZE = int(os.getenv("HEALTH_HISTORY_SIZE", "100"))
+HTTP_PORT = int(os.getenv("HEALTH_MONITOR_PORT", "8080"))
+
+# Список целей: "Имя=URL" через запятую. Тип проверки определяется схемой URL.
+DEFAULT_TARGETS = ",".join([
+    "Backend API=http://backend-api:8000/health",
+    "Backend Auth=http://backend-auth:8001/health",
+    "Database=postgresql://user:password@db:5432/education_platform",
+    "Redis=redis://redis:6379/0",
+])
+HEALTH_TARGETS = os.getenv("HEALTH_TARGETS", DEFAULT_TARGETS)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+class Target:
+    """Цель мониторинга с историей задержек последних проверок"""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.latencies = deque(maxlen=HISTORY_SIZE)
+        self.healthy = None
+        self.message = "Not checked yet"
+        self.checked_at = None
+        self.failures = 0
+
+    async def probe(self):
+        """Возвращает (is_healthy, message); соединения переиспользуются между проверками"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def check(self):
+        start = time.perf_counter()
+        try:
+            self.healthy, self.message = await asyncio.wait_for(self.probe(), CHECK_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.healthy, self.message = False, "Timeout"
+        except Exception as e:
+            self.healthy, self.message = False, f"Error: {str(e)}"
+        latency = time.perf_counter() - start
+        self.latencies.append(latency)
+        self.checked_at = time.time()
+        if not self.healthy:
+            self.failures += 1
+        return self.healthy
+
+    def state(self):
+        latencies = sorted(self.latencies)
+        to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "message": self.message,
+            "checked_at": self.checked_at,
+            "failures": self.failures,
+            "latency_ms": {
+                "last": to_ms(self.latencies[-1]) if self.latencies else None,
+                "p50": to_ms(percentile(latencies, 0.50)),
+                "p95": to_ms(percentile(latencies, 0.95)),
+                "p99": to_ms(percentile(latencies, 0.99)),
+            },
+        }
+
+class WebServiceTarget(Target):
+    """Проверяет доступность веб-сервиса через общий пул HTTP-соединений"""
+
+    def __init__(self, name, url, client):
+        super().__init__(name, url)
+        self.client = client
+
+    async def probe(self):
+        try:
+            response = await self.client.get(self.url)
+        except httpx.ConnectError:
+            return False, "Connection refused"
         if response.status_code == 200:
             return True, "Service is healthy"
-        else:
-            return False, f"HTTP {response.status_code}"
-    except requests.exceptions.ConnectionError:
-        return False, "Connection refused"
-    except requests.exceptions.Timeout:
-        return False, "Timeout"
-    except Exception as e:
-        return False, f"Error: {str(e)}"
-
-def check_database():
-    """Проверяет доступность базы данных"""
-    try:
-        conn = psycopg2.connect(
-            host="db",
-            database="education_platform", 
-            user="user",
-            password="password",
-            connect_timeout=5
-        )
-        # Проверяем что можем выполнить простой запрос
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.close()
-        conn.close()
+        return False, f"HTTP {response.status_code}"
+
+class DatabaseTarget(Target):
+    """Проверяет доступность базы данных через постоянный пул asyncpg"""
+
+    def __init__(self, name, url):
+        super().__init__(name, url)
+        self.pool = None
+
+    async def probe(self):
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(self.url, min_size=1, max_size=1, timeout=CHECK_TIMEOUT)
+        async with self.pool.acquire() as conn:
+            await conn.fetchval("SELECT 1")
         return True, "Database is accessible"
-    except psycopg2.OperationalError as e:
-        return False, f"Database connection failed: {str(e)}"
-    except Exception as e:
-        return False, f"Database error: {str(e)}"
-
-def check_redis():
-    """Проверяет доступность Redis"""
-    try:
-        r = redis.Redis(host="redis", port=6379, socket_connect_timeout=5)
-        r.ping()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+class RedisTarget(Target):
+    """Проверяет доступность Redis через постоянный клиент"""
+
+    def __init__(self, name, url):
+        super().__init__(name, url)
+        self.client = aioredis.from_url(url, socket_connect_timeout=CHECK_TIMEOUT)
+
+    async def probe(self):
+        await self.client.ping()
         return True, "Redis is responsive"
-    except redis.ConnectionError:
-        return False, "Redis connection failed"
-    except Exception as e:
-        return False, f"Redis error: {str(e)}"
 
-def monitor_all_services():
-    """Проверяет все сервисы и выводит отчет"""
+    async def close(self):
+        await self.client.close()
+
+def parse_targets(spec, http_client):
+    targets = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, url = item.split("=", 1)
+        name, url = name.strip(), url.strip()
+        if url.startswith(("http://", "https://")):
+            targets.append(WebServiceTarget(name, url, http_client))
+        elif url.startswith(("postgresql://", "postgres://")):
+            targets.append(DatabaseTarget(name, url))
+        elif url.startswith("redis://"):
+            targets.append(RedisTarget(name, url))
+        else:
+            raise ValueError(f"Unsupported health target: {item}")
+    return targets
+
+def aggregate_state(targets):
+    states = [target.state() for target in targets]
+    return {
+        "healthy": all(state["healthy"] for state in states),
+        "targets": states,
+    }
+
+async def monitor_all_services(targets):
+    """Проверяет все сервисы параллельно и выводит отчет"""
+    await asyncio.gather(*(target.check() for target in targets))
+
     print("\n" + "="*50)
     print("HEALTH MONITOR REPORT")
     print("="*50)
-    
-    services_to_check = [
-        ("Backend API", "backend-api", 8000),
-        ("Backend Auth", "backend-auth", 8001),
-    ]
-    
-    all_healthy = True
-    
-    # Проверяем веб-сервисы
-    for service_name, host, port in services_to_check:
-        is_healthy, message = check_web_service(service_name, host, port)
-        print(f"{service_name:<15} {message}")
-        if not is_healthy:
-            all_healthy = False
-    
-    # Проверяем базу данных
-    db_healthy, db_message = check_database()
-    print(f"{'Database':<15} {db_message}")
-    if not db_healthy:
-        all_healthy = False
-    
-    # Проверяем Redis
-    redis_healthy, redis_message = check_redis()
-    print(f"{'Redis':<15} {redis_message}")
-    if not redis_healthy:
-        all_healthy = False
-    
+    for target in targets:
+        latency = target.latencies[-1] * 1000
+        print(f"{target.name:<15} {target.message} ({latency:.1f} ms)")
     print("="*50)
-    if all_healthy:
+    if all(target.healthy for target in targets):
         print("ALL SYSTEMS OPERATIONAL")
     else:
         print("SOME SERVICES HAVE ISSUES")
     print("="*50)
 
+async def serve_state(targets, port=HTTP_PORT):
+    """Минимальный HTTP-сервер: GET /status - состояние целей, GET /health - жив ли монитор"""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode(errors="replace").split()
+            path = parts[1] if len(parts) > 1 else "/"
+            if path == "/health":
+                status_line, body = "200 OK", {"status": "healthy", "service": "health-monitor"}
+            elif path in ("/", "/status"):
+                state = aggregate_state(targets)
+                status_line = "200 OK" if state["healthy"] else "503 Service Unavailable"
+                body = state
+            else:
+                status_line, body = "404 Not Found", {"detail": "Not Found"}
+            payload = json.dumps(body).encode()
+            writer.write(
+                f"HTTP/1.1 {status_line}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "0.0.0.0", port)
+
+async def main():
+    async with httpx.AsyncClient(timeout=CHECK_TIMEOUT) as http_client:
+        targets = parse_targets(HEALTH_TARGETS, http_client)
+        server = await serve_state(targets)
+        print(f"Serving health state on port {HTTP_PORT}")
+        try:
+            while True:
+                await monitor_all_services(targets)
+                print(f"Next check in {CHECK_INTERVAL} seconds...\n")
+                await asyncio.sleep(CHECK_INTERVAL)
+        finally:
+            server.close()
+            await asyncio.gather(*(target.close() for target in targets))
+
 if __name__ == "__main__":
     print("Health Monitor Service Started")
-    print("Monitoring services every 30 seconds...")
-    
-    # Для демонстрации проверяем чаще
-    check_interval = 30  # секунды
-    
-    while True:
-        monitor_all_services()
-        print(f"Next check in {check_interval} seconds...\n")
-        time.sleep(check_interval)
\ No newline at end of file
+    print(f"Monitoring services every {CHECK_INTERVAL} seconds...")
+    asyncio.run(main())
@@ -0,0 +1,307 @@
+"""Фоновые задачи для побочных эффектов записи.
+
+Обработчик запроса ставит задачу одной командой XADD и сразу отвечает;
+задачи выполняет воркер (python -m app.worker) в группе потребителей
+Redis Streams. Незавершенная задача упавшего воркера остается в pending и
+через JOBS_VISIBILITY_TIMEOUT забирается другим воркером (XAUTOCLAIM).
+Ошибки и такие зависания считаются попытками и повторяются с
+экспоненциальной задержкой через отложенный ZSET; после JOBS_MAX_ATTEMPTS
+задача уходит в поток мертвых задач. Долгие задачи (job(..., heartbeat=True),
+например массовый импорт) продлевают видимость, пока выполняются.
+
+Без Redis задачи попадают в очередь в памяти процесса, которую разбирает
+фоновый поток того же процесса - это замена для разработки и тестов,
+задачи при перезапуске теряются.
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+import redis
+
+from .redis_client import get_async_redis, get_redis, mark_redis_down
+
+JOBS_STREAM = os.getenv("JOBS_STREAM", "jobs:stream")
+JOBS_GROUP = os.getenv("JOBS_GROUP", "workers")
+JOBS_DELAYED_KEY = f"{JOBS_STREAM}:delayed"
+JOBS_DEAD_STREAM = f"{JOBS_STREAM}:dead"
+JOBS_MAXLEN = int(os.getenv("JOBS_MAXLEN", "100000"))
+JOBS_VISIBILITY_TIMEOUT = float(os.getenv("JOBS_VISIBILITY_TIMEOUT", "60"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_RETRY_BASE_DELAY = float(os.getenv("JOBS_RETRY_BASE_DELAY", "2"))
+JOBS_BATCH_SIZE = int(os.getenv("JOBS_BATCH_SIZE", "10"))
+JOBS_BLOCK_MS = int(os.getenv("JOBS_BLOCK_MS", "5000"))
+JOBS_LOCAL_WORKER = os.getenv("JOBS_LOCAL_WORKER", "true").lower() == "true"
+
+_handlers = {}
+_long_running = set()
+
+def job(name, heartbeat=False):
+    """Регистрирует обработчик задачи: func(**payload).
+
+    heartbeat - задача может идти дольше JOBS_VISIBILITY_TIMEOUT, и пока
+    она выполняется, ее не забирают другие воркеры.
+    """
+    def decorator(func):
+        _handlers[name] = func
+        if heartbeat:
+            _long_running.add(name)
+        return func
+    return decorator
+
+def make_job(name, payload):
+    return {"id": uuid.uuid4().hex, "name": name, "payload": payload, "attempts": 0}
+
+def retry_delay(attempts):
+    return JOBS_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+
+# Переносит наступившие отложенные задачи в поток
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, item in ipairs(due) do
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'job', item)
+    redis.call('ZREM', KEYS[1], item)
+end
+return #due
+"""
+
+class RedisBroker:
+    def __init__(self, client):
+        self.client = client
+        self.promote = client.register_script(PROMOTE_SCRIPT)
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(JOBS_STREAM, JOBS_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def fetch(self, consumer, count=JOBS_BATCH_SIZE, block_ms=JOBS_BLOCK_MS):
+        """[(id, задача, забрана ли у другого воркера)]: сначала зависшие, затем новые"""
+        self.promote(keys=[JOBS_DELAYED_KEY, JOBS_STREAM], args=[time.time(), count, JOBS_MAXLEN])
+        _, claimed, _ = self.client.xautoclaim(
+            JOBS_STREAM, JOBS_GROUP, consumer, int(JOBS_VISIBILITY_TIMEOUT * 1000), count=count
+        )
+        if claimed:
+            return [(message_id, json.loads(fields[b"job"]), True) for message_id, fields in claimed]
+        response = self.client.xreadgroup(
+            # block=0 в Redis означает "ждать бесконечно"
+            JOBS_GROUP, consumer, {JOBS_STREAM: ">"}, count=count, block=block_ms or None
+        )
+        return [
+            (message_id, json.loads(fields[b"job"]), False)
+            for _, messages in response
+            for message_id, fields in messages
+        ]
+
+    def touch(self, consumer, message_id):
+        """Сбрасывает время простоя задачи в pending"""
+        self.client.xclaim(JOBS_STREAM, JOBS_GROUP, consumer, 0, [message_id], justid=True)
+
+    def ack(self, message_id):
+        pipe = self.client.pipeline()
+        pipe.xack(JOBS_STREAM, JOBS_GROUP, message_id)
+        pipe.xdel(JOBS_STREAM, message_id)
+        pipe.execute()
+
+    def retry(self, message_id, item, delay):
+        pipe = self.client.pipeline()
+        pipe.xack(JOBS_STREAM, JOBS_GROUP, message_id)
+        pipe.xdel(JOBS_STREAM, message_id)
+        pipe.zadd(JOBS_DELAYED_KEY, {json.dumps(item): time.time() + delay})
+        pipe.execute()
+
+    def dead(self, message_id, item):
+        pipe = self.client.pipeline()
+        pipe.xack(JOBS_STREAM, JOBS_GROUP, message_id)
+        pipe.xdel(JOBS_STREAM, message_id)
+        pipe.xadd(JOBS_DEAD_STREAM, {"job": json.dumps(item)}, maxlen=JOBS_MAXLEN, approximate=True)
+        pipe.execute()
+
+class LocalBroker:
+    """Та же семантика (pending, повторы, таймаут видимости) в памяти процесса"""
+
+    def __init__(self):
+        # Как MAXLEN у потока: без воркера очередь не растет бесконечно
+        self.ready = deque(maxlen=JOBS_MAXLEN)
+        self.pending = {}  # id -> [задача, время выдачи]
+        self.delayed = []  # куча (время запуска, порядковый номер, задача)
+        self.dead_jobs = deque(maxlen=1000)
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def add(self, item):
+        with self._cond:
+            self.ready.append((str(next(self._ids)), item))
+            self._cond.notify()
+
+    def ensure_group(self):
+        pass
+
+    def _collect(self, count):
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, item = heapq.heappop(self.delayed)
+            self.ready.append((str(next(self._ids)), item))
+        result = []
+        for message_id, entry in self.pending.items():
+            if len(result) >= count:
+                break
+            if now - entry[1] >= JOBS_VISIBILITY_TIMEOUT:
+                entry[1] = now
+                result.append((message_id, entry[0], True))
+        while self.ready and len(result) < count:
+            message_id, item = self.ready.popleft()
+            self.pending[message_id] = [item, now]
+            result.append((message_id, item, False))
+        return result
+
+    def fetch(self, consumer, count=JOBS_BATCH_SIZE, block_ms=JOBS_BLOCK_MS):
+        with self._cond:
+            result = self._collect(count)
+            if not result and block_ms:
+                self._cond.wait(block_ms / 1000)
+                result = self._collect(count)
+            return result
+
+    def touch(self, consumer, message_id):
+        with self._cond:
+            entry = self.pending.get(message_id)
+            if entry is not None:
+                entry[1] = time.monotonic()
+
+    def ack(self, message_id):
+        with self._cond:
+            self.pending.pop(message_id, None)
+
+    def retry(self, message_id, item, delay):
+        with self._cond:
+            self.pending.pop(message_id, None)
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self._ids), item))
+
+    def dead(self, message_id, item):
+        with self._cond:
+            self.pending.pop(message_id, None)
+            self.dead_jobs.append(item)
+
+local_broker = LocalBroker()
+_local_worker = None
+_local_worker_lock = threading.Lock()
+
+def fail(broker, message_id, item, error):
+    """Считает попытку неудачной: повтор с задержкой или мертвые задачи"""
+    item = dict(item, attempts=item["attempts"] + 1, error=error)
+    if item["attempts"] >= JOBS_MAX_ATTEMPTS:
+        print(f"Job {item['name']} {item['id']} failed {item['attempts']} times, moved to dead letters")
+        broker.dead(message_id, item)
+    else:
+        delay = retry_delay(item["attempts"])
+        print(f"Job {item['name']} {item['id']} failed, retry in {delay:.0f}s")
+        broker.retry(message_id, item, delay)
+
+def keep_alive(broker, consumer, message_id):
+    """Продлевает видимость задачи, пока не будет установлено возвращенное событие"""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(JOBS_VISIBILITY_TIMEOUT / 3):
+            try:
+                broker.touch(consumer, message_id)
+            except redis.RedisError as e:
+                print(f"Job heartbeat failed: {e}")
+
+    threading.Thread(target=beat, name=f"job-heartbeat-{message_id}", daemon=True).start()
+    return stop
+
+def process(broker, message_id, item, reclaimed=False, consumer=None):
+    """Выполняет одну задачу; возвращает True при успехе"""
+    if reclaimed:
+        # Прошлый воркер не завершил задачу (упал или завис) - это тоже попытка,
+        # иначе задача, роняющая воркер, выполнялась бы бесконечно
+        fail(broker, message_id, item, "visibility timeout expired")
+        return False
+    handler = _handlers.get(item["name"])
+    if handler is None:
+        print(f"Unknown job {item['name']} {item['id']} moved to dead letters")
+        broker.dead(message_id, item)
+        return False
+    heartbeat = keep_alive(broker, consumer, message_id) if item["name"] in _long_running else None
+    try:
+        handler(**item["payload"])
+    except Exception:
+        fail(broker, message_id, item, traceback.format_exc(limit=3))
+        return False
+    finally:
+        if heartbeat is not None:
+            heartbeat.set()
+    broker.ack(message_id)
+    return True
+
+def run_worker(broker, consumer, stop_event):
+    group_ready = False
+    while not stop_event.is_set():
+        try:
+            if not group_ready:
+                broker.ensure_group()
+                group_ready = True
+            for message_id, item, reclaimed in broker.fetch(consumer):
+                process(broker, message_id, item, reclaimed, consumer)
+                if stop_event.is_set():
+                    # Невыполненные задачи пачки заберет другой воркер после таймаута
+                    break
+        except redis.RedisError as e:
+            # Группа могла пропасть вместе с данными Redis - создаем заново
+            print(f"Job broker error: {e}")
+            group_ready = False
+            stop_event.wait(1)
+
+def ensure_local_worker():
+    """Запускает в процессе поток, разбирающий локальную очередь"""
+    global _local_worker
+    if not JOBS_LOCAL_WORKER or _local_worker is not None:
+        return
+    with _local_worker_lock:
+        if _local_worker is None:
+            from . import tasks  # noqa: F401 - регистрация обработчиков
+            _local_worker = threading.Thread(
+                target=run_worker, args=(local_broker, "local", threading.Event()),
+                name="local-jobs", daemon=True,
+            )
+            _local_worker.start()
+
+def enqueue_local(item):
+    local_broker.add(item)
+    ensure_local_worker()
+
+def enqueue(name, **payload):
+    """Ставит задачу в очередь (синхронные обработчики)"""
+    item = make_job(name, payload)
+    client = get_redis()
+    if client is not None:
+        try:
+            client.xadd(JOBS_STREAM, {"job": json.dumps(item)}, maxlen=JOBS_MAXLEN, approximate=True)
+            return item["id"]
+        except redis.RedisError:
+            mark_redis_down()
+    enqueue_local(item)
+    return item["id"]
+
+async def enqueue_async(name, **payload):
+    """Ставит задачу в очередь, не блокируя event loop"""
+    item = make_job(name, payload)
+    client = get_async_redis()
+    if client is not None:
+        try:
+            await client.xadd(JOBS_STREAM, {"job": json.dumps(item)}, maxlen=JOBS_MAXLEN, approximate=True)
+            return item["id"]
+        except redis.RedisError:
+            mark_redis_down()
+    enqueue_local(item)
+    return item["id"]
@@ -1,20 +1,115 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import List
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
+from typing import List, Optional
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas, crud, etags, metrics, tasks, bulk_import, events, tokens, analytics
+from .database import (
+    BOOTSTRAP_LOCK_ID, ReadSessionLocal, SessionLocal, advisory_lock, dispose_engines,
+    get_async_read_db, get_db, init_db, monitor_replicas, pool_status, replica_status, replicas_configured,
+    run_crud, wait_for_database, warm_up_pools,
+)
+from .cache import catalog_cache
+from .principal import Principal, principal_cache
+from .responses import RowsResponse
+from .compression import CompressionMiddleware
+
+# Пагинация каталога
+COURSES_PAGE_SIZE = 100
+COURSES_MAX_PAGE_SIZE = 500
+POPULAR_PAGE_SIZE = 10
+POPULAR_MAX_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Глубже результаты поиска не листаются: OFFSET растет линейно
+SEARCH_MAX_OFFSET = 1000
+
+# Создание схемы и тестовых данных. Под production-сервером (app.server)
+# выполняется один раз в мастер-процессе, а воркеры его пропускают.
+INIT_DB_ON_STARTUP = os.getenv("INIT_DB_ON_STARTUP", "true").lower() == "true"
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))
+STARTUP_RETRY_DELAY = float(os.getenv("STARTUP_RETRY_DELAY", "5"))
+STARTUP_RETRY_MAX_DELAY = float(os.getenv("STARTUP_RETRY_MAX_DELAY", "60"))
+
+def bootstrap():
+    """Схема и тестовые данные; advisory lock не дает воркерам и подам гоняться"""
+    print("Initializing database...")
+    with advisory_lock(BOOTSTRAP_LOCK_ID):
+        init_db()
+        db = SessionLocal()
+        try:
+            crud.init_sample_data(db)
+        finally:
+            db.close()
+    print("Sample data initialized")
+
+def warm_catalog_cache():
+    db = SessionLocal()
+    try:
+        # Тот же ключ, что у первой страницы /courses/catalog без фильтров
+        crud.get_cached_courses(db, None, COURSES_PAGE_SIZE + 1, None, None, None)
+    finally:
+        db.close()
+
+async def start_up():
+    if INIT_DB_ON_STARTUP:
+        await asyncio.to_thread(bootstrap)
+    await warm_up_pools(WARMUP_CONNECTIONS)
+    await asyncio.to_thread(warm_catalog_cache)
 
-from . import models, schemas, crud
-from .database import get_db, init_db
+async def retry_start_up(app: FastAPI):
+    """Повторяет неудавшийся запуск; до успеха /ready отвечает 503"""
+    delay = STARTUP_RETRY_DELAY
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await start_up()
+        except Exception as e:
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+            print(f"Startup error: {e}, retrying in {delay:.0f}s")
+        else:
+            app.state.ready = True
+            print("Application started successfully!")
+            return
 
-# JWT конфигурация
-SECRET_KEY = "your-secret-key-here-change-in-production"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    # Недоступная после всех повторов БД останавливает запуск
+    await wait_for_database()
+    # Первая проверка реплик идет сразу; до нее чтение идет с primary
+    replica_monitor = asyncio.create_task(monitor_replicas()) if replicas_configured() else None
+    # Открытые ключи сервиса авторизации: токены проверяются локально
+    key_refresher = asyncio.create_task(tokens.refresh_keys_periodically())
+    retry = None
+    try:
+        await start_up()
+    except Exception as e:
+        # Процесс продолжает работать (liveness), но трафик не получает,
+        # пока схема и прогрев не будут выполнены
+        print(f"Startup error: {e}, retrying in {STARTUP_RETRY_DELAY:.0f}s")
+        retry = asyncio.create_task(retry_start_up(app))
+    else:
+        app.state.ready = True
+        print("Application started successfully!")
+    yield
+    app.state.ready = False
+    if retry is not None:
+        retry.cancel()
+    key_refresher.cancel()
+    if replica_monitor is not None:
+        replica_monitor.cancel()
+    await dispose_engines()
 
-app = FastAPI(title="Education Platform API")
+app = FastAPI(title="Education Platform API", lifespan=lifespan)
 security = HTTPBearer()
 
 # CORS
@@ -31,138 +126,352 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(CompressionMiddleware)
 
-# Инициализация БД при запуске
-@app.on_event("startup")
-def on_startup():
-    print("Initializing database...")
-    try:
-        init_db()
-        print("Database tables created")
-        
-        # Initialize sample data
-        db = next(get_db())
-        crud.init_sample_data(db)
-        print("Sample data initialized")
-        print("Application started successfully!")
-    except Exception as e:
-        print(f"Startup error: {e}")
+metrics.install(app, "main-api")
 
-# JWT токен
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+@metrics.collector
+def collect_app_metrics():
+    cache_stats = catalog_cache.stats()
+    yield "catalog_cache_hits_total", "counter", "Catalog cache hits", {}, cache_stats["hits"]
+    yield "catalog_cache_misses_total", "counter", "Catalog cache misses", {}, cache_stats["misses"]
+    yield "catalog_cache_redis_errors_total", "counter", "Catalog cache Redis errors", {}, cache_stats["redis_errors"]
+    yield "sse_connections", "gauge", "Open /events streams", {}, events.event_hub.subscriber_count()
+    for pool_name, pool in pool_status().items():
+        labels = {"pool": pool_name}
+        yield "db_pool_checked_out", "gauge", "Connections checked out", labels, pool["checked_out"]
+        yield "db_pool_saturation", "gauge", "Checked out connections / pool capacity", labels, pool["saturation"]
+        yield "db_pool_checkouts_total", "counter", "Connection checkouts", labels, pool["checkouts"]
+        yield "db_pool_timeouts_total", "counter", "Connection checkout timeouts", labels, pool["timeouts"]
+        yield "db_pool_wait_avg_seconds", "gauge", "Average checkout wait", labels, pool["wait_avg_ms"] / 1000
+        yield "db_pool_wait_p99_seconds", "gauge", "p99 checkout wait", labels, pool["wait_p99_ms"] / 1000
+    for replica_name, replica in replica_status().items():
+        labels = {"replica": replica_name}
+        yield "db_replica_healthy", "gauge", "Replica receives reads", labels, int(replica["healthy"])
+        if replica["lag"] is not None:
+            yield "db_replica_lag_seconds", "gauge", "Replication lag seen by the last check", labels, replica["lag"]
 
-def verify_token(token: str):
+def load_user(user_id):
+    """Пользователь для проверки токена; читается с реплики, если она есть"""
+    db = ReadSessionLocal(user_id)
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
-        return None
+        return crud.get_user(db, user_id)
+    finally:
+        db.close()
+
+def authenticate(token: str):
+    """Проверяет токен; возвращает (Principal, payload) или 401.
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+    Подпись проверяется по кэшу открытых ключей сервиса авторизации,
+    без обращения к нему на каждый запрос.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    token = credentials.credentials
-    payload = verify_token(token)
-    if payload is None:
+    payload = tokens.verify_access_token(token)
+    if payload is None or payload.get("uid") is None:
         raise credentials_exception
+    user_id = payload["uid"]
     
-    email: str = payload.get("sub")
-    if email is None:
-        raise credentials_exception
+    # Проверенный пользователь берется из кэша, в БД идем только при промахе
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = load_user(user_id)
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+        principal_cache.set(principal)
     
-    user = crud.get_user_by_email(db, email=email)
-    if user is None:
+    if principal.token_version != payload.get("ver"):
         raise credentials_exception
     
-    return user
+    return principal, payload
 
-# Авторизация
-@app.post("/auth/login", response_model=schemas.LoginResponse)
-def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = crud.get_user_by_email(db, user_data.email)
-    if not user or not crud.verify_password(user_data.password, user.password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password"
-        )
-    
-    access_token = create_access_token(data={"sub": user.email})
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": schemas.User.from_orm(user)
-    }
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return authenticate(credentials.credentials)[0]
 
-@app.post("/auth/register", response_model=schemas.LoginResponse)
-def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
-    # Проверка существования пользователя
-    db_user = crud.get_user_by_email(db, email=user_data.email)
-    if db_user:
+def get_current_admin(current_user: Principal = Depends(get_current_user)):
+    if not current_user.is_admin:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required"
         )
-    
-    # Создание
-    user = crud.create_user(db=db, user=user_data)
-    
-    access_token = create_access_token(data={"sub": user.email})
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": schemas.User.from_orm(user)
-    }
+    return current_user
+
+# Чтение с реплик. Сразу после своих записей пользователь читает с primary
+# (read-your-writes, см. database.mark_recent_write).
+async def get_user_async_read_db(current_user: Principal = Depends(get_current_user)):
+    async for db in get_async_read_db(current_user.id):
+        yield db
 
 @app.get("/users/me", response_model=schemas.User)
-def get_current_user_info(current_user: models.User = Depends(get_current_user)):
-    return current_user
+def get_current_user_info(request: Request, current_user: Principal = Depends(get_current_user)):
+    user = {"email": current_user.email, "name": current_user.name, "id": current_user.id}
+    return etags.conditional(request, ORJSONResponse(user))
 
 @app.put("/users/me", response_model=schemas.User)
 def update_user_profile(
     user_update: schemas.UserCreate,
-    current_user: models.User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    user = crud.update_user(db=db, user_id=current_user.id, user_update=user_update)
+    tasks.audit("user.updated", current_user.id)
+    return user
+
+def parse_cursor(cursor: Optional[str], field: str = "id"):
+    if not cursor:
+        return None
+    try:
+        return crud.decode_cursor(cursor, field)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+@app.get("/courses/catalog", response_model=List[schemas.Course])
+def get_course_catalog(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(COURSES_PAGE_SIZE, ge=1, le=COURSES_MAX_PAGE_SIZE),
+    level: Optional[str] = None,
+    min_hours: Optional[int] = Query(None, ge=0),
+    max_hours: Optional[int] = Query(None, ge=0),
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Общая для всех пользователей часть каталога (без is_enrolled).
+
+    Тело берется из кэша каталога и одинаково для всех, поэтому его сжатые
+    варианты переиспользуются middleware по ETag. Промах кэша читается с
+    primary: после изменения каталога отставшая реплика закэшировала бы
+    старые данные на весь TTL.
+    """
+    after_id = parse_cursor(cursor)
+    etag = etags.versioned_etag("catalog", request.url.query, etags.counts_window())
+    if etag and etags.if_none_match(request, etag):
+        return etags.not_modified(etag)
+    
+    courses = crud.get_cached_courses(db, after_id, limit + 1, level, min_hours, max_hours)
+    headers = {}
+    if len(courses) > limit:
+        courses = courses[:limit]
+        headers["X-Next-Cursor"] = crud.encode_cursor(courses[-1]["id"])
+    
+    return etags.conditional(request, ORJSONResponse(courses, headers=headers), etag)
+
+@app.get("/courses/popular", response_model=List[schemas.Course])
+def get_popular_courses(
+    request: Request,
+    limit: int = Query(POPULAR_PAGE_SIZE, ge=1, le=POPULAR_MAX_PAGE_SIZE),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    return crud.update_user(db=db, user_id=current_user.id, user_update=user_update)
+    """Самые популярные курсы; одинаковы для всех пользователей, как и каталог"""
+    etag = etags.versioned_etag("popular", limit, etags.counts_window())
+    if etag and etags.if_none_match(request, etag):
+        return etags.not_modified(etag)
+    
+    courses = crud.get_popular_courses(db, limit)
+    return etags.conditional(request, ORJSONResponse(courses), etag)
+
+@app.get("/courses/search", response_model=List[schemas.CourseWithEnrollment])
+async def search_courses(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    level: Optional[str] = None,
+    min_hours: Optional[int] = Query(None, ge=0),
+    max_hours: Optional[int] = Query(None, ge=0),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    """Поиск по названию и описанию, лучшие совпадения первыми"""
+    offset = parse_cursor(cursor, "offset") or 0
+    if offset > SEARCH_MAX_OFFSET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    
+    etag = etags.versioned_etag("search", request.url.query, etags.counts_window(), user_id=current_user.id)
+    if etag and etags.if_none_match(request, etag):
+        return etags.not_modified(etag)
+    
+    rows = await run_crud(
+        db, crud.search_courses, current_user.id, q, offset=offset, limit=limit + 1,
+        level=level, min_hours=min_hours, max_hours=max_hours
+    )
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if offset + limit <= SEARCH_MAX_OFFSET:
+            headers["X-Next-Cursor"] = crud.encode_cursor(offset + limit, "offset")
+    
+    return etags.conditional(request, RowsResponse(rows, headers=headers), etag)
 
 @app.get("/courses", response_model=List[schemas.CourseWithEnrollment])
 def get_all_courses(
-    current_user: models.User = Depends(get_current_user),
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(COURSES_PAGE_SIZE, ge=1, le=COURSES_MAX_PAGE_SIZE),
+    level: Optional[str] = None,
+    min_hours: Optional[int] = Query(None, ge=0),
+    max_hours: Optional[int] = Query(None, ge=0),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    courses = crud.get_courses(db)
-    user_courses = crud.get_user_courses(db, current_user.id)
-    user_course_ids = [course.id for course in user_courses]
+    """Каталог с флагом is_enrolled.
+
+    Страница и список курсов пользователя берутся из кэша каталога, БД
+    читается только при промахе - с primary, как и в /courses/catalog.
+    """
+    after_id = parse_cursor(cursor)
+    
+    # Версии не менялись - отвечаем 304, не обращаясь к БД
+    etag = etags.versioned_etag("courses", request.url.query, etags.counts_window(), user_id=current_user.id)
+    if etag and etags.if_none_match(request, etag):
+        return etags.not_modified(etag)
     
-    courses_with_enrollment = []
-    for course in courses:
-        course_data = schemas.CourseWithEnrollment.from_orm(course)
-        course_data.is_enrolled = course.id in user_course_ids
-        courses_with_enrollment.append(course_data)
+    # Запрашиваем на одну строку больше, чтобы понять, есть ли следующая страница
+    courses = crud.get_cached_courses_with_enrollment(
+        db, current_user.id, after_id=after_id, limit=limit + 1,
+        level=level, min_hours=min_hours, max_hours=max_hours
+    )
+    headers = {}
+    if len(courses) > limit:
+        courses = courses[:limit]
+        headers["X-Next-Cursor"] = crud.encode_cursor(courses[-1]["id"])
     
-    return courses_with_enrollment
+    return etags.conditional(request, ORJSONResponse(courses, headers=headers), etag)
 
 @app.get("/users/me/courses", response_model=List[schemas.Course])
-def get_my_courses(
-    current_user: models.User = Depends(get_current_user),
+async def get_my_courses(
+    request: Request,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    etag = etags.versioned_etag("my-courses", etags.counts_window(), user_id=current_user.id)
+    if etag and etags.if_none_match(request, etag):
+        return etags.not_modified(etag)
+    
+    rows = await run_crud(db, crud.get_user_course_rows, current_user.id)
+    return etags.conditional(request, RowsResponse(rows), etag)
+
+@app.post("/users/me/courses:batch", response_model=schemas.BatchResult)
+def batch_update_my_courses(
+    batch: schemas.CourseBatch,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    result = {
+        "enrolled": crud.enroll_users_in_courses(db, [current_user.id], batch.enroll),
+        "left": crud.remove_users_from_courses(db, [current_user.id], batch.leave),
+    }
+    tasks.audit("enrollment.batch", current_user.id, enroll=batch.enroll, leave=batch.leave, **result)
+    return result
+
+@app.post("/admin/enrollments:batch", response_model=schemas.BatchResult)
+def batch_update_enrollments(
+    batch: schemas.EnrollmentBatch,
+    current_user: Principal = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    result = {
+        "enrolled": crud.enroll_users_in_courses(db, batch.user_ids, batch.enroll),
+        "left": crud.remove_users_from_courses(db, batch.user_ids, batch.leave),
+    }
+    tasks.audit(
+        "admin.enrollment.batch", current_user.id,
+        user_ids=batch.user_ids, enroll=batch.enroll, leave=batch.leave, **result
+    )
+    return result
+
+# Массовый импорт: тело запроса - CSV или NDJSON, пишется потоково на общий
+# том, импорт пачками (app.bulk_import) выполняет воркер фоновых задач
+@app.post("/admin/imports/{kind}", response_model=schemas.ImportRun, status_code=status.HTTP_202_ACCEPTED)
+async def start_import(
+    kind: str,
+    request: Request,
+    import_format: Optional[str] = Query(None, alias="format"),
+    current_user: Principal = Depends(get_current_admin)
+):
+    if kind not in bulk_import.KINDS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown import kind")
+    if import_format is None:
+        import_format = "ndjson" if "ndjson" in request.headers.get("content-type", "") else "csv"
+    if import_format not in bulk_import.FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported import format")
+
+    os.makedirs(bulk_import.IMPORT_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(bulk_import.IMPORT_DIR, f"{uuid.uuid4().hex}.{import_format}"))
+
+    def create_run():
+        db = SessionLocal()
+        try:
+            return bulk_import.create_run(db, kind, path, import_format)
+        finally:
+            db.close()
+
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > bulk_import.IMPORT_MAX_BYTES:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Import file too large")
+                await asyncio.to_thread(f.write, chunk)
+        run = await asyncio.to_thread(create_run)
+    except BaseException:
+        # Лимит, отключение клиента или ошибка записи: файл без импорта не остается на томе
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    await tasks.start_import_async(run.id)
+    await tasks.audit_async("admin.import.started", current_user.id, import_id=run.id, kind=kind, bytes=size)
+    return schemas.ImportRun.from_orm(run)
+
+@app.get("/admin/imports/{import_id}", response_model=schemas.ImportRun)
+def get_import(
+    import_id: str,
+    current_user: Principal = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    run = db.get(models.ImportRun, import_id)
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import not found")
+    return run
+
+@app.post("/admin/imports/{import_id}/resume", response_model=schemas.ImportRun, status_code=status.HTTP_202_ACCEPTED)
+def resume_import(
+    import_id: str,
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
-    return crud.get_user_courses(db, current_user.id)
+    """Продолжает импорт, прерванный ошибкой или перезапуском пода"""
+    run = db.get(models.ImportRun, import_id)
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import not found")
+    if run.status == "completed":
+        return run
+    if not os.path.exists(run.source):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Import file is no longer available")
+    tasks.start_import(run.id)
+    tasks.audit("admin.import.resumed", current_user.id, import_id=run.id)
+    return run
 
 @app.post("/users/me/courses/{course_id}")
 def enroll_in_course(
     course_id: int,
-    current_user: models.User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     course = crud.enroll_user_in_course(db, current_user.id, course_id)
@@ -172,12 +481,13 @@ def enroll_in_course(
             detail="Course not found"
         )
     
+    tasks.audit("enrollment.added", current_user.id, course_id=course_id)
     return {"message": "Successfully enrolled in course"}
 
 @app.delete("/users/me/courses/{course_id}")
 def leave_course(
     course_id: int,
-    current_user: models.User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     course = crud.leave_course(db, current_user.id, course_id)
@@ -187,11 +497,109 @@ def leave_course(
             detail="Course not found or not enrolled"
         )
     
+    tasks.audit("enrollment.removed", current_user.id, course_id=course_id)
     return {"message": "Successfully left course"}
 
+# Аналитика: готовые агрегаты (app.analytics), каждый запрос читает
+# ограниченное число строк по индексу; отставание реплики здесь допустимо
+STATS_PAGE_SIZE = 20
+STATS_MAX_PAGE_SIZE = 100
+
+@app.get("/stats/overview", response_model=schemas.StatsOverview)
+async def get_stats_overview(
+    current_user: Principal = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    return await run_crud(db, analytics.get_overview)
+
+@app.get("/stats/levels", response_model=List[schemas.LevelStats])
+async def get_level_stats(
+    current_user: Principal = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    return await run_crud(db, analytics.get_level_stats)
+
+@app.get("/stats/courses", response_model=List[schemas.CourseStats])
+async def get_course_stats(
+    limit: int = Query(STATS_PAGE_SIZE, ge=1, le=STATS_MAX_PAGE_SIZE),
+    current_user: Principal = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    return await run_crud(db, analytics.get_course_stats, limit)
+
+@app.get("/stats/learners", response_model=List[schemas.NamedLearnerStats])
+async def get_learner_stats(
+    limit: int = Query(STATS_PAGE_SIZE, ge=1, le=STATS_MAX_PAGE_SIZE),
+    current_user: Principal = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    return await run_crud(db, analytics.get_learner_stats, limit)
+
+@app.get("/stats/learners/{user_id}", response_model=schemas.LearnerStats)
+async def get_user_stats(
+    user_id: int,
+    current_user: Principal = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    return await run_crud(db, analytics.get_user_stats, user_id)
+
+@app.get("/stats/activity", response_model=List[schemas.DayStats])
+async def get_activity_stats(
+    days: int = Query(30, ge=1, le=analytics.ANALYTICS_MAX_DAYS),
+    current_user: Principal = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_user_async_read_db)
+):
+    """Записи, выходы и активные пользователи по дням, новые первыми"""
+    return await run_crud(db, analytics.get_activity, days)
+
+@app.get("/events")
+async def stream_events(
+    request: Request,
+    token: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+):
+    """Server-Sent Events: изменения каталога и записей текущего пользователя.
+
+    EventSource в браузере не умеет передавать заголовки, поэтому токен
+    можно передать параметром token. Пропущенные события досылаются по
+    заголовку Last-Event-ID или параметру last_event_id (новый EventSource
+    после обновления токена).
+    """
+    raw_token = credentials.credentials if credentials else token
+    if not raw_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    principal, payload = await asyncio.to_thread(authenticate, raw_token)
+    stream = events.event_hub.stream(
+        principal.id, request.headers.get("last-event-id") or last_event_id, until=payload.get("exp")
+    )
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx отдает кадры клиенту сразу
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "service": "main-api"}
+    return {
+        "status": "healthy",
+        "service": "main-api",
+        "cache": catalog_cache.stats(),
+        "db_pool": pool_status(),
+        "replicas": replica_status(),
+    }
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness-проба: 503, пока воркер не прогрел пулы и кэш или уже завершается"""
+    if not getattr(app.state, "ready", False):
+        return ORJSONResponse({"status": "starting"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"status": "ready"}
 
 @app.get("/")
 def root():
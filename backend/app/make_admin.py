@@ -0,0 +1,33 @@
+"""Выдача прав администратора (доступ к /stats и управлению записью на курсы).
+
+    python -m app.make_admin admin@example.com
+    python -m app.make_admin --revoke admin@example.com
+
+Тестовые учетные записи прав администратора не получают: их пароли
+известны всем.
+"""
+import argparse
+import asyncio
+
+from . import crud
+from .database import SessionLocal, wait_for_database
+
+def main():
+    parser = argparse.ArgumentParser(description="Grant or revoke admin rights")
+    parser.add_argument("emails", nargs="+")
+    parser.add_argument("--revoke", action="store_true")
+    args = parser.parse_args()
+
+    asyncio.run(wait_for_database())
+    db = SessionLocal()
+    try:
+        missing = [email for email in args.emails if not crud.set_admin(db, email, not args.revoke)]
+    finally:
+        db.close()
+    action = "revoked" if args.revoke else "granted"
+    print(f"Admin rights {action}: {len(args.emails) - len(missing)} users")
+    if missing:
+        raise SystemExit(f"Unknown users: {', '.join(missing)}")
+
+if __name__ == "__main__":
+    main()
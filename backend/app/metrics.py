@@ -0,0 +1,228 @@
+"""Метрики в текстовом формате Prometheus.
+
+Счетчики и гистограммы обновляются только из event loop (ASGI-middleware
+и async-код), поэтому обходятся без блокировок. Код из пула потоков
+(синхронные обработчики, хуки SQLAlchemy) пишет в объект RequestStats
+текущего запроса, который middleware сворачивает в общие метрики после
+ответа. Значения, которые живут в других модулях (кэш, пул соединений),
+читаются коллекторами в момент запроса /metrics.
+
+Каждый воркер uvicorn считает свое и отвечает на /metrics сам. При
+нескольких воркерах (app.server) к рядам добавляется метка worker с pid
+процесса, чтобы ряды разных воркеров не сменяли друг друга между
+опросами; суммировать их - sum without (worker).
+"""
+import bisect
+import contextvars
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.responses import Response
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+# Включает app.server, когда запускает больше одного воркера
+METRICS_WORKER_LABEL = os.getenv("METRICS_WORKER_LABEL", "false").lower() == "true"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_collectors = []
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        for labelvalues, value in self._values.items():
+            yield self.name + _format_labels(self.labelnames, labelvalues), value
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        self._values[labelvalues] = value
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [счетчики по корзинам..., сумма, количество]
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value, *labelvalues):
+        state = self._values.get(labelvalues)
+        if state is None:
+            state = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def samples(self):
+        bucket_labels = self.labelnames + ("le",)
+        for labelvalues, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield self.name + "_bucket" + _format_labels(bucket_labels, labelvalues + (bound,)), cumulative
+            yield self.name + "_bucket" + _format_labels(bucket_labels, labelvalues + ("+Inf",)), state[-1]
+            yield self.name + "_sum" + _format_labels(self.labelnames, labelvalues), state[-2]
+            yield self.name + "_count" + _format_labels(self.labelnames, labelvalues), state[-1]
+
+def collector(func):
+    """Регистрирует функцию, возвращающую (name, type, help, labels, value)"""
+    _collectors.append(func)
+    return func
+
+def with_worker_label(sample):
+    """Добавляет метку worker к имени ряда с метками или без"""
+    label = f'worker="{os.getpid()}"'
+    if sample.endswith("}"):
+        return f"{sample[:-1]},{label}}}"
+    return f"{sample}{{{label}}}"
+
+def render(worker_label=None):
+    worker_label = METRICS_WORKER_LABEL if worker_label is None else worker_label
+    sample = with_worker_label if worker_label else (lambda name: name)
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(f"{sample(name)} {value}" for name, value in metric.samples())
+    for func in _collectors:
+        described = set()
+        for name, metric_type, documentation, labels, value in func():
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{sample(name + _format_labels(tuple(labels), tuple(labels.values())))} {value}")
+    return "\n".join(lines) + "\n"
+
+def metrics_endpoint():
+    return Response(render(), media_type=CONTENT_TYPE)
+
+# HTTP-метрики
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("service", "method", "route", "status"))
+LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("service", "method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being processed", ("service",))
+
+# Метрики БД в разрезе запроса
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed", ("service", "route"))
+DB_QUERY_TIME = Counter("db_query_duration_seconds_total", "Time spent in SQL statements", ("service", "route"))
+DB_QUERIES_PER_REQUEST = Histogram(
+    "http_request_db_queries", "SQL statements per HTTP request", ("service", "route"), buckets=QUERY_COUNT_BUCKETS
+)
+
+class RequestStats:
+    __slots__ = ("queries", "query_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get("query_start_time")
+    if not start_times:
+        return
+    elapsed = time.perf_counter() - start_times.pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += elapsed
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка, статусы и число SQL-запросов по маршрутам"""
+
+    def __init__(self, app, service):
+        self.app = app
+        self.service = service
+        self._routes = None
+
+    def _route(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None or endpoint not in self._routes:
+            self._routes = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc(self.service)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec(self.service)
+            _request_stats.reset(token)
+            route = self._route(scope)
+            method = scope["method"]
+            REQUESTS.inc(self.service, method, route, status_code)
+            LATENCY.observe(elapsed, self.service, method, route)
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, self.service, route)
+            if stats.queries:
+                DB_QUERIES.inc(self.service, route, amount=stats.queries)
+                DB_QUERY_TIME.inc(self.service, route, amount=stats.query_time)
+
+def install(app, service):
+    """Подключает сбор метрик и эндпоинт /metrics к приложению FastAPI"""
+    app.add_middleware(MetricsMiddleware, service=service)
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
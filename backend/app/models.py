@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Table, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Table, ForeignKey, Index, Date, DateTime, Text, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -7,8 +7,10 @@ Base = declarative_base()
 user_course_association = Table(
     'user_courses',
     Base.metadata,
-    Column('user_id', Integer, ForeignKey('users.id')),
-    Column('course_id', Integer, ForeignKey('courses.id'))
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('course_id', Integer, ForeignKey('courses.id'), primary_key=True),
+    # Выборки по курсу: пересчет счетчиков (app.reconcile) и аналитики
+    Index('ix_user_courses_course_id', 'course_id'),
 )
 
 class User(Base):
@@ -18,6 +20,9 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False)
     name = Column(String, nullable=False)
+    # Увеличивается при отзыве токенов; сверяется с claim "ver" в JWT
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    is_admin = Column(Boolean, nullable=False, default=False, server_default="false")
     
     courses = relationship("Course", secondary=user_course_association, back_populates="users")
 
@@ -29,5 +34,156 @@ class Course(Base):
     description = Column(String)
     hours = Column(Integer, nullable=False)
     level = Column(String, nullable=False)
+    # Число записей; меняется в тех же транзакциях, что и user_courses (crud),
+    # сверяется с user_courses задачей app.reconcile
+    enrolled_count = Column(Integer, nullable=False, default=0, server_default="0")
     
-    users = relationship("User", secondary=user_course_association, back_populates="courses")
\ No newline at end of file
+    users = relationship("User", secondary=user_course_association, back_populates="courses")
+
+    # Индексы для фильтров каталога с keyset-пагинацией по id
+    __table_args__ = (
+        Index("ix_courses_level_id", "level", "id"),
+        Index("ix_courses_hours_id", "hours", "id"),
+        # /courses/popular читает первые строки индекса без сортировки
+        Index("ix_courses_enrolled_count_id", enrolled_count.desc(), "id"),
+        # Массовый импорт сопоставляет курсы по названию
+        Index("ix_courses_name", "name"),
+    )
+
+class AuditEvent(Base):
+    """Журнал действий пользователей; пишется фоновыми задачами (app.tasks)"""
+    __tablename__ = "audit_events"
+
+    id = Column(Integer, primary_key=True)
+    # Задачи выполняются как минимум один раз: повтор не создаст дубль
+    event_id = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    user_id = Column(Integer, index=True)
+    action = Column(String, nullable=False)
+    details = Column(Text)
+
+class ImportRun(Base):
+    """Прогресс массового импорта (app.bulk_import); продолжается с batches_done"""
+    __tablename__ = "import_runs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    format = Column(String, nullable=False)
+    batch_size = Column(Integer, nullable=False)
+    status = Column(String, nullable=False)
+    batches_done = Column(Integer, nullable=False, default=0, server_default="0")
+    rows_done = Column(Integer, nullable=False, default=0, server_default="0")
+    rows_skipped = Column(Integer, nullable=False, default=0, server_default="0")
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# Агрегаты для /stats (app.analytics). Меняет воркер фоновых задач после
+# записи на курсы; строки, которые задевает каждая запись, разбиты на части
+# (shard) по user_id, при чтении части суммируются.
+class AnalyticsUserHours(Base):
+    """Курсы и часы обучения пользователя"""
+    __tablename__ = "analytics_user_hours"
+
+    user_id = Column(Integer, primary_key=True)
+    courses = Column(Integer, nullable=False, default=0, server_default="0")
+    hours = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_analytics_user_hours_hours", hours.desc(), "user_id"),
+    )
+
+class AnalyticsLearners(Base):
+    """Число пользователей хотя бы с одним курсом"""
+    __tablename__ = "analytics_learners"
+
+    shard = Column(Integer, primary_key=True)
+    learners = Column(Integer, nullable=False, default=0, server_default="0")
+
+class AnalyticsLevel(Base):
+    """Записи на курсы по уровню"""
+    __tablename__ = "analytics_levels"
+
+    level = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    enrollments = Column(Integer, nullable=False, default=0, server_default="0")
+
+class AnalyticsDaily(Base):
+    """Записи, выходы и активные пользователи по дням (UTC)"""
+    __tablename__ = "analytics_daily"
+
+    day = Column(Date, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    enrollments = Column(Integer, nullable=False, default=0, server_default="0")
+    unenrollments = Column(Integer, nullable=False, default=0, server_default="0")
+    active_learners = Column(Integer, nullable=False, default=0, server_default="0")
+
+class AnalyticsDailyLearner(Base):
+    """Кто уже учтен в active_learners дня; старые дни удаляет refresh"""
+    __tablename__ = "analytics_daily_learners"
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+
+class AnalyticsAppliedBatch(Base):
+    """Учтенные пачки записей: повтор задачи не прибавляет их второй раз"""
+    __tablename__ = "analytics_applied_batches"
+
+    batch_id = Column(String, primary_key=True)
+    day = Column(Date, nullable=False)
+
+# Изменения схемы Postgres для баз, созданных раньше (create_all не меняет
+# существующие таблицы). Столбец search_vector не объявлен в модели, чтобы
+# схема оставалась совместимой с SQLite.
+POSTGRES_DDL = [
+    # Столбцы, добавленные после первого развертывания (init.sql их уже содержит)
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN NOT NULL DEFAULT FALSE",
+    # До пересчетов ниже: они считают записи по course_id
+    "CREATE INDEX IF NOT EXISTS ix_user_courses_course_id ON user_courses (course_id)",
+    # Новый счетчик сразу заполняется по user_courses
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'courses' AND column_name = 'enrolled_count'
+        ) THEN
+            ALTER TABLE courses ADD COLUMN enrolled_count INTEGER NOT NULL DEFAULT 0;
+            UPDATE courses SET enrolled_count = (
+                SELECT count(*) FROM user_courses WHERE user_courses.course_id = courses.id
+            );
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_courses_enrolled_count_id ON courses (enrolled_count DESC, id)",
+    # Первичный ключ user_courses: без него ON CONFLICT DO NOTHING при записи
+    # не срабатывает. Дубликаты удаляются, счетчики курсов пересчитываются
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = 'user_courses'::regclass AND contype = 'p'
+        ) THEN
+            LOCK TABLE user_courses IN EXCLUSIVE MODE;
+            DELETE FROM user_courses WHERE user_id IS NULL OR course_id IS NULL;
+            DELETE FROM user_courses a USING user_courses b
+            WHERE a.user_id = b.user_id AND a.course_id = b.course_id AND a.ctid > b.ctid;
+            ALTER TABLE user_courses ADD PRIMARY KEY (user_id, course_id);
+            UPDATE courses SET enrolled_count = (
+                SELECT count(*) FROM user_courses WHERE user_courses.course_id = courses.id
+            );
+        END IF;
+    END $$
+    """,
+    # Полнотекстовый поиск: сгенерированный tsvector и GIN-индекс
+    """
+    ALTER TABLE courses ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_courses_search_vector ON courses USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_courses_name ON courses (name)",
+]
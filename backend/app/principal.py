@@ -0,0 +1,81 @@
+import json
+import os
+from dataclasses import asdict, dataclass
+
+import redis
+
+from .cache import LRUCache
+from .redis_client import get_redis, mark_redis_down
+
+# Время жизни проверенного пользователя в кэше. Это же верхняя граница
+# задержки отзыва токенов в других процессах.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096"))
+
+@dataclass(frozen=True)
+class Principal:
+    """Проверенный пользователь запроса без обращения к ORM"""
+    id: int
+    email: str
+    name: str
+    token_version: int
+    is_admin: bool = False
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            email=user.email,
+            name=user.name,
+            token_version=user.token_version,
+            is_admin=bool(user.is_admin),
+        )
+
+class PrincipalCache:
+    """LRU в памяти процесса с необязательным общим слоем в Redis"""
+
+    def __init__(self, ttl=PRINCIPAL_CACHE_TTL, maxsize=PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.local = LRUCache(maxsize)
+
+    @staticmethod
+    def _key(user_id):
+        return f"principal:{user_id}"
+
+    def get(self, user_id):
+        principal = self.local.get(user_id)
+        if principal is not None:
+            return principal
+
+        client = get_redis()
+        if client is not None:
+            try:
+                cached = client.get(self._key(user_id))
+            except redis.RedisError:
+                mark_redis_down()
+            else:
+                if cached is not None:
+                    principal = Principal(**json.loads(cached))
+                    self.local.set(user_id, principal, self.ttl)
+                    return principal
+        return None
+
+    def set(self, principal):
+        self.local.set(principal.id, principal, self.ttl)
+        client = get_redis()
+        if client is not None:
+            try:
+                client.set(self._key(principal.id), json.dumps(asdict(principal)), ex=self.ttl)
+            except redis.RedisError:
+                mark_redis_down()
+
+    def invalidate(self, user_id):
+        self.local.delete(user_id)
+        client = get_redis()
+        if client is not None:
+            try:
+                client.delete(self._key(user_id))
+            except redis.RedisError:
+                mark_redis_down()
+
+principal_cache = PrincipalCache()
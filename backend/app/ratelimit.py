@@ -0,0 +1,182 @@
+"""Ограничение частоты запросов по алгоритму token bucket.
+
+Лимиты задаются на маршрут для областей ip, email и global. Все корзины
+маршрута проверяются одним Lua-скриптом в Redis: токены списываются только
+если разрешают все корзины, поэтому отклоненный запрос не расходует лимит
+остальных областей. Если Redis недоступен, используются корзины в памяти
+процесса - тогда лимит действует на каждый под отдельно.
+
+Формат RATE_LIMITS: "маршрут=область:запросов/секунд,...;маршрут=...",
+например "login=ip:20/60,email:10/300,global:30/1".
+"""
+import hashlib
+import math
+import os
+import time
+from collections import namedtuple
+
+import redis
+
+from . import metrics
+from .cache import LRUCache
+from .redis_client import get_async_redis, mark_redis_down
+
+DEFAULT_RATE_LIMITS = (
+    "login=ip:20/60,email:10/300,global:30/1;"
+    "register=ip:5/3600,global:5/1;"
+    "refresh=ip:60/60"
+)
+RATE_LIMITS = os.getenv("RATE_LIMITS", DEFAULT_RATE_LIMITS)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Доверять X-Real-IP / X-Forwarded-For. Включать, только если сервис доступен
+# исключительно через nginx: при прямом доступе клиент подставит любой адрес
+# и обойдет лимит по IP
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+RATE_LIMIT_LOCAL_SIZE = int(os.getenv("RATE_LIMIT_LOCAL_SIZE", "10000"))
+
+SCOPES = ("ip", "email", "global")
+
+RATE_LIMITED = metrics.Counter(
+    "rate_limit_rejections_total", "Requests rejected by rate limits", ("route", "scope", "backend")
+)
+
+Limit = namedtuple("Limit", "scope capacity period")
+
+# KEYS - корзины, ARGV - пары (емкость, токенов в секунду) для каждой корзины.
+# Возвращает {0, "0"} при успехе или {номер корзины, секунд до токена}.
+# Время берется из Redis, чтобы часы разных подов не влияли на лимит.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    if available < 1 then
+        return {i, tostring((1 - available) / rate)}
+    end
+    tokens[i] = available
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+end
+return {0, '0'}
+"""
+
+def parse_limits(spec):
+    """{маршрут: [Limit, ...]} из строки RATE_LIMITS"""
+    limits = {}
+    for route_spec in spec.split(";"):
+        if not route_spec.strip():
+            continue
+        route, _, items = route_spec.partition("=")
+        route_limits = []
+        for item in items.split(","):
+            scope, _, rate = item.strip().partition(":")
+            if scope not in SCOPES:
+                raise ValueError(f"Unknown rate limit scope: {item}")
+            capacity, _, period = rate.partition("/")
+            route_limits.append(Limit(scope, int(capacity), float(period)))
+        limits[route.strip()] = route_limits
+    return limits
+
+def client_ip(request):
+    if RATE_LIMIT_TRUST_PROXY:
+        real_ip = request.headers.get("x-real-ip")
+        if real_ip:
+            return real_ip.strip()
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def email_identity(email):
+    # В Redis не храним адреса в открытом виде
+    return hashlib.blake2b(email.strip().lower().encode(), digest_size=12).hexdigest()
+
+class RateLimiter:
+    def __init__(self, limits, local_size=RATE_LIMIT_LOCAL_SIZE):
+        self.limits = limits
+        # Корзины для работы без Redis: ключ -> [токены, время обновления]
+        self.local = LRUCache(local_size)
+        self._script = None
+
+    def buckets(self, route, request, email=None):
+        """[(Limit, ключ корзины)] для запроса; области без идентификатора пропускаются"""
+        identities = {
+            "ip": client_ip(request),
+            "email": email_identity(email) if email else None,
+            "global": "all",
+        }
+        return [
+            (limit, f"ratelimit:{route}:{limit.scope}:{identities[limit.scope]}")
+            for limit in self.limits.get(route, [])
+            if identities[limit.scope] is not None
+        ]
+
+    async def check(self, route, request, email=None):
+        """None, если запрос разрешен, иначе число секунд до повторной попытки"""
+        if not RATE_LIMIT_ENABLED:
+            return None
+        buckets = self.buckets(route, request, email)
+        if not buckets:
+            return None
+
+        backend = "redis"
+        rejected = None
+        client = get_async_redis()
+        if client is not None:
+            try:
+                rejected = await self.check_redis(client, buckets)
+            except redis.RedisError:
+                mark_redis_down()
+                client = None
+        if client is None:
+            backend = "local"
+            rejected = self.check_local(buckets)
+
+        if rejected is None:
+            return None
+        index, retry_after = rejected
+        RATE_LIMITED.inc(route, buckets[index][0].scope, backend)
+        return retry_after
+
+    async def check_redis(self, client, buckets):
+        if self._script is None:
+            self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        args = []
+        for limit, _ in buckets:
+            args += [limit.capacity, limit.capacity / limit.period]
+        index, retry_after = await self._script(keys=[key for _, key in buckets], args=args, client=client)
+        if index == 0:
+            return None
+        return index - 1, float(retry_after)
+
+    def check_local(self, buckets):
+        """Тот же алгоритм в памяти процесса; вызывается только из event loop"""
+        now = time.monotonic()
+        states = []
+        for i, (limit, key) in enumerate(buckets):
+            rate = limit.capacity / limit.period
+            state = self.local.get(key) or [float(limit.capacity), now]
+            state[0] = min(limit.capacity, state[0] + (now - state[1]) * rate)
+            state[1] = now
+            if state[0] < 1:
+                return i, (1 - state[0]) / rate
+            states.append(state)
+        for state, (limit, key) in zip(states, buckets):
+            state[0] -= 1
+            self.local.set(key, state, limit.period)
+        return None
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
+
+rate_limiter = RateLimiter(parse_limits(RATE_LIMITS))
@@ -0,0 +1,26 @@
+"""Сверка денормализованных счетчиков courses.enrolled_count с user_courses.
+
+    python -m app.reconcile
+
+Счетчики поддерживаются в транзакциях записи на курсы; задача исправляет
+расхождения после ручных правок БД или восстановления из бэкапа.
+В Kubernetes запускается по расписанию (k8s/reconcile-counts.yaml).
+"""
+import asyncio
+import time
+
+from . import crud
+from .database import SessionLocal, wait_for_database
+
+def main():
+    asyncio.run(wait_for_database())
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        fixed = crud.reconcile_enrolled_counts(db)
+    finally:
+        db.close()
+    print(f"Reconciled enrolled counts: {fixed} fixed in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import time
+import weakref
+
+import redis
+import redis.asyncio as aioredis
+
+# Общий клиент Redis для кэша и прочих подсистем
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+# Сколько секунд не пытаться снова после ошибки соединения
+REDIS_RETRY_AFTER = float(os.getenv("REDIS_RETRY_AFTER", "5"))
+
+_client = None
+# Асинхронный клиент привязан к event loop, поэтому храним по клиенту на цикл
+_async_clients = weakref.WeakKeyDictionary()
+_down_until = 0.0
+
+def get_redis():
+    """Возвращает клиент Redis или None, если Redis недоступен или отключен"""
+    global _client
+    if not REDIS_URL or time.monotonic() < _down_until:
+        return None
+    if _client is None:
+        _client = redis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
+
+def get_async_redis():
+    """Асинхронный клиент Redis для кода в event loop или None"""
+    if not REDIS_URL or time.monotonic() < _down_until:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = aioredis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+    return client
+
+def mark_redis_down():
+    """Отключает обращения к Redis на REDIS_RETRY_AFTER секунд после ошибки"""
+    global _down_until
+    _down_until = time.monotonic() + REDIS_RETRY_AFTER
@@ -0,0 +1,20 @@
+import orjson
+from starlette.responses import Response
+
+def rows_to_dicts(rows):
+    """Строки SQLAlchemy (Row) в словари по именам колонок"""
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
+
+class RowsResponse(Response):
+    """JSON-ответ из строк БД, сериализованных orjson.
+
+    Обходит from_orm и повторную валидацию по response_model: форма строк
+    задается запросами crud и проверяется в тестах на соответствие схемам.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(rows_to_dicts(content))
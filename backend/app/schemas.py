@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from datetime import date
+
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 # User schemas
@@ -31,6 +33,7 @@ class CourseCreate(CourseBase):
 
 class Course(CourseBase):
     id: int
+    enrolled_count: int = 0
 
     class Config:
         from_attributes = True
@@ -38,10 +41,75 @@ class Course(CourseBase):
 class CourseWithEnrollment(Course):
     is_enrolled: bool = False
 
+# Пакетная запись на курсы
+MAX_BATCH_SIZE = 1000
+
+class CourseBatch(BaseModel):
+    enroll: List[int] = Field(default=[], max_length=MAX_BATCH_SIZE)
+    leave: List[int] = Field(default=[], max_length=MAX_BATCH_SIZE)
+
+class EnrollmentBatch(CourseBatch):
+    user_ids: List[int] = Field(max_length=MAX_BATCH_SIZE)
+
+class BatchResult(BaseModel):
+    enrolled: int = 0
+    left: int = 0
+
+class ImportRun(BaseModel):
+    id: str
+    kind: str
+    format: str
+    status: str
+    batch_size: int
+    batches_done: int
+    rows_done: int
+    rows_skipped: int
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 class LoginResponse(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str
+    expires_in: int
     user: User
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class UserWithCourses(User):
-    courses: List[Course] = []
\ No newline at end of file
+    courses: List[Course] = []
+
+# Аналитика (/stats)
+class LevelStats(BaseModel):
+    level: str
+    enrollments: int
+
+class CourseStats(BaseModel):
+    id: int
+    name: str
+    level: str
+    hours: int
+    enrolled_count: int
+
+class LearnerStats(BaseModel):
+    user_id: int
+    courses: int
+    hours: int
+
+class NamedLearnerStats(LearnerStats):
+    name: str
+
+class DayStats(BaseModel):
+    day: date
+    enrollments: int
+    unenrollments: int
+    active_learners: int
+
+class StatsOverview(BaseModel):
+    enrollments: int
+    learners: int
+    levels: List[LevelStats]
+    today: Optional[DayStats] = None
@@ -0,0 +1,97 @@
+"""Production-запуск API: несколько воркеров uvicorn по квоте CPU.
+
+    python -m app.server
+
+Схема БД и тестовые данные создаются один раз в мастер-процессе до старта
+воркеров (под advisory lock, поэтому реплики тоже не гоняются между собой).
+Воркеры только прогревают свои пулы и кэш в lifespan; если у мастера
+создание не удалось, его повторяют воркеры под тем же advisory lock. По SIGTERM uvicorn
+перестает принимать соединения и ждет текущие запросы GRACEFUL_TIMEOUT
+секунд.
+"""
+import asyncio
+import math
+import os
+
+import uvicorn
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Явное число воркеров; если не задано - по квоте CPU
+WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY")
+WORKERS_MAX = int(os.getenv("WORKERS_MAX", "8"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "20"))
+KEEP_ALIVE_TIMEOUT = int(os.getenv("KEEP_ALIVE_TIMEOUT", "5"))
+
+def cpu_quota(root="/sys/fs/cgroup"):
+    """Лимит CPU контейнера в ядрах (cgroup v2 или v1) или None"""
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+def available_cpus():
+    """Доступные процессу ядра с учетом лимита CPU контейнера (может быть дробным)"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, quota)
+    return cpus
+
+def worker_count():
+    if WEB_CONCURRENCY:
+        return max(1, int(WEB_CONCURRENCY))
+    cpus = available_cpus()
+    # Лимит 200m дает одного воркера: лишние процессы только делят квоту
+    return max(1, min(WORKERS_MAX, math.ceil(cpus)))
+
+async def bootstrap_once():
+    """Инициализация в мастер-процессе; после успеха воркеры наследуют окружение и пропускают ее"""
+    from .main import INIT_DB_ON_STARTUP, bootstrap
+    from .database import dispose_engines, wait_for_database
+
+    if not INIT_DB_ON_STARTUP:
+        return
+    await wait_for_database()
+    try:
+        await asyncio.to_thread(bootstrap)
+    except Exception as e:
+        # INIT_DB_ON_STARTUP остается: воркеры повторят bootstrap в retry_start_up
+        print(f"Startup error: {e}, workers will retry")
+    else:
+        os.environ["INIT_DB_ON_STARTUP"] = "false"
+    finally:
+        # Соединения мастера воркерам не нужны
+        await dispose_engines()
+
+def main():
+    workers = worker_count()
+    if workers > 1:
+        # Воркеры наследуют окружение: у каждого свои ряды метрик (app.metrics)
+        os.environ["METRICS_WORKER_LABEL"] = "true"
+    # Один воркер работает в этом же процессе и сам выполнит bootstrap в lifespan
+    if workers > 1:
+        asyncio.run(bootstrap_once())
+    print(f"Starting {workers} worker(s) on {HOST}:{PORT}")
+    uvicorn.run(
+        "app.main:app",
+        host=HOST,
+        port=PORT,
+        workers=workers,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        timeout_keep_alive=KEEP_ALIVE_TIMEOUT,
+        proxy_headers=True,
+    )
+
+if __name__ == "__main__":
+    main()
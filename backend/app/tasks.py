@@ -0,0 +1,71 @@
+"""Обработчики фоновых задач и функции для их постановки из эндпоинтов"""
+import json
+import uuid
+from datetime import datetime
+
+from . import analytics, bulk_import, models
+from .crud import insert_ignore
+from .database import SessionLocal
+from .jobs import enqueue, enqueue_async, job
+
+def audit_payload(action, user_id, details):
+    return {
+        "event_id": uuid.uuid4().hex,
+        "action": action,
+        "user_id": user_id,
+        "occurred_at": datetime.utcnow().isoformat(),
+        "details": details,
+    }
+
+def audit(action, user_id=None, **details):
+    return enqueue("audit", **audit_payload(action, user_id, details))
+
+async def audit_async(action, user_id=None, **details):
+    return await enqueue_async("audit", **audit_payload(action, user_id, details))
+
+def start_import(import_id):
+    return enqueue("import", import_id=import_id)
+
+async def start_import_async(import_id):
+    return await enqueue_async("import", import_id=import_id)
+
+@job("audit")
+def record_audit_event(event_id, action, user_id, occurred_at, details):
+    db = SessionLocal()
+    try:
+        db.execute(
+            insert_ignore(db, models.AuditEvent.__table__)
+            .values(
+                event_id=event_id,
+                action=action,
+                user_id=user_id,
+                created_at=datetime.fromisoformat(occurred_at),
+                details=json.dumps(details, ensure_ascii=False) if details else None,
+            )
+            .on_conflict_do_nothing(index_elements=["event_id"])
+        )
+        db.commit()
+    finally:
+        db.close()
+
+# Агрегаты /stats после записей на курсы; повтор пачки не учитывается дважды
+@job("analytics.enrollments")
+def record_enrollments(batch_id, pairs, sign, day):
+    db = SessionLocal()
+    try:
+        analytics.apply_enrollments(db, batch_id, pairs, sign, day)
+    finally:
+        db.close()
+
+@job("analytics.courses")
+def recount_courses(course_ids, old_levels):
+    db = SessionLocal()
+    try:
+        analytics.apply_course_changes(db, course_ids, old_levels)
+    finally:
+        db.close()
+
+# Повтор после сбоя продолжает импорт со следующей незафиксированной пачки
+@job("import", heartbeat=True)
+def run_import(import_id):
+    bulk_import.run_uploaded_import(import_id)
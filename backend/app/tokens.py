@@ -0,0 +1,249 @@
+"""Токены доступа: выпуск в сервисе авторизации и проверка в API.
+
+Сервис авторизации (app.auth_service) подписывает короткоживущие токены
+доступа RS256 и публикует открытые ключи в /.well-known/jwks.json. API
+проверяет подпись локально по набору ключей, который загружается при старте
+и обновляется в фоне раз в JWKS_REFRESH_INTERVAL: общего секрета нет, и
+проверка токена не ходит в сеть. Токен с незнакомым kid (ключ только что
+сменили) вызывает внеочередное обновление не чаще JWKS_MIN_REFRESH_INTERVAL.
+
+Токены обновления - случайные строки; в Redis хранится только их хэш с
+(uid, ver). Токен обновления одноразовый: при обмене он удаляется и
+выдается новый. Отзыв (token_version) делает недействительными и токены
+доступа, и токены обновления.
+
+Ключ подписи: AUTH_PRIVATE_KEY (PEM) или файл AUTH_PRIVATE_KEY_FILE. Старые
+ключи из AUTH_RETIRED_KEY_FILES публикуются в JWKS, пока не истекут
+подписанные ими токены. Без ключа сервис авторизации не запускается; только
+с AUTH_DEV_KEY=true (docker-compose) процесс генерирует временный ключ в
+памяти - он меняется при перезапуске, и несколько процессов с ним не работают.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+
+import redis
+import requests
+import rsa
+from jose import JWTError, jwk, jwt
+
+from .cache import LRUCache
+from .redis_client import get_redis, mark_redis_down
+
+ALGORITHM = "RS256"
+TOKEN_ISSUER = os.getenv("TOKEN_ISSUER", "eduplatform-auth")
+ACCESS_TOKEN_EXPIRE_MINUTES = float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "5"))
+REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL", str(14 * 24 * 3600)))
+REFRESH_TOKEN_LOCAL_SIZE = int(os.getenv("REFRESH_TOKEN_LOCAL_SIZE", "100000"))
+
+AUTH_PRIVATE_KEY = os.getenv("AUTH_PRIVATE_KEY", "")
+AUTH_PRIVATE_KEY_FILE = os.getenv("AUTH_PRIVATE_KEY_FILE", "/etc/auth-keys/private.pem")
+AUTH_RETIRED_KEY_FILES = [path for path in os.getenv("AUTH_RETIRED_KEY_FILES", "").split(",") if path]
+SIGNING_KEY_BITS = int(os.getenv("SIGNING_KEY_BITS", "2048"))
+AUTH_DEV_KEY = os.getenv("AUTH_DEV_KEY", "false").lower() == "true"
+
+# Пустой JWKS_URL - ключи берутся из этого же процесса (сервис авторизации, тесты)
+JWKS_URL = os.getenv("JWKS_URL", "http://backend-auth-service:8001/.well-known/jwks.json")
+JWKS_REFRESH_INTERVAL = float(os.getenv("JWKS_REFRESH_INTERVAL", "300"))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "10"))
+JWKS_TIMEOUT = float(os.getenv("JWKS_TIMEOUT", "2"))
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def public_jwk(pem):
+    """Открытый ключ в формате JWK; kid - отпечаток ключа по RFC 7638"""
+    key = jwk.construct(pem, ALGORITHM).public_key().to_dict()
+    thumbprint = json.dumps({"e": key["e"], "kty": key["kty"], "n": key["n"]}, separators=(",", ":"))
+    key["kid"] = b64url(hashlib.sha256(thumbprint.encode()).digest())
+    key["use"] = "sig"
+    return key
+
+def generate_private_key():
+    _, private_key = rsa.newkeys(SIGNING_KEY_BITS)
+    return private_key.save_pkcs1().decode()
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+class SigningKeys:
+    """Ключ подписи сервиса авторизации и опубликованные открытые ключи"""
+
+    def __init__(self, private_pem, retired_pems=()):
+        self.private_pem = private_pem
+        self.current = public_jwk(private_pem)
+        self.kid = self.current["kid"]
+        self.public = [self.current] + [public_jwk(pem) for pem in retired_pems]
+
+    def jwks(self):
+        return {"keys": self.public}
+
+_signing_keys = None
+_signing_lock = threading.Lock()
+
+def signing_keys():
+    """Ключи подписи процесса; загружаются при первом обращении"""
+    global _signing_keys
+    with _signing_lock:
+        if _signing_keys is None:
+            if AUTH_PRIVATE_KEY:
+                private_pem = AUTH_PRIVATE_KEY
+            elif os.path.exists(AUTH_PRIVATE_KEY_FILE):
+                private_pem = read_file(AUTH_PRIVATE_KEY_FILE)
+            elif AUTH_DEV_KEY:
+                print("AUTH_DEV_KEY is set, using a generated development key")
+                private_pem = generate_private_key()
+            else:
+                raise RuntimeError(
+                    f"Signing key is not configured: set AUTH_PRIVATE_KEY or mount {AUTH_PRIVATE_KEY_FILE}"
+                )
+            _signing_keys = SigningKeys(private_pem, [read_file(path) for path in AUTH_RETIRED_KEY_FILES])
+        return _signing_keys
+
+# Выпуск токенов
+def create_access_token(user):
+    keys = signing_keys()
+    now = int(time.time())
+    claims = {
+        "iss": TOKEN_ISSUER,
+        "sub": user.email,
+        "uid": user.id,
+        "ver": user.token_version,
+        "iat": now,
+        "exp": now + int(ACCESS_TOKEN_EXPIRE_MINUTES * 60),
+    }
+    return jwt.encode(claims, keys.private_pem, algorithm=ALGORITHM, headers={"kid": keys.kid})
+
+class RefreshTokenStore:
+    """Одноразовые токены обновления: хэш токена -> (uid, ver) в Redis.
+
+    Без Redis токены хранятся в памяти процесса (один узел, тесты).
+    """
+
+    def __init__(self, ttl=REFRESH_TOKEN_TTL, local_size=REFRESH_TOKEN_LOCAL_SIZE):
+        self.ttl = ttl
+        self.local = LRUCache(local_size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return "refresh:" + hashlib.sha256(token.encode()).hexdigest()
+
+    def issue(self, user_id, token_version):
+        token = secrets.token_urlsafe(32)
+        value = f"{user_id}:{token_version}"
+        client = get_redis()
+        if client is not None:
+            try:
+                client.set(self._key(token), value, ex=self.ttl)
+                return token
+            except redis.RedisError:
+                mark_redis_down()
+        self.local.set(self._key(token), value, self.ttl)
+        return token
+
+    def consume(self, token):
+        """(uid, ver) и удаление токена; None, если токен неизвестен или уже использован"""
+        key = self._key(token)
+        value = None
+        client = get_redis()
+        if client is not None:
+            try:
+                value = client.getdel(key)
+            except redis.RedisError:
+                mark_redis_down()
+        if value is None:
+            with self._lock:
+                value = self.local.get(key)
+                self.local.delete(key)
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+        user_id, token_version = value.split(":")
+        return int(user_id), int(token_version)
+
+refresh_tokens = RefreshTokenStore()
+
+def issue_tokens(user):
+    """Ответ входа: токен доступа и новый токен обновления"""
+    return {
+        "access_token": create_access_token(user),
+        "refresh_token": refresh_tokens.issue(user.id, user.token_version),
+        "token_type": "bearer",
+        "expires_in": int(ACCESS_TOKEN_EXPIRE_MINUTES * 60),
+    }
+
+# Проверка токенов
+def fetch_jwks():
+    if not JWKS_URL:
+        return signing_keys().jwks()
+    response = requests.get(JWKS_URL, timeout=JWKS_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+class KeySet:
+    """Открытые ключи издателя, кэш процесса"""
+
+    def __init__(self):
+        self.keys = {}
+        self.fetched_at = None
+        self._last_attempt = float("-inf")
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Загружает JWKS; при ошибке остаются прежние ключи"""
+        if not self._lock.acquire(blocking=False):
+            # Уже обновляет другой поток
+            return False
+        try:
+            self._last_attempt = time.monotonic()
+            keys = {key["kid"]: key for key in fetch_jwks()["keys"]}
+            self.keys = keys
+            self.fetched_at = time.monotonic()
+            return True
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"JWKS refresh failed: {e}")
+            return False
+        finally:
+            self._lock.release()
+
+    def get(self, kid):
+        key = self.keys.get(kid)
+        if key is None and time.monotonic() - self._last_attempt >= JWKS_MIN_REFRESH_INTERVAL:
+            self.refresh()
+            key = self.keys.get(kid)
+        return key
+
+key_set = KeySet()
+
+async def refresh_keys_periodically():
+    """Фоновое обновление JWKS; первая загрузка сразу"""
+    while True:
+        await asyncio.to_thread(key_set.refresh)
+        await asyncio.sleep(JWKS_REFRESH_INTERVAL if key_set.fetched_at is not None else JWKS_MIN_REFRESH_INTERVAL)
+
+def local_key(kid):
+    """Открытый ключ по kid из ключей этого процесса (сервис авторизации)"""
+    for key in signing_keys().public:
+        if key["kid"] == kid:
+            return key
+    return None
+
+def verify_access_token(token, get_key=None):
+    """Проверенные claims токена доступа или None"""
+    get_key = get_key or key_set.get
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = get_key(kid) if kid else None
+        if key is None:
+            return None
+        return jwt.decode(token, key, algorithms=[ALGORITHM], issuer=TOKEN_ISSUER)
+    except JWTError:
+        return None
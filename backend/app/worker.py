@@ -0,0 +1,40 @@
+"""Воркер фоновых задач.
+
+    python -m app.worker
+
+Несколько воркеров делят одну группу потребителей; по SIGTERM воркер
+дорабатывает текущую задачу и выходит.
+"""
+import asyncio
+import os
+import signal
+import socket
+import threading
+
+import redis
+
+from . import tasks  # noqa: F401 - регистрация обработчиков
+from .database import wait_for_database
+from .jobs import JOBS_BLOCK_MS, RedisBroker, run_worker
+from .redis_client import REDIS_URL
+
+def main():
+    asyncio.run(wait_for_database())
+    if not REDIS_URL:
+        # Без Redis воркеру нечего разбирать: локальная очередь есть только в API
+        raise SystemExit("REDIS_URL is required for the job worker")
+    # Собственный клиент: общий рассчитан на короткие команды, а XREADGROUP блокируется
+    client = redis.Redis.from_url(REDIS_URL, socket_timeout=JOBS_BLOCK_MS / 1000 + 5)
+    broker = RedisBroker(client)
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    print(f"Job worker {consumer} started")
+    run_worker(broker, consumer, stop_event)
+    print(f"Job worker {consumer} stopped")
+
+if __name__ == "__main__":
+    main()
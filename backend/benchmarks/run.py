@@ -0,0 +1,271 @@
+"""Нагрузочные и микро-бенчмарки горячих путей API.
+
+Запуск из каталога backend:
+
+    python -m benchmarks.run --users 1000 --courses 500 --enrollments 5000
+    python -m benchmarks.run --save-baseline            # сохранить эталон
+    python -m benchmarks.run --fail-on-regression       # сравнить с эталоном
+
+По умолчанию приложение работает на временной SQLite-базе; для Postgres
+укажите BENCH_DATABASE_URL. Результаты пишутся в JSON (--output) и
+сравниваются с benchmarks/baseline.json, если он есть.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+BENCH_PASSWORD = "bench-password"
+
+def configure_environment():
+    # DATABASE_URL читается при импорте app.database
+    database_url = os.getenv("BENCH_DATABASE_URL")
+    if not database_url:
+        path = os.path.join(tempfile.mkdtemp(prefix="edu-bench-"), "bench.db")
+        database_url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("REDIS_URL", "")
+    # Сценарий login идет с одного адреса и иначе упрется в лимиты
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    # Токены выпускает app.auth_service в этом же процессе: временный ключ,
+    # API берет открытый ключ у него же, а не по JWKS_URL
+    os.environ.setdefault("AUTH_DEV_KEY", "true")
+    os.environ.setdefault("JWKS_URL", "")
+    return database_url
+
+def seed(users, courses, enrollments):
+    """Заполняет БД пакетными INSERT; у всех пользователей один пароль (один хэш)"""
+    from sqlalchemy import insert
+    from app import crud, models
+    from app.database import SessionLocal, get_engine
+
+    engine = get_engine()
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    password_hash = crud.get_password_hash(BENCH_PASSWORD)
+    rng = random.Random(42)
+    levels = ["beginner", "intermediate", "advanced"]
+
+    with SessionLocal() as db:
+        db.execute(insert(models.User), [
+            {"email": f"user{i}@bench.ru", "password": password_hash, "name": f"Пользователь {i}"}
+            for i in range(1, users + 1)
+        ])
+        db.execute(insert(models.Course), [
+            {
+                "name": f"Курс {i}",
+                "description": "Описание курса для нагрузочного теста. " * 3,
+                "hours": rng.randint(1, 40),
+                "level": levels[i % len(levels)],
+            }
+            for i in range(1, courses + 1)
+        ])
+        pairs = {(rng.randint(1, users), rng.randint(1, courses)) for _ in range(enrollments)}
+        if pairs:
+            db.execute(insert(models.user_course_association), [
+                {"user_id": user_id, "course_id": course_id} for user_id, course_id in pairs
+            ])
+        db.commit()
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": pick(0.50) if latencies else None,
+        "p95_ms": pick(0.95) if latencies else None,
+        "p99_ms": pick(0.99) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+    }
+
+async def run_scenario(client, make_request, concurrency, total):
+    """Выполняет total запросов при фиксированной конкурентности"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(worker_id):
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            ok = await make_request(client, worker_id, i)
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+async def run_load(args):
+    import httpx
+    from app.auth_service import app as auth_app
+    from app.main import app
+
+    results = {}
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client, \
+            httpx.AsyncClient(app=auth_app, base_url="http://bench-auth") as auth_client:
+        tokens = []
+        for worker_id in range(args.concurrency):
+            response = await auth_client.post("/auth/login", json={
+                "email": f"user{worker_id % args.users + 1}@bench.ru", "password": BENCH_PASSWORD
+            })
+            response.raise_for_status()
+            tokens.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+
+        async def login(client, worker_id, i):
+            response = await auth_client.post("/auth/login", json={
+                "email": f"user{i % args.users + 1}@bench.ru", "password": BENCH_PASSWORD
+            })
+            return response.status_code == 200
+
+        async def courses(client, worker_id, i):
+            response = await client.get("/courses", headers=tokens[worker_id])
+            return response.status_code == 200
+
+        async def my_courses(client, worker_id, i):
+            response = await client.get("/users/me/courses", headers=tokens[worker_id])
+            return response.status_code == 200
+
+        async def enroll_leave(client, worker_id, i):
+            course_id = i % args.courses + 1
+            enrolled = await client.post(f"/users/me/courses/{course_id}", headers=tokens[worker_id])
+            left = await client.delete(f"/users/me/courses/{course_id}", headers=tokens[worker_id])
+            return enrolled.status_code == 200 and left.status_code == 200
+
+        scenarios = {
+            "login": (login, args.login_requests),
+            "courses": (courses, args.requests),
+            "my_courses": (my_courses, args.requests),
+            "enroll_leave": (enroll_leave, args.requests),
+        }
+        for name, (make_request, total) in scenarios.items():
+            results[name] = await run_scenario(client, make_request, args.concurrency, total)
+            print(f"{name:<14} {results[name]}")
+    return results
+
+def measure(func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    return {"ops_per_sec": round(number / seconds, 1), "mean_us": round(seconds / number * 1e6, 3)}
+
+def run_micro(args):
+    from app import crud, models, schemas, tokens
+    from app.responses import RowsResponse
+
+    user = models.User(id=1, email="user1@bench.ru", token_version=0)
+    token = tokens.create_access_token(user)
+    password_hash = crud.get_password_hash(BENCH_PASSWORD)
+    rows = [
+        {"id": i, "name": f"Курс {i}", "description": "Описание курса. " * 5,
+         "hours": i % 40, "level": "beginner", "is_enrolled": i % 3 == 0}
+        for i in range(args.serialize_rows)
+    ]
+    # namedtuple повторяет интерфейс Row, который использует RowsResponse
+    CourseRow = collections.namedtuple("CourseRow", rows[0].keys())
+    row_tuples = [CourseRow(**row) for row in rows]
+
+    results = {
+        # Подпись RS256 в библиотеке rsa на чистом Python занимает десятки мс
+        "create_access_token": measure(lambda: tokens.create_access_token(user), 50),
+        "verify_token": measure(lambda: tokens.verify_access_token(token), 2000),
+        "argon2_hash": measure(lambda: crud.get_password_hash(BENCH_PASSWORD), 5),
+        "argon2_verify": measure(lambda: crud.verify_password(BENCH_PASSWORD, password_hash), 5),
+        f"serialize_{args.serialize_rows}_courses": measure(
+            lambda: [schemas.CourseWithEnrollment(**row).model_dump() for row in rows], 20
+        ),
+        f"serialize_{args.serialize_rows}_courses_orjson": measure(lambda: RowsResponse(row_tuples), 20),
+    }
+    for name, result in results.items():
+        print(f"{name:<28} {result}")
+    return results
+
+def compare(current, baseline, threshold):
+    """Список регрессий: падение пропускной способности или рост p99 больше threshold"""
+    regressions = []
+    for name, result in current.get("load", {}).items():
+        base = baseline.get("load", {}).get(name)
+        if not base:
+            continue
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"load.{name}: rps {base['rps']} -> {result['rps']}")
+        if base["p99_ms"] and result["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions.append(f"load.{name}: p99 {base['p99_ms']}ms -> {result['p99_ms']}ms")
+    for name, result in current.get("micro", {}).items():
+        base = baseline.get("micro", {}).get(name)
+        if base and result["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            regressions.append(f"micro.{name}: {base['ops_per_sec']} -> {result['ops_per_sec']} ops/s")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="API load and micro benchmarks")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--courses", type=int, default=100)
+    parser.add_argument("--enrollments", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=40)
+    parser.add_argument("--serialize-rows", type=int, default=1000)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    database_url = configure_environment()
+    seed(args.users, args.courses, args.enrollments)
+
+    results = {
+        "meta": {
+            "database": database_url.split("://")[0],
+            "python": platform.python_version(),
+            "users": args.users,
+            "courses": args.courses,
+            "enrollments": args.enrollments,
+            "concurrency": args.concurrency,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+    }
+    if not args.skip_load:
+        results["load"] = asyncio.run(run_load(args))
+    if not args.skip_micro:
+        results["micro"] = run_micro(args)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results saved to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if not regressions:
+            print("No regressions against baseline")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,9 @@ CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     email VARCHAR UNIQUE NOT NULL,
     password VARCHAR NOT NULL,
-    name VARCHAR NOT NULL
+    name VARCHAR NOT NULL,
+    token_version INTEGER NOT NULL DEFAULT 0,
+    is_admin BOOLEAN NOT NULL DEFAULT FALSE
 );
 
 CREATE TABLE IF NOT EXISTS courses (
@@ -11,11 +13,93 @@ CREATE TABLE IF NOT EXISTS courses (
     name VARCHAR NOT NULL,
     description TEXT,
     hours INTEGER NOT NULL,
-    level VARCHAR NOT NULL
+    level VARCHAR NOT NULL,
+    enrolled_count INTEGER NOT NULL DEFAULT 0
 );
 
+CREATE INDEX IF NOT EXISTS ix_courses_level_id ON courses (level, id);
+CREATE INDEX IF NOT EXISTS ix_courses_hours_id ON courses (hours, id);
+CREATE INDEX IF NOT EXISTS ix_courses_enrolled_count_id ON courses (enrolled_count DESC, id);
+CREATE INDEX IF NOT EXISTS ix_courses_name ON courses (name);
+
+-- Полнотекстовый поиск по названию (вес A) и описанию (вес B)
+ALTER TABLE courses ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED;
+CREATE INDEX IF NOT EXISTS ix_courses_search_vector ON courses USING GIN (search_vector);
+
 CREATE TABLE IF NOT EXISTS user_courses (
     user_id INTEGER REFERENCES users(id),
     course_id INTEGER REFERENCES courses(id),
     PRIMARY KEY (user_id, course_id)
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS ix_user_courses_course_id ON user_courses (course_id);
+
+CREATE TABLE IF NOT EXISTS audit_events (
+    id SERIAL PRIMARY KEY,
+    event_id VARCHAR UNIQUE NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
+    user_id INTEGER,
+    action VARCHAR NOT NULL,
+    details TEXT
+);
+
+CREATE INDEX IF NOT EXISTS ix_audit_events_user_id ON audit_events (user_id);
+
+CREATE TABLE IF NOT EXISTS import_runs (
+    id VARCHAR PRIMARY KEY,
+    kind VARCHAR NOT NULL,
+    source VARCHAR NOT NULL,
+    format VARCHAR NOT NULL,
+    batch_size INTEGER NOT NULL,
+    status VARCHAR NOT NULL,
+    batches_done INTEGER NOT NULL DEFAULT 0,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    rows_skipped INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Агрегаты для /stats (app.analytics)
+CREATE TABLE IF NOT EXISTS analytics_user_hours (
+    user_id INTEGER PRIMARY KEY,
+    courses INTEGER NOT NULL DEFAULT 0,
+    hours INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_analytics_user_hours_hours ON analytics_user_hours (hours DESC, user_id);
+
+CREATE TABLE IF NOT EXISTS analytics_learners (
+    shard INTEGER PRIMARY KEY,
+    learners INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS analytics_levels (
+    level VARCHAR NOT NULL,
+    shard INTEGER NOT NULL,
+    enrollments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (level, shard)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_daily (
+    day DATE NOT NULL,
+    shard INTEGER NOT NULL,
+    enrollments INTEGER NOT NULL DEFAULT 0,
+    unenrollments INTEGER NOT NULL DEFAULT 0,
+    active_learners INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, shard)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_daily_learners (
+    day DATE NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_applied_batches (
+    batch_id VARCHAR PRIMARY KEY,
+    day DATE NOT NULL
+);
@@ -0,0 +1,121 @@
+import json
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import sessionmaker
+
+from app import analytics, crud, models, redis_client
+
+@pytest.fixture
+def queued(monkeypatch):
+    """Задачи аналитики, поставленные после commit"""
+    jobs = []
+    monkeypatch.setattr(analytics, "enqueue", lambda name, **payload: jobs.append((name, payload)))
+    return jobs
+
+def run_jobs(db, queued):
+    handlers = {"analytics.enrollments": analytics.apply_enrollments, "analytics.courses": analytics.apply_course_changes}
+    while queued:
+        name, payload = queued.pop(0)
+        handlers[name](db, **payload)
+
+@pytest.fixture
+def db(monkeypatch, queued):
+    """SQLite в памяти: три пользователя, курсы двух уровней"""
+    monkeypatch.setattr(redis_client, "REDIS_URL", "")
+    engine = create_engine("sqlite:///:memory:")
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    session.add_all([models.User(email=f"{i}@test.com", password="x", name=f"U{i}") for i in range(1, 4)])
+    session.add_all([
+        models.Course(name="A", description="", hours=10, level="beginner"),
+        models.Course(name="B", description="", hours=20, level="beginner"),
+        models.Course(name="C", description="", hours=30, level="advanced"),
+    ])
+    session.commit()
+    yield session
+    session.close()
+
+def test_enrollments_update_aggregates(db, queued):
+    crud.enroll_users_in_courses(db, [1, 2], [1, 3])
+    crud.enroll_users_in_courses(db, [3], [2])
+    crud.remove_users_from_courses(db, [2], [1, 3])
+    # Запись на курс агрегаты не трогает - их обновляет задача
+    assert analytics.get_overview(db)["enrollments"] == 0
+    run_jobs(db, queued)
+
+    overview = analytics.get_overview(db)
+    assert (overview["enrollments"], overview["learners"]) == (3, 2)
+    assert overview["levels"] == [
+        {"level": "beginner", "enrollments": 2},
+        {"level": "advanced", "enrollments": 1},
+    ]
+    assert overview["today"]["enrollments"] == 5
+    assert overview["today"]["unenrollments"] == 2
+    assert overview["today"]["active_learners"] == 3
+    assert [(row["user_id"], row["hours"]) for row in analytics.get_learner_stats(db, 10)] == [(1, 40), (3, 20)]
+    assert analytics.get_user_stats(db, 2) == {"user_id": 2, "courses": 0, "hours": 0}
+
+def test_repeated_job_is_applied_once(db, queued):
+    crud.enroll_users_in_courses(db, [1], [1, 3])
+    (_, payload), = queued
+    assert analytics.apply_enrollments(db, **payload)
+    assert not analytics.apply_enrollments(db, **payload)
+
+    overview = analytics.get_overview(db)
+    assert (overview["enrollments"], overview["learners"]) == (2, 1)
+    assert overview["today"]["enrollments"] == 2
+    # Записи по уровню лежат в части пользователя, а не в части 0
+    assert db.execute(select(analytics.levels.c.shard).distinct()).scalars().all() == [analytics.shard_of(1)]
+    assert analytics.get_user_stats(db, 1)["hours"] == 40
+
+def test_course_changes_recount_users_and_levels(db, queued):
+    crud.enroll_users_in_courses(db, [1, 2], [1])
+    run_jobs(db, queued)
+    db.execute(update(models.Course.__table__).where(models.Course.id == 1).values(hours=15, level="advanced"))
+    db.commit()
+
+    analytics.enqueue_course_changes([(1, "beginner")])
+    run_jobs(db, queued)
+    assert [(row["user_id"], row["hours"]) for row in analytics.get_learner_stats(db, 10)] == [(1, 15), (2, 15)]
+    assert analytics.get_level_stats(db) == [
+        {"level": "advanced", "enrollments": 2},
+        {"level": "beginner", "enrollments": 0},
+    ]
+
+def test_refresh_fixes_drift(db, queued):
+    crud.enroll_users_in_courses(db, [1, 2], [1, 2])
+    run_jobs(db, queued)
+    # Расхождение после ручной правки БД
+    db.execute(update(analytics.user_hours).where(analytics.user_hours.c.user_id == 1).values(hours=999))
+    db.execute(update(analytics.levels).values(enrollments=0))
+    db.execute(update(analytics.learners).values(learners=7))
+    db.commit()
+
+    assert analytics.refresh_user_hours(db, batch_size=2) == 1
+    assert analytics.refresh_learners(db) == 2
+    analytics.refresh_levels(db)
+    assert analytics.get_user_stats(db, 1)["hours"] == 30
+    assert analytics.get_overview(db)["enrollments"] == 4
+    assert analytics.get_overview(db)["learners"] == 2
+
+def test_backfill_daily_from_audit_log(db):
+    events = [
+        (datetime(2024, 3, 1, 10), 1, "enrollment.added", None),
+        (datetime(2024, 3, 1, 11), 2, "enrollment.batch", {"enrolled": 3, "left": 1}),
+        (datetime(2024, 3, 2, 9), 1, "enrollment.removed", None),
+        (datetime(2024, 3, 2, 9), 1, "user.updated", None),
+    ]
+    db.add_all([
+        models.AuditEvent(event_id=str(i), created_at=at, user_id=user_id, action=action,
+                          details=json.dumps(details) if details else None)
+        for i, (at, user_id, action, details) in enumerate(events)
+    ])
+    db.commit()
+
+    assert analytics.backfill_daily(db, date(2024, 3, 1), date(2024, 3, 3)) == 2
+    assert analytics.get_activity(db, 7, until=date(2024, 3, 3)) == [
+        {"day": date(2024, 3, 2), "enrollments": 0, "unenrollments": 1, "active_learners": 1},
+        {"day": date(2024, 3, 1), "enrollments": 4, "unenrollments": 1, "active_learners": 2},
+    ]
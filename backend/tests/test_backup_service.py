@@ -0,0 +1,83 @@
+import os
+import stat
+import zlib
+
+from app import backup_service
+
+def entry(name, created_at):
+    return {"name": name, "created_at": created_at}
+
+def test_retention_keeps_latest_per_tier(monkeypatch):
+    monkeypatch.setattr(backup_service, "KEEP_LAST", 1)
+    monkeypatch.setattr(backup_service, "KEEP_HOURLY", 2)
+    monkeypatch.setattr(backup_service, "KEEP_DAILY", 2)
+    monkeypatch.setattr(backup_service, "KEEP_WEEKLY", 0)
+    entries = [
+        entry("a", "2024-01-01T10:00:00"),
+        entry("b", "2024-01-02T09:00:00"),
+        entry("c", "2024-01-02T09:30:00"),
+        entry("d", "2024-01-02T10:00:00"),
+        entry("e", "2024-01-02T10:30:00"),
+    ]
+
+    assert backup_service.select_kept(entries) == {"e", "c", "a"}
+
+def test_custom_dump_is_streamed_through_compressor(tmp_path, monkeypatch):
+    # Подменяем pg_dump скриптом, который пишет известные данные в stdout
+    fake = tmp_path / "pg_dump"
+    fake.write_text("#!/bin/sh\nprintf 'dump-data'\n")
+    fake.chmod(fake.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    monkeypatch.setattr(backup_service, "BACKUP_DIR", str(tmp_path / "backups"))
+
+    result = backup_service.create_backup()
+
+    path = tmp_path / "backups" / result["name"]
+    assert result["name"].endswith(".dump.gz")
+    assert zlib.decompress(path.read_bytes(), 31) == b"dump-data"
+    assert backup_service.load_manifest()[0]["size_bytes"] == path.stat().st_size
+
+def test_legacy_sql_backups_are_subject_to_retention(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup_service, "BACKUP_DIR", str(tmp_path))
+    monkeypatch.setattr(backup_service, "KEEP_LAST", 1)
+    monkeypatch.setattr(backup_service, "KEEP_HOURLY", 0)
+    monkeypatch.setattr(backup_service, "KEEP_DAILY", 0)
+    monkeypatch.setattr(backup_service, "KEEP_WEEKLY", 0)
+    (tmp_path / "backup_20240101_100000.sql").write_text("old")
+    (tmp_path / "backup_20240102_100000.sql").write_text("new")
+
+    manifest = backup_service.apply_retention(backup_service.adopt_legacy_backups([]))
+
+    assert [entry["name"] for entry in manifest] == ["backup_20240102_100000.sql"]
+    assert sorted(os.listdir(tmp_path)) == ["backup_20240102_100000.sql"]
+
+def test_failed_dump_leaves_no_partial_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))  # pg_dump не найден - Popen падает
+    monkeypatch.setattr(backup_service, "BACKUP_DIR", str(tmp_path / "backups"))
+
+    assert backup_service.create_backup() is None
+    assert os.listdir(tmp_path / "backups") == []
+
+def test_password_is_passed_through_environment(tmp_path, monkeypatch):
+    fake = tmp_path / "pg_dump"
+    fake.write_text('#!/bin/sh\nprintf "%s|$PGPASSWORD" "$*"\n')
+    fake.chmod(fake.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    monkeypatch.setattr(backup_service, "BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setattr(backup_service, "BACKUP_COMPRESSION", "none")
+    monkeypatch.setattr(backup_service, "DATABASE_URL", "postgresql://user:p%40ss@db:5432/education_platform")
+
+    result = backup_service.create_backup()
+
+    args, password = (tmp_path / "backups" / result["name"]).read_text().split("|")
+    assert "--dbname=postgresql://user@db:5432/education_platform" in args
+    assert password == "p@ss"
+
+def test_legacy_backups_are_adopted_only_without_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup_service, "BACKUP_DIR", str(tmp_path))
+    (tmp_path / "backup_20240101_100000.sql").write_text("old")
+    assert [entry["name"] for entry in backup_service.load_manifest()] == ["backup_20240101_100000.sql"]
+
+    backup_service.save_manifest([])
+    (tmp_path / "backup_20240102_100000.sql").write_text("copied later")
+    assert backup_service.load_manifest() == []
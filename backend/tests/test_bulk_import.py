@@ -0,0 +1,99 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+from app import analytics, bulk_import, database, models, redis_client
+from app.hashing import pwd_context
+
+@pytest.fixture
+def queued(monkeypatch):
+    """Задачи аналитики вместо очереди: локальный воркер ходил бы в основную БД"""
+    jobs = []
+    monkeypatch.setattr(analytics, "enqueue", lambda name, **payload: jobs.append((name, payload)))
+    return jobs
+
+@pytest.fixture
+def db(tmp_path, monkeypatch, queued):
+    """Импорт в файловую SQLite-базу без Redis"""
+    monkeypatch.setattr(redis_client, "REDIS_URL", "")
+    monkeypatch.setattr(bulk_import, "IMPORT_HASH_WORKERS", 1)
+    original_url = database.DATABASE_URL
+    database.configure_database(f"sqlite:///{tmp_path / 'import.db'}")
+    models.Base.metadata.create_all(bind=database.get_engine())
+    session = database.SessionLocal()
+    session.add(models.User(email="old@test.com", password="x", name="Old"))
+    session.add(models.Course(name="Existing", description="Old", hours=1, level="beginner"))
+    session.commit()
+    yield session
+    session.close()
+    database.configure_database(original_url)
+
+def run(db, kind, path, batch_size=2):
+    return bulk_import.run_import(bulk_import.create_run(db, kind, str(path), batch_size=batch_size).id)
+
+def test_import_users_and_courses(db, tmp_path, queued):
+    hashed = pwd_context.hash("secret")
+    users = tmp_path / "users.csv"
+    users.write_text(
+        "email,name,password,password_hash\n"
+        "new@test.com,New,secret,\n"
+        f"old@test.com,Renamed,,{hashed}\n"
+        "broken,No email,x,\n"
+        f"other@test.com,Other,,{hashed}\n"
+    )
+    courses = tmp_path / "courses.ndjson"
+    courses.write_text("\n".join([
+        json.dumps({"name": "Existing", "description": "New", "hours": 5, "level": "advanced"}),
+        json.dumps({"name": "Fresh", "hours": "3", "level": "beginner"}),
+        "not json",
+    ]))
+
+    result = run(db, "users", users)
+    assert (result.status, result.batches_done, result.rows_done, result.rows_skipped) == ("completed", 2, 4, 1)
+    assert run(db, "courses", courses).rows_skipped == 1
+
+    stored = {user.email: user for user in db.query(models.User)}
+    assert sorted(stored) == ["new@test.com", "old@test.com", "other@test.com"]
+    assert stored["old@test.com"].name == "Renamed"
+    # Пароль существующего пользователя импорт не меняет
+    assert stored["old@test.com"].password == "x"
+    assert pwd_context.verify("secret", stored["new@test.com"].password)
+    assert [(c.name, c.description, c.hours, c.level) for c in db.query(models.Course).order_by(models.Course.id)] == [
+        ("Existing", "New", 5, "advanced"),
+        ("Fresh", None, 3, "beginner"),
+    ]
+    # Часы и уровень курса изменились - аналитика пересчитает его учащихся
+    assert queued == [("analytics.courses", {"course_ids": [1], "old_levels": ["beginner"]})]
+
+def test_enrollment_import_resumes_without_duplicates(db, tmp_path, monkeypatch):
+    source = tmp_path / "enrollments.csv"
+    source.write_text(
+        "email,course_id,course\n"
+        "old@test.com,1,\n"
+        "old@test.com,,Existing\n"
+        "old@test.com,,Missing\n"
+        "nobody@test.com,1,\n"
+    )
+    run_id = bulk_import.create_run(db, "enrollments", str(source), batch_size=2).id
+
+    merge = bulk_import.merge_enrollments
+    def fail_second_batch(session, rows):
+        if any(row[0] == "nobody@test.com" for row in rows):
+            raise RuntimeError("connection lost")
+        return merge(session, rows)
+
+    monkeypatch.setattr(bulk_import, "merge_enrollments", fail_second_batch)
+    with pytest.raises(RuntimeError):
+        bulk_import.run_import(run_id)
+    failed = db.get(models.ImportRun, run_id)
+    assert (failed.status, failed.batches_done) == ("failed", 1)
+
+    monkeypatch.setattr(bulk_import, "merge_enrollments", merge)
+    db.expire_all()
+    result = bulk_import.run_import(run_id)
+    assert (result.status, result.batches_done, result.rows_done) == ("completed", 2, 4)
+
+    enrollment = models.user_course_association
+    assert db.execute(select(enrollment.c.user_id, enrollment.c.course_id)).all() == [(1, 1)]
+    assert db.get(models.Course, 1).enrolled_count == 1
@@ -0,0 +1,69 @@
+import pytest
+
+from app import redis_client
+from app.cache import LRUCache, CatalogCache
+
+@pytest.fixture(autouse=True)
+def no_redis(monkeypatch):
+    """Кэш должен работать без Redis, используя LRU в памяти"""
+    monkeypatch.setattr(redis_client, "REDIS_URL", "")
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+def test_catalog_cache_read_through_and_invalidate():
+    cache = CatalogCache(ttl=60)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [{"id": 1, "name": "Test Course"}]
+
+    assert cache.get_or_load("courses", loader) == [{"id": 1, "name": "Test Course"}]
+    assert cache.get_or_load("courses", loader) == [{"id": 1, "name": "Test Course"}]
+    assert len(calls) == 1
+
+    cache.invalidate()
+    cache.get_or_load("courses", loader)
+    assert len(calls) == 2
+
+    stats = cache.stats()
+    assert stats["backend"] == "local"
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+def test_catalog_invalidation_during_redis_outage(monkeypatch):
+    import fakeredis
+    from app import cache as cache_module
+
+    client = fakeredis.FakeRedis()
+    cache = CatalogCache(ttl=60)
+    monkeypatch.setattr(cache_module, "get_redis", lambda: client)
+    cache.get_or_load("courses", lambda: ["old"])
+
+    # Redis недоступен: увеличивается только локальная версия
+    monkeypatch.setattr(cache_module, "get_redis", lambda: None)
+    cache.invalidate()
+
+    monkeypatch.setattr(cache_module, "get_redis", lambda: client)
+    assert cache.get_or_load("courses", lambda: ["new"]) == ["new"]
+    assert client.get(CatalogCache.VERSION_KEY) == b"1"
+
+def test_principal_cache_invalidate():
+    from app.principal import Principal, PrincipalCache
+
+    cache = PrincipalCache(ttl=60)
+    principal = Principal(id=1, email="test@test.com", name="Test User", token_version=0)
+    cache.set(principal)
+    assert cache.get(1) == principal
+
+    cache.invalidate(1)
+    assert cache.get(1) is None
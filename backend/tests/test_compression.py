@@ -0,0 +1,59 @@
+import gzip
+import hashlib
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from app import compression
+
+def make_client():
+    app = FastAPI()
+    app.add_middleware(compression.CompressionMiddleware)
+
+    @app.get("/large")
+    def large():
+        return PlainTextResponse("Описание курса " * 500, headers={"ETag": '"v1"'})
+
+    @app.get("/user/{user_id}")
+    def user(user_id: int):
+        # Одинаковый ETag у разных тел не должен давать чужое тело из кэша
+        return PlainTextResponse(f"Курсы {user_id} " * 500, headers={"ETag": '"v1"'})
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("ok")
+
+    return app, TestClient(app)
+
+def test_negotiate_respects_quality():
+    assert compression.negotiate("gzip, zstd;q=0.5") == "gzip"
+    assert compression.negotiate("gzip, br, zstd") == "zstd"
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("gzip;q=0") is None
+
+def test_large_response_compressed_once_per_body():
+    app, client = make_client()
+
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.text == "Описание курса " * 500
+
+    middleware = app.middleware_stack
+    while not isinstance(middleware, compression.CompressionMiddleware):
+        middleware = middleware.app
+    body = ("Описание курса " * 500).encode()
+    cached = middleware.cache.get((hashlib.blake2b(body, digest_size=16).digest(), "gzip"))
+    assert gzip.decompress(cached) == body
+
+def test_cache_does_not_mix_bodies_with_same_etag():
+    _, client = make_client()
+    assert client.get("/user/1", headers={"Accept-Encoding": "gzip"}).text == "Курсы 1 " * 500
+    assert client.get("/user/2", headers={"Accept-Encoding": "gzip"}).text == "Курсы 2 " * 500
+
+def test_small_response_not_compressed():
+    _, client = make_client()
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
@@ -0,0 +1,139 @@
+import fakeredis
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import analytics, crud, models
+
+@pytest.fixture
+def db(monkeypatch):
+    """Сессия на SQLite в памяти с двумя пользователями и тремя курсами"""
+    # Задачи аналитики не ставятся: локальный воркер ходил бы в основную БД
+    monkeypatch.setattr(analytics, "enqueue", lambda name, **payload: None)
+    engine = create_engine("sqlite:///:memory:")
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    session.add_all([
+        models.User(email="a@test.com", password="x", name="A"),
+        models.User(email="b@test.com", password="x", name="B"),
+    ])
+    session.add_all([
+        models.Course(name=f"Course {i}", description="Test", hours=i, level="beginner")
+        for i in range(1, 4)
+    ])
+    session.commit()
+    yield session
+    session.close()
+
+def test_courses_with_enrollment(db):
+    crud.enroll_user_in_course(db, 1, 2)
+    crud.enroll_user_in_course(db, 2, 3)
+
+    rows = crud.get_courses_with_enrollment(db, 1)
+
+    assert [(row.id, row.is_enrolled) for row in rows] == [(1, False), (2, True), (3, False)]
+
+def test_cached_courses_with_enrollment(db, monkeypatch):
+    from app import cache, etags
+
+    crud.enroll_user_in_course(db, 1, 2)
+    joined = [dict(row._mapping) for row in crud.get_courses_with_enrollment(db, 1)]
+
+    # Без Redis - один запрос с LEFT JOIN
+    monkeypatch.setattr(etags, "get_redis", lambda: None)
+    rows = crud.get_cached_courses_with_enrollment(db, 1)
+    assert [(row["id"], row["is_enrolled"]) for row in rows] == [(1, False), (2, True), (3, False)]
+    assert rows == joined
+
+    # С Redis - общая страница каталога и список курсов пользователя из кэша
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(etags, "get_redis", lambda: client)
+    monkeypatch.setattr(cache, "get_redis", lambda: client)
+    assert crud.get_cached_courses_with_enrollment(db, 1) == joined
+    assert any(key.startswith(b"catalog:v") and b":enrolled:1:" in key for key in client.keys())
+
+def test_courses_keyset_pagination(db):
+    first = crud.get_courses(db, limit=2)
+    cursor = crud.encode_cursor(first[-1].id)
+    second = crud.get_courses(db, after_id=crud.decode_cursor(cursor), limit=2)
+
+    assert [course.id for course in first] == [1, 2]
+    assert [course.id for course in second] == [3]
+    assert [course.id for course in crud.get_courses(db, min_hours=2, max_hours=2)] == [2]
+
+    with pytest.raises(ValueError):
+        crud.decode_cursor("not-a-cursor")
+
+def test_batch_enrollment_is_idempotent(db):
+    assert crud.enroll_users_in_courses(db, [1, 2], [1, 2, 99]) == 4
+    assert crud.enroll_users_in_courses(db, [1], [1, 3]) == 1
+    assert crud.remove_users_from_courses(db, [1, 2], [1]) == 2
+
+    assert [course.id for course in crud.get_user_courses(db, 1)] == [2, 3]
+    assert [course.id for course in crud.get_user_courses(db, 2)] == [2]
+
+def test_row_endpoints_match_schemas(db):
+    """Строки для RowsResponse должны совпадать с контрактом схем"""
+    from app import schemas
+    from app.responses import rows_to_dicts
+
+    crud.enroll_user_in_course(db, 1, 2)
+
+    catalog = rows_to_dicts(crud.get_courses_with_enrollment(db, 1))
+    assert set(catalog[0]) == set(schemas.CourseWithEnrollment.model_fields)
+    assert [schemas.CourseWithEnrollment(**row).model_dump() for row in catalog] == catalog
+    # orjson сериализует флаг как true/false, а не 0/1
+    assert [type(row["is_enrolled"]) for row in catalog] == [bool] * 3
+
+    my_courses = rows_to_dicts(crud.get_user_course_rows(db, 1))
+    assert set(my_courses[0]) == set(schemas.Course.model_fields)
+    assert [row["id"] for row in my_courses] == [2]
+
+def test_search_courses_ranks_name_matches_first(db):
+    db.add_all([
+        models.Course(name="Основы SQL", description="Запросы и индексы", hours=5, level="beginner"),
+        models.Course(name="Python", description="Работа с sql из кода", hours=8, level="advanced"),
+    ])
+    db.commit()
+    crud.enroll_user_in_course(db, 1, 5)
+
+    rows = crud.search_courses(db, 1, "SQL")
+    assert [(row.name, row.is_enrolled) for row in rows] == [("Основы SQL", False), ("Python", True)]
+    assert [row.name for row in crud.search_courses(db, 1, "sql", level="advanced")] == ["Python"]
+    assert [row.name for row in crud.search_courses(db, 1, "sql", offset=1)] == ["Python"]
+    # Символы LIKE и операторы tsquery не влияют на запрос
+    assert crud.search_courses(db, 1, "%") == []
+    assert [row.name for row in crud.search_courses(db, 1, "sql & !python")] == ["Python"]
+
+def test_offset_cursor(db):
+    assert crud.decode_cursor(crud.encode_cursor(40, "offset"), "offset") == 40
+    with pytest.raises(ValueError):
+        crud.decode_cursor(crud.encode_cursor(40), "offset")
+
+def test_enrolled_counts_follow_enrollments(db):
+    assert crud.enroll_users_in_courses(db, [1, 2], [1, 2]) == 4
+    assert crud.enroll_users_in_courses(db, [1], [1, 3]) == 1
+    assert crud.remove_users_from_courses(db, [2], [1, 3]) == 1
+
+    counts = {course.id: course.enrolled_count for course in db.query(models.Course)}
+    assert counts == {1: 1, 2: 2, 3: 1}
+    rows = crud.get_courses_with_enrollment(db, 1)
+    assert [row.enrolled_count for row in rows] == [1, 2, 1]
+    assert [course["id"] for course in crud.get_popular_courses(db, 2)] == [2, 1]
+
+def test_reconcile_enrolled_counts(db):
+    crud.enroll_users_in_courses(db, [1, 2], [1])
+    db.query(models.Course).update({models.Course.enrolled_count: 7})
+    db.commit()
+
+    assert crud.reconcile_enrolled_counts(db, batch_size=2) == 3
+    counts = {course.id: course.enrolled_count for course in db.query(models.Course)}
+    assert counts == {1: 2, 2: 0, 3: 0}
+    assert crud.reconcile_enrolled_counts(db) == 0
+
+def test_set_admin(db):
+    assert crud.set_admin(db, "a@test.com")
+    assert crud.get_user_by_email(db, "a@test.com").is_admin
+    assert crud.set_admin(db, "a@test.com", False)
+    assert not crud.get_user_by_email(db, "a@test.com").is_admin
+    assert not crud.set_admin(db, "missing@test.com")
@@ -0,0 +1,42 @@
+import fakeredis
+import pytest
+
+from app import etags, redis_client
+from app.cache import CatalogCache
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_client, "get_redis", lambda: client)
+    monkeypatch.setattr(etags, "get_redis", lambda: client)
+    return client
+
+def test_versioned_etag_changes_on_writes(fake_redis):
+    first = etags.versioned_etag("courses", "", user_id=1)
+    assert etags.versioned_etag("courses", "", user_id=1) == first
+    # Счетчики пользователей равны, но ETag разные
+    assert etags.versioned_etag("courses", "", user_id=2) != first
+
+    etags.bump_enrollment_versions([1])
+    second = etags.versioned_etag("courses", "", user_id=1)
+    assert second != first
+    assert etags.versioned_etag("courses", "", user_id=2) != second
+
+    fake_redis.incr(CatalogCache.VERSION_KEY)
+    assert etags.versioned_etag("courses", "", user_id=1) != second
+
+def test_versioned_etag_requires_redis(monkeypatch):
+    monkeypatch.setattr(etags, "get_redis", lambda: None)
+    assert etags.versioned_etag("courses") is None
+
+def test_missed_bump_changes_epoch(fake_redis, monkeypatch):
+    first = etags.versioned_etag("courses", "", user_id=1)
+
+    # Запись во время недоступности Redis не увеличивает версию пользователя
+    monkeypatch.setattr(etags, "get_redis", lambda: None)
+    etags.bump_enrollment_versions([1])
+
+    monkeypatch.setattr(etags, "get_redis", lambda: fake_redis)
+    assert etags.versioned_etag("courses", "", user_id=1) != first
+    second = etags.versioned_etag("courses", "", user_id=1)
+    assert etags.versioned_etag("courses", "", user_id=1) == second
@@ -0,0 +1,74 @@
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from app import events, redis_client
+
+@pytest.fixture(autouse=True)
+def no_redis(monkeypatch):
+    monkeypatch.setattr(redis_client, "REDIS_URL", "")
+
+def test_stream_delivers_own_events_and_resumes():
+    hub = events.EventHub()
+
+    async def scenario():
+        stream = hub.stream(7)
+        assert await anext(stream) == f"retry: {events.EVENTS_RETRY_MS}\n\n"
+        hub.publish_local("enrollment", {"added": [1]}, user_id=8)
+        created = hub.publish_local("course.created", {"id": 5})
+        own = hub.publish_local("enrollment", {"added": [2]}, user_id=7)
+        assert await anext(stream) == f'id: {created.id}\nevent: course.created\ndata: {{"id":5}}\n\n'
+        assert await anext(stream) == f'id: {own.id}\nevent: enrollment\ndata: {{"added":[2]}}\n\n'
+        await stream.aclose()
+        assert hub.subscriber_count() == 0
+
+        resumed = hub.stream(7, last_event_id=created.id)
+        await anext(resumed)
+        assert (await anext(resumed)).startswith(f"id: {own.id}\n")
+        await resumed.aclose()
+
+        # Неизвестный id: клиент должен перечитать данные
+        reset = hub.stream(7, last_event_id="garbage")
+        await anext(reset)
+        assert await anext(reset) == f"id: {own.id}\nevent: reset\ndata: {{}}\n\n"
+        await reset.aclose()
+
+    asyncio.run(scenario())
+
+def test_slow_client_stream_is_closed(monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_QUEUE_SIZE", 2)
+    hub = events.EventHub()
+
+    async def scenario():
+        stream = hub.stream(1)
+        await anext(stream)
+        for i in range(3):
+            hub.publish_local("course.created", {"id": i})
+        await asyncio.sleep(0)
+        # Очередь переполнилась: поток закрывается, клиент продолжит по Last-Event-ID
+        assert [frame async for frame in stream] == []
+
+    asyncio.run(scenario())
+
+def test_redis_history_replay(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(events, "get_redis", lambda: fakeredis.FakeRedis(server=server))
+    hub = events.EventHub()
+    hub.publish_many([
+        ("course.created", {"id": 1}, None),
+        ("enrollment", {"added": [1]}, 2),
+        ("enrollment", {"removed": [1]}, 3),
+    ])
+    ids = [entry_id.decode() for entry_id, _ in fakeredis.FakeRedis(server=server).xrange(events.EVENTS_LOG)]
+
+    async def replay(last_event_id):
+        client = fakeredis.aioredis.FakeRedis(server=server)
+        return await hub.replay_redis(client, last_event_id, 2)
+
+    replayed, reset_id = asyncio.run(replay(ids[0]))
+    assert reset_id is None
+    assert [(e.id, e.type, e.data) for e in replayed] == [(ids[1], "enrollment", {"added": [1]})]
+    # Id старше начала потока - часть истории могла быть обрезана
+    assert asyncio.run(replay("1-0")) == ([], ids[-1])
@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+from passlib.context import CryptContext
+
+from app import hashing
+
+def test_verify_rehashes_outdated_hash(monkeypatch):
+    old_context = CryptContext(schemes=["argon2"], argon2__time_cost=1, argon2__memory_cost=8192)
+    monkeypatch.setattr(hashing, "pwd_context", CryptContext(
+        schemes=["argon2"], argon2__time_cost=2, argon2__memory_cost=8192
+    ))
+    old_hash = old_context.hash("secret")
+
+    is_valid, new_hash = asyncio.run(hashing.verify_password("secret", old_hash))
+    assert is_valid
+    assert new_hash is not None and new_hash != old_hash
+
+    is_valid, new_hash = asyncio.run(hashing.verify_password("secret", hashing._hash("secret")))
+    assert is_valid and new_hash is None
+
+def test_full_queue_is_rejected(monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_MAX_PENDING", 0)
+
+    with pytest.raises(hashing.HashingBusy):
+        asyncio.run(hashing.hash_password("secret"))
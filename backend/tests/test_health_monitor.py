@@ -0,0 +1,29 @@
+import asyncio
+
+from app import health_monitor
+
+class SlowTarget(health_monitor.Target):
+    async def probe(self):
+        await asyncio.sleep(10)
+        return True, "ok"
+
+class OkTarget(health_monitor.Target):
+    async def probe(self):
+        return True, "ok"
+
+def test_checks_run_concurrently_with_timeout(monkeypatch):
+    monkeypatch.setattr(health_monitor, "CHECK_TIMEOUT", 0.2)
+    targets = [SlowTarget("slow", "x"), SlowTarget("slow2", "x"), OkTarget("ok", "x")]
+
+    asyncio.run(asyncio.wait_for(health_monitor.monitor_all_services(targets), 1))
+
+    state = health_monitor.aggregate_state(targets)
+    assert state["healthy"] is False
+    assert [target["message"] for target in state["targets"]] == ["Timeout", "Timeout", "ok"]
+    assert state["targets"][2]["latency_ms"]["p99"] is not None
+
+def test_parse_targets():
+    targets = health_monitor.parse_targets(
+        "API=http://api:8000/health, Database=postgresql://u:p@db/x, Redis=redis://redis:6379/0", None
+    )
+    assert [type(target).__name__ for target in targets] == ["WebServiceTarget", "DatabaseTarget", "RedisTarget"]
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from app import jobs
+from app.jobs import LocalBroker, RedisBroker, process
+
+@pytest.fixture(params=["local", "redis"])
+def broker(request, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_RETRY_BASE_DELAY", 0)
+    if request.param == "local":
+        return LocalBroker()
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(jobs, "get_redis", lambda: client)
+    broker = RedisBroker(client)
+    broker.ensure_group()
+    return broker
+
+def enqueue(broker, name, **payload):
+    if isinstance(broker, LocalBroker):
+        broker.add(jobs.make_job(name, payload))
+    else:
+        jobs.enqueue(name, **payload)
+
+def fetch(broker):
+    return broker.fetch("test", block_ms=0)
+
+def test_job_is_retried_until_it_succeeds(broker, monkeypatch):
+    calls = []
+
+    def flaky(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise RuntimeError("temporary")
+
+    monkeypatch.setitem(jobs._handlers, "flaky", flaky)
+    enqueue(broker, "flaky", value=1)
+    results = []
+    for _ in range(3):
+        batch = fetch(broker)
+        assert len(batch) == 1
+        results.append(process(broker, *batch[0]))
+
+    assert results == [False, False, True]
+    assert calls == [1, 1, 1]
+    assert fetch(broker) == []
+
+def test_failing_job_goes_to_dead_letters(broker, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_MAX_ATTEMPTS", 2)
+    monkeypatch.setitem(jobs._handlers, "broken", lambda: 1 / 0)
+    enqueue(broker, "broken")
+    for _ in range(2):
+        process(broker, *fetch(broker)[0])
+    assert fetch(broker) == []
+    if isinstance(broker, LocalBroker):
+        assert broker.dead_jobs[0]["attempts"] == 2
+    else:
+        assert broker.client.xlen(jobs.JOBS_DEAD_STREAM) == 1
+
+def test_unacked_job_is_redelivered_after_visibility_timeout(broker, monkeypatch):
+    monkeypatch.setitem(jobs._handlers, "noop", lambda: None)
+    enqueue(broker, "noop")
+    message_id, item, reclaimed = fetch(broker)[0]
+    assert not reclaimed
+    # Воркер "упал", не подтвердив задачу
+    monkeypatch.setattr(jobs, "JOBS_VISIBILITY_TIMEOUT", 0)
+    redelivered = fetch(broker)
+    assert [(entry[1]["id"], entry[2]) for entry in redelivered] == [(item["id"], True)]
+    assert process(broker, *redelivered[0]) is False
+
+    # Зависание засчитано как попытка, задача вернулась через отложенную очередь
+    monkeypatch.setattr(jobs, "JOBS_VISIBILITY_TIMEOUT", 60)
+    retried = fetch(broker)
+    assert [(entry[1]["id"], entry[1]["attempts"]) for entry in retried] == [(item["id"], 1)]
+    assert process(broker, *retried[0]) is True
+
+def test_long_running_job_keeps_visibility(broker, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_VISIBILITY_TIMEOUT", 0.3)
+    seen = []
+
+    def long_job():
+        time.sleep(0.5)
+        # Другой воркер не забирает задачу, пока она выполняется
+        seen.extend(fetch(broker))
+
+    monkeypatch.setitem(jobs._handlers, "long", long_job)
+    monkeypatch.setattr(jobs, "_long_running", {"long"})
+    enqueue(broker, "long")
+    assert process(broker, *fetch(broker)[0], consumer="test") is True
+    assert seen == []
+
+def test_run_worker_stops_on_event(monkeypatch):
+    broker = LocalBroker()
+    stop_event = threading.Event()
+    done = []
+    monkeypatch.setitem(jobs._handlers, "mark", lambda: (done.append(1), stop_event.set()))
+    broker.add(jobs.make_job("mark", {}))
+    jobs.run_worker(broker, "test", stop_event)
+    assert done == [1]
@@ -1,9 +1,47 @@
 import pytest
 
-def test_health_check():
-    """Test health check endpoint without starting full app"""
-    # This test will be skipped in CI since we can't start the app without DB
-    pytest.skip("Skipping in CI - requires database connection")
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+    """Приложение на временной SQLite-базе без Redis"""
+    from app import database, redis_client, tokens
+    from app.main import app
+
+    monkeypatch.setattr(redis_client, "REDIS_URL", "")
+    # Ключи издателя из этого же процесса; короткий ключ генерируется быстрее
+    monkeypatch.setattr(tokens, "JWKS_URL", "")
+    monkeypatch.setattr(tokens, "AUTH_DEV_KEY", True)
+    monkeypatch.setattr(tokens, "SIGNING_KEY_BITS", 1024)
+    original_url = database.DATABASE_URL
+    database.configure_database(f"sqlite:///{tmp_path / 'test.db'}")
+    yield app
+    database.configure_database(original_url)
+
+def test_import_does_not_connect():
+    from app import database
+    assert database.pool_status() == {}
+
+def test_health_check(sqlite_app):
+    """Test health check endpoint against SQLite"""
+    from fastapi.testclient import TestClient
+
+    with TestClient(sqlite_app) as client:
+        assert client.get("/ready").json() == {"status": "ready"}
+        response = client.get("/health")
+        assert response.status_code == 200
+        assert response.json()["status"] == "healthy"
+
+def test_not_ready_after_failed_startup(sqlite_app, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    def broken_bootstrap():
+        raise RuntimeError("schema")
+
+    monkeypatch.setattr(main, "bootstrap", broken_bootstrap)
+    monkeypatch.setattr(main, "STARTUP_RETRY_DELAY", 60)
+    with TestClient(sqlite_app) as client:
+        assert client.get("/ready").status_code == 503
+        assert client.get("/health").status_code == 200
 
 def test_models_creation():
     """Test that models can be created"""
@@ -25,4 +63,80 @@ def test_schemas_validation():
     course_data = CourseCreate(name="Test Course", description="Test", hours=10, level="beginner")
     
     assert user_data.email == "test@test.com"
-    assert course_data.name == "Test Course"
\ No newline at end of file
+    assert course_data.name == "Test Course"
+
+def test_events_stream(sqlite_app, monkeypatch):
+    """Поток /events досылает пропущенное и закрывается к сроку токена"""
+    import time
+    from fastapi.testclient import TestClient
+    from app import events, tokens
+    from app.auth_service import app as auth_app
+
+    # Срок потока - exp токена; в тесте он уже наступил, и поток закрывается
+    # сразу после пропущенных событий, не дожидаясь истечения токена
+    stream, deadlines = events.event_hub.stream, []
+
+    def expired_stream(user_id, last_event_id=None, until=None):
+        deadlines.append(until)
+        return stream(user_id, last_event_id, until=time.time())
+
+    monkeypatch.setattr(events.event_hub, "stream", expired_stream)
+    with TestClient(sqlite_app) as client, TestClient(auth_app) as auth_client:
+        assert client.get("/events").status_code == 401
+        token = auth_client.post("/auth/login", json={"email": "student@edu.ru", "password": "123"}).json()["access_token"]
+        seen = events.event_hub.publish_local("course.created", {"id": 0})
+        client.post("/users/me/courses/2", headers={"Authorization": f"Bearer {token}"})
+
+        response = client.get(f"/events?token={token}", headers={"Last-Event-ID": seen.id})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert 'event: enrollment\ndata: {"added":[2]}' in response.text
+        assert deadlines == [tokens.verify_access_token(token)["exp"]]
+
+def test_refresh_rotation_and_revoke(sqlite_app):
+    """Токены выпускает сервис авторизации, API проверяет их по JWKS"""
+    from fastapi.testclient import TestClient
+    from app import tokens
+    from app.auth_service import app as auth_app
+
+    def bearer(token):
+        return {"Authorization": f"Bearer {token}"}
+
+    with TestClient(sqlite_app) as api, TestClient(auth_app) as auth:
+        kids = [key["kid"] for key in auth.get("/.well-known/jwks.json").json()["keys"]]
+        assert tokens.signing_keys().kid in kids
+
+        login = auth.post("/auth/login", json={"email": "student@edu.ru", "password": "123"}).json()
+        assert api.get("/users/me", headers=bearer(login["access_token"])).json()["email"] == "student@edu.ru"
+
+        # Токен обновления одноразовый
+        refreshed = auth.post("/auth/refresh", json={"refresh_token": login["refresh_token"]})
+        assert refreshed.status_code == 200
+        assert auth.post("/auth/refresh", json={"refresh_token": login["refresh_token"]}).status_code == 401
+        pair = refreshed.json()
+        assert api.get("/users/me", headers=bearer(pair["access_token"])).status_code == 200
+
+        # Отзыв закрывает и токены доступа, и токены обновления
+        assert auth.post("/auth/revoke", headers=bearer(pair["access_token"])).status_code == 200
+        assert api.get("/users/me", headers=bearer(pair["access_token"])).status_code == 401
+        assert auth.post("/auth/refresh", json={"refresh_token": pair["refresh_token"]}).status_code == 401
+
+def test_failed_upload_leaves_no_import_file(sqlite_app, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import bulk_import, main
+    from app.principal import Principal
+
+    monkeypatch.setattr(bulk_import, "IMPORT_DIR", str(tmp_path / "imports"))
+    monkeypatch.setattr(bulk_import, "IMPORT_MAX_BYTES", 10)
+    monkeypatch.setitem(
+        sqlite_app.dependency_overrides, main.get_current_admin,
+        lambda: Principal(id=1, email="admin@edu.ru", name="Admin", token_version=0, is_admin=True),
+    )
+
+    def broken_create_run(*args):
+        raise RuntimeError("database is down")
+
+    with TestClient(sqlite_app, raise_server_exceptions=False) as client:
+        assert client.post("/admin/imports/users?format=csv", content=b"x" * 11).status_code == 413
+        monkeypatch.setattr(bulk_import, "create_run", broken_create_run)
+        assert client.post("/admin/imports/users?format=csv", content=b"email\n").status_code == 500
+    assert sorted((tmp_path / "imports").iterdir()) == []
@@ -0,0 +1,43 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import metrics
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5, "/a")
+
+    samples = dict(histogram.samples())
+    assert samples['test_latency_seconds_bucket{route="/a",le="0.1"}'] == 1
+    assert samples['test_latency_seconds_bucket{route="/a",le="1.0"}'] == 2
+    assert samples['test_latency_seconds_bucket{route="/a",le="+Inf"}'] == 3
+    assert samples['test_latency_seconds_count{route="/a"}'] == 3
+
+def test_middleware_records_route_template():
+    app = FastAPI()
+    metrics.install(app, "test")
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        return {"id": item_id}
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+
+    assert metrics.REQUESTS.value("test", "GET", "/items/{item_id}", 200) == 2
+    assert 'http_requests_total{service="test",method="GET",route="/items/{item_id}",status="200"} 2' in client.get("/metrics").text
+
+def test_worker_label_separates_processes():
+    counter = metrics.Counter("test_worker_events_total", "Test events", ("kind",))
+    counter.inc("a")
+    gauge = metrics.Gauge("test_worker_gauge", "Test gauge")
+    gauge.set(3)
+
+    text = metrics.render(worker_label=True)
+    pid = metrics.os.getpid()
+    assert f'test_worker_events_total{{kind="a",worker="{pid}"}} 1' in text
+    assert f'test_worker_gauge{{worker="{pid}"}} 3' in text
+    assert 'test_worker_gauge 3' in metrics.render(worker_label=False)
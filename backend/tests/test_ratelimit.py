@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeServer, aioredis
+from starlette.requests import Request
+
+from app import ratelimit
+from app.ratelimit import RateLimiter, parse_limits
+
+def make_request(ip="10.0.0.1", headers=()):
+    return Request({"type": "http", "headers": list(headers), "client": (ip, 1)})
+
+@pytest.fixture(params=["local", "redis"])
+def backend(request, monkeypatch):
+    client = aioredis.FakeRedis(server=FakeServer()) if request.param == "redis" else None
+    monkeypatch.setattr(ratelimit, "get_async_redis", lambda: client)
+    return request.param
+
+def test_parse_limits():
+    limits = parse_limits("login=ip:20/60,email:10/300;register=global:5/1")
+    assert limits["login"] == [("ip", 20, 60.0), ("email", 10, 300.0)]
+    assert limits["register"] == [("global", 5, 1.0)]
+    with pytest.raises(ValueError):
+        parse_limits("login=user:1/1")
+
+def test_client_ip_trusts_proxy_headers_only_when_enabled(monkeypatch):
+    request = make_request("127.0.0.1", [(b"x-real-ip", b"10.0.0.1")])
+    assert ratelimit.client_ip(request) == "127.0.0.1"
+
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_TRUST_PROXY", True)
+    assert ratelimit.client_ip(request) == "10.0.0.1"
+
+def test_bucket_rejects_after_capacity(backend):
+    limiter = RateLimiter(parse_limits("login=ip:3/60"))
+
+    async def run():
+        results = [await limiter.check("login", make_request()) for _ in range(4)]
+        other_ip = await limiter.check("login", make_request("10.0.0.2"))
+        return results, other_ip
+
+    results, other_ip = asyncio.run(run())
+    assert results[:3] == [None, None, None]
+    assert 0 < results[3] <= 20
+    assert other_ip is None
+    assert ratelimit.RATE_LIMITED.value("login", "ip", backend) >= 1
+
+def test_rejection_does_not_consume_other_buckets(backend):
+    limiter = RateLimiter(parse_limits("login=ip:10/60,email:1/60"))
+
+    async def run():
+        first = await limiter.check("login", make_request(), "a@edu.ru")
+        # Лимит email исчерпан - токен ip не должен списываться
+        rejected = [await limiter.check("login", make_request(), "a@edu.ru") for _ in range(5)]
+        allowed = [await limiter.check("login", make_request(), f"u{i}@edu.ru") for i in range(9)]
+        return first, rejected, allowed
+
+    first, rejected, allowed = asyncio.run(run())
+    assert first is None
+    assert all(retry is not None for retry in rejected)
+    assert allowed == [None] * 9
+
+def test_email_identity_is_case_insensitive():
+    assert ratelimit.email_identity(" A@Edu.ru") == ratelimit.email_identity("a@edu.ru")
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from app import database, redis_client
+
+@pytest.fixture
+def replicas(tmp_path, monkeypatch):
+    """Primary и две реплики на отдельных SQLite-файлах, вторая недоступна"""
+    monkeypatch.setattr(redis_client, "REDIS_URL", "")
+    original_url = database.DATABASE_URL
+    database.configure_database(
+        f"sqlite:///{tmp_path / 'primary.db'}",
+        replica_urls=[f"sqlite:///{tmp_path / 'replica.db'}", f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"],
+    )
+    yield database._replicas
+    database.configure_database(original_url)
+
+def bound_url(db):
+    url = str(db.get_bind().url)
+    db.close()
+    return url
+
+def test_reads_wait_for_health_check(replicas):
+    healthy, broken = replicas
+    # До первой проверки все чтение идет на primary
+    assert bound_url(database.ReadSessionLocal()) == database.DATABASE_URL
+
+    async def check():
+        await asyncio.gather(*(database.check_replica(replica) for replica in replicas))
+        await asyncio.gather(*(replica.dispose() for replica in replicas))
+
+    asyncio.run(check())
+    assert database.replica_status() == {
+        "replica1": {"healthy": True, "lag": 0.0},
+        "replica2": {"healthy": False, "lag": None},
+    }
+    assert {bound_url(database.ReadSessionLocal()) for _ in range(3)} == {healthy.url}
+
+def test_read_your_writes_and_fallback(replicas):
+    healthy, broken = replicas
+    healthy.healthy = broken.healthy = True
+
+    urls = [bound_url(database.ReadSessionLocal(101)) for _ in range(4)]
+    # Недоступная реплика выбывает при первой ошибке, ее запрос уходит на primary
+    assert set(urls) == {healthy.url, database.DATABASE_URL}
+    assert not broken.healthy
+
+    database.mark_recent_write([101])
+    assert bound_url(database.ReadSessionLocal(101)) == database.DATABASE_URL
+    assert bound_url(database.ReadSessionLocal(102)) == healthy.url
+
+def test_async_read_your_writes_uses_async_redis(replicas, monkeypatch):
+    from fakeredis import FakeServer, aioredis
+
+    healthy, broken = replicas
+    healthy.healthy = True
+    client = aioredis.FakeRedis(server=FakeServer())
+    monkeypatch.setattr(database, "get_async_redis", lambda: client)
+    # Синхронный клиент в event loop не используется
+    monkeypatch.setattr(database, "get_redis", lambda: pytest.fail("sync Redis call"))
+
+    async def bound_urls():
+        # Запись сделана другим процессом: о ней знает только Redis
+        await client.set(database.recent_write_key(101), 1)
+        urls = []
+        for user_id in (101, 102):
+            async with await database.AsyncReadSessionLocal(user_id) as db:
+                urls.append(str(db.get_bind().url))
+        return urls
+
+    assert asyncio.run(bound_urls()) == [database.ASYNC_DATABASE_URL, healthy.async_url]
+
+def test_metrics_with_replicas_and_no_pools(replicas):
+    from app.main import collect_app_metrics
+
+    names = {sample[0] for sample in collect_app_metrics()}
+    assert "db_replica_healthy" in names
+    assert "db_pool_timeouts_total" not in names
+
+def test_configure_database_disposes_async_engines(replicas, tmp_path):
+    from sqlalchemy import text
+
+    async def query():
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+
+    asyncio.run(query())
+    engine = database._async_engine
+
+    database.configure_database(f"sqlite:///{tmp_path / 'other.db'}")
+    # Async engine закрывается не в configure_database, а в event loop
+    assert engine in database._retired
+    asyncio.run(database.dispose_engines())
+    assert database._retired == []
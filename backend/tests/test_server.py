@@ -0,0 +1,49 @@
+import asyncio
+
+from app import server
+
+def test_cpu_quota_cgroup_v2(tmp_path):
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert server.cpu_quota(str(tmp_path)) == 1.5
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert server.cpu_quota(str(tmp_path)) is None
+
+def test_cpu_quota_cgroup_v1(tmp_path):
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("20000")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000")
+    assert server.cpu_quota(str(tmp_path)) == 0.2
+
+def test_worker_count(monkeypatch):
+    monkeypatch.setattr(server, "WEB_CONCURRENCY", None)
+    monkeypatch.setattr(server, "cpu_quota", lambda: 0.2)
+    assert server.worker_count() == 1
+    monkeypatch.setattr(server, "cpu_quota", lambda: 2.5)
+    monkeypatch.setattr(server.os, "sched_getaffinity", lambda pid: set(range(16)), raising=False)
+    assert server.worker_count() == 3
+    monkeypatch.setattr(server, "WEB_CONCURRENCY", "4")
+    assert server.worker_count() == 4
+
+def test_failed_bootstrap_is_left_to_workers(monkeypatch):
+    from app import database, main
+
+    async def no_wait():
+        pass
+
+    async def no_dispose():
+        pass
+
+    def broken_bootstrap():
+        raise RuntimeError("database is starting")
+
+    monkeypatch.setattr(main, "INIT_DB_ON_STARTUP", True)
+    monkeypatch.setattr(main, "bootstrap", broken_bootstrap)
+    monkeypatch.setattr(database, "wait_for_database", no_wait)
+    monkeypatch.setattr(database, "dispose_engines", no_dispose)
+    monkeypatch.setenv("INIT_DB_ON_STARTUP", "true")
+    asyncio.run(server.bootstrap_once())
+    assert server.os.environ["INIT_DB_ON_STARTUP"] == "true"
+
+    monkeypatch.setattr(main, "bootstrap", lambda: None)
+    asyncio.run(server.bootstrap_once())
+    assert server.os.environ["INIT_DB_ON_STARTUP"] == "false"
@@ -0,0 +1,41 @@
+import pytest
+
+from app import tokens
+
+def test_key_rotation(monkeypatch):
+    class User:
+        id, email, token_version = 1, "a@edu.ru", 0
+
+    monkeypatch.setattr(tokens, "JWKS_URL", "")
+    monkeypatch.setattr(tokens, "SIGNING_KEY_BITS", 1024)
+    old_keys = tokens.SigningKeys(tokens.generate_private_key())
+    monkeypatch.setattr(tokens, "JWKS_MIN_REFRESH_INTERVAL", 0)
+    monkeypatch.setattr(tokens, "_signing_keys", old_keys)
+    monkeypatch.setattr(tokens, "key_set", tokens.KeySet())
+    old_token = tokens.create_access_token(User)
+    assert tokens.verify_access_token(old_token)["uid"] == 1
+
+    # Новый ключ: kid незнаком кэшу, набор ключей перечитывается; старый еще опубликован
+    new_keys = tokens.SigningKeys(tokens.generate_private_key(), [old_keys.private_pem])
+    monkeypatch.setattr(tokens, "_signing_keys", new_keys)
+    assert tokens.verify_access_token(tokens.create_access_token(User))["uid"] == 1
+    assert set(tokens.key_set.keys) == {new_keys.kid, old_keys.kid}
+    assert tokens.verify_access_token(old_token)["uid"] == 1
+
+    # Подпись чужим ключом с подставленным kid не проходит
+    foreign = tokens.SigningKeys(tokens.generate_private_key())
+    foreign.kid = new_keys.kid
+    monkeypatch.setattr(tokens, "_signing_keys", foreign)
+    assert tokens.verify_access_token(tokens.create_access_token(User)) is None
+
+def test_signing_key_is_required(tmp_path, monkeypatch):
+    monkeypatch.setattr(tokens, "_signing_keys", None)
+    monkeypatch.setattr(tokens, "AUTH_PRIVATE_KEY", "")
+    monkeypatch.setattr(tokens, "AUTH_PRIVATE_KEY_FILE", str(tmp_path / "missing.pem"))
+    monkeypatch.setattr(tokens, "AUTH_DEV_KEY", False)
+    with pytest.raises(RuntimeError):
+        tokens.signing_keys()
+
+    monkeypatch.setattr(tokens, "AUTH_DEV_KEY", True)
+    monkeypatch.setattr(tokens, "SIGNING_KEY_BITS", 1024)
+    assert tokens.signing_keys().kid
@@ -12,15 +12,50 @@ function setAuthToken(token) {
     localStorage.setItem('authToken', token);
 }
 
+// Токены входа: короткоживущий токен доступа и токен обновления
+function setSession(data) {
+    setAuthToken(data.access_token);
+    localStorage.setItem('refreshToken', data.refresh_token);
+    localStorage.setItem('currentUser', JSON.stringify(data.user));
+    localStorage.setItem('isLoggedIn', 'true');
+}
+
 // Remove auth token from localStorage
 function removeAuthToken() {
     localStorage.removeItem('authToken');
+    localStorage.removeItem('refreshToken');
     localStorage.removeItem('currentUser');
     localStorage.removeItem('isLoggedIn');
 }
 
+// Обмен токена обновления на новую пару токенов. Одновременные запросы
+// с истекшим токеном ждут один обмен: токен обновления одноразовый
+let refreshPromise = null;
+
+export function refreshAccessToken() {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (!refreshToken) {
+        return Promise.resolve(false);
+    }
+    if (!refreshPromise) {
+        refreshPromise = fetch(`${API_BASE_URL}/auth/refresh`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: refreshToken }),
+        })
+            .then(async (response) => {
+                if (!response.ok) return false;
+                setSession(await response.json());
+                return true;
+            })
+            .catch(() => false)
+            .finally(() => { refreshPromise = null; });
+    }
+    return refreshPromise;
+}
+
 // Generic API request function
-async function apiRequest(endpoint, options = {}) {
+async function apiRequest(endpoint, options = {}, onResponse = null, retried = false) {
     const token = getAuthToken();
     const headers = {
         'Content-Type': 'application/json',
@@ -41,6 +76,10 @@ async function apiRequest(endpoint, options = {}) {
         const isAuthEndpoint = endpoint.includes('/auth/');
         
         if (response.status === 401 && !isAuthEndpoint) {
+            // Токен доступа истек - получаем новый и повторяем запрос один раз
+            if (!retried && await refreshAccessToken()) {
+                return apiRequest(endpoint, options, onResponse, true);
+            }
             // Token expired or invalid for protected endpoints - logout
             removeAuthToken();
             window.location.href = 'login.html';
@@ -65,12 +104,33 @@ async function apiRequest(endpoint, options = {}) {
             throw new Error(errorMessage);
         }
 
+        if (onResponse) {
+            onResponse(response);
+        }
+
         return await response.json();
     } catch (error) {
         throw error;
     }
 }
 
+// Загружает все страницы списка с курсорной пагинацией (заголовок X-Next-Cursor)
+async function apiRequestAllPages(endpoint) {
+    const items = [];
+    let cursor = null;
+
+    do {
+        const separator = endpoint.includes('?') ? '&' : '?';
+        const url = cursor ? `${endpoint}${separator}cursor=${encodeURIComponent(cursor)}` : endpoint;
+        const page = await apiRequest(url, {}, (response) => {
+            cursor = response.headers.get('X-Next-Cursor');
+        });
+        items.push(...page);
+    } while (cursor);
+
+    return items;
+}
+
 // Auth API
 export const authAPI = {
     async login(email, password) {
@@ -80,9 +140,7 @@ export const authAPI = {
                 body: JSON.stringify({ email, password }),
             });
             
-            setAuthToken(data.access_token);
-            localStorage.setItem('currentUser', JSON.stringify(data.user));
-            localStorage.setItem('isLoggedIn', 'true');
+            setSession(data);
 
             return data;
         } catch (error) {
@@ -97,9 +155,7 @@ export const authAPI = {
                 body: JSON.stringify({ email, password, name }),
             });
             
-            setAuthToken(data.access_token);
-            localStorage.setItem('currentUser', JSON.stringify(data.user));
-            localStorage.setItem('isLoggedIn', 'true');
+            setSession(data);
 
             return data;
         } catch (error) {
@@ -112,6 +168,16 @@ export const authAPI = {
     },
 
     logout() {
+        const refreshToken = localStorage.getItem('refreshToken');
+        if (refreshToken) {
+            // Токен обновления больше не нужен - удаляем его и на сервере
+            fetch(`${API_BASE_URL}/auth/logout`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh_token: refreshToken }),
+                keepalive: true,
+            }).catch(() => {});
+        }
         removeAuthToken();
     }
 };
@@ -119,7 +185,13 @@ export const authAPI = {
 // Courses API
 export const coursesAPI = {
     async getAllCourses() {
-        return await apiRequest('/courses');
+        return await apiRequestAllPages('/courses');
+    },
+
+    async searchCourses(query, level = '') {
+        const params = new URLSearchParams({ q: query, limit: 50 });
+        if (level) params.set('level', level);
+        return await apiRequest(`/courses/search?${params}`);
     },
 
     async getMyCourses() {
@@ -139,6 +211,19 @@ export const coursesAPI = {
     }
 };
 
+// Поток событий (SSE). EventSource не умеет передавать заголовки,
+// поэтому токен передается параметром; Last-Event-ID браузер шлет сам
+// при переподключении, а новому потоку id передается параметром
+export function openEventStream(lastEventId = null) {
+    const token = getAuthToken();
+    if (!token || typeof EventSource === 'undefined') {
+        return null;
+    }
+    const params = new URLSearchParams({ token });
+    if (lastEventId) params.set('last_event_id', lastEventId);
+    return new EventSource(`${API_BASE_URL}/events?${params}`);
+}
+
 // User API
 export const userAPI = {
     async updateProfile(userData) {
@@ -1,8 +1,12 @@
-import { coursesAPI } from './api.js';
+import { coursesAPI, openEventStream, refreshAccessToken } from './api.js';
 
 // Функции для работы с курсами
 
 let currentCourses = [];
+let searchTimer = null;
+let searchRequestId = 0;
+const SEARCH_DEBOUNCE_MS = 250;
+let eventSource = null;
 
 // Инициализация страницы курсов
 document.addEventListener('DOMContentLoaded', function() {
@@ -20,20 +24,137 @@ function initCoursesPage() {
     
     // Настройка обработчиков событий
     setupCoursesEventListeners();
+    
+    // Изменения приходят с сервера, списки не нужно перезапрашивать
+    subscribeToCourseEvents();
+}
+
+let lastEventId = null;
+
+function subscribeToCourseEvents() {
+    eventSource = openEventStream(lastEventId);
+    if (!eventSource) return;
+    
+    const track = (handler) => (event) => {
+        lastEventId = event.lastEventId || lastEventId;
+        handler(event);
+    };
+    eventSource.addEventListener('enrollment', track((event) => applyEnrollmentEvent(JSON.parse(event.data))));
+    eventSource.addEventListener('course.created', track((event) => applyCourseCreated(JSON.parse(event.data))));
+    // Массовые изменения или пропущенные события - перечитываем список
+    eventSource.addEventListener('catalog.changed', track(() => loadCourses()));
+    eventSource.addEventListener('reset', track(() => loadCourses()));
+    
+    // Поток закрывается к сроку токена доступа, а переподключение со старым
+    // токеном получает 401 - обновляем токен и открываем поток заново
+    eventSource.addEventListener('error', async () => {
+        if (eventSource.readyState !== EventSource.CLOSED) return;
+        if (await refreshAccessToken()) {
+            subscribeToCourseEvents();
+        }
+    });
+}
+
+window.addEventListener('beforeunload', () => eventSource && eventSource.close());
+
+function isMyCoursesPageOpen() {
+    return window.location.pathname.includes('my-courses.html');
+}
+
+// Запись или выход в другой вкладке / на другом устройстве
+function applyEnrollmentEvent({ added = [], removed = [] }) {
+    if (isMyCoursesPageOpen()) {
+        if (added.length > 0) {
+            // Для новых курсов нужны их данные
+            loadCourses();
+            return;
+        }
+        currentCourses = currentCourses.filter(course => !removed.includes(course.id));
+        renderCourses(currentCourses, true);
+        filterCourses();
+        return;
+    }
+    
+    added.forEach(courseId => setEnrolledState(courseId, true));
+    removed.forEach(courseId => setEnrolledState(courseId, false));
+}
+
+function setEnrolledState(courseId, enrolled) {
+    const course = currentCourses.find(c => c.id === courseId);
+    if (course) {
+        course.is_enrolled = enrolled;
+    }
+    
+    const button = document.querySelector(`.course-card[data-course-id="${courseId}"] .btn-start`);
+    if (!button) return;
+    button.disabled = enrolled;
+    button.classList.toggle('btn-disabled', enrolled);
+    button.innerHTML = enrolled ? 'Курс добавлен' : 'Начать курс';
+}
+
+function applyCourseCreated(course) {
+    if (isMyCoursesPageOpen() || currentCourses.some(c => c.id === course.id)) return;
+    
+    const newCourse = { ...course, is_enrolled: false };
+    currentCourses.push(newCourse);
+    
+    // Во время поиска на экране результаты поиска - новый курс появится после сброса
+    const searchTerm = document.getElementById('course-search')?.value.trim() || '';
+    const coursesList = document.getElementById(getCoursesListId());
+    if (searchTerm || !coursesList) return;
+    coursesList.appendChild(createCourseElement(newCourse, false));
+    filterCourses();
 }
 
 function setupCoursesEventListeners() {
     // Обработчик поиска
     const searchInput = document.getElementById('course-search');
     if (searchInput) {
-        searchInput.addEventListener('input', filterCourses);
+        searchInput.addEventListener('input', onSearchChange);
     }
     
     // Обработчики фильтров
     const levelFilter = document.getElementById('level-filter');
     
     if (levelFilter) {
-        levelFilter.addEventListener('change', filterCourses);
+        levelFilter.addEventListener('change', onSearchChange);
+    }
+}
+
+// Каталог ищется на сервере, список "Мои курсы" небольшой и фильтруется локально
+function usesServerSearch() {
+    return window.location.pathname.includes('all-courses.html');
+}
+
+function onSearchChange() {
+    if (!usesServerSearch()) {
+        filterCourses();
+        return;
+    }
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(searchCatalog, SEARCH_DEBOUNCE_MS);
+}
+
+async function searchCatalog() {
+    const searchTerm = document.getElementById('course-search')?.value.trim() || '';
+    const levelFilter = document.getElementById('level-filter')?.value || '';
+    const requestId = ++searchRequestId;
+    
+    if (!searchTerm) {
+        renderCourses(currentCourses, false);
+        filterCourses();
+        return;
+    }
+    
+    try {
+        const results = await coursesAPI.searchCourses(searchTerm, levelFilter);
+        // Ответ на устаревший запрос, пользователь уже ввел другой текст
+        if (requestId !== searchRequestId) return;
+        renderCourses(results, false);
+        filterCourses();
+    } catch (error) {
+        console.error('Failed to search courses:', error);
+        showNotification('Ошибка поиска курсов', 'error');
     }
 }
 
@@ -154,6 +275,7 @@ function createCourseElement(course, isMyCoursesPage) {
                 <span class="course-hours">
                     ${course.hours} часов
                 </span>
+                <span class="course-enrolled">Записано: ${course.enrolled_count ?? 0}</span>
                 <span class="course-id">ID: ${course.id}</span>
             </div>
             <div class="course-actions">
@@ -215,8 +337,8 @@ async function startCourse(courseId) {
     try {
         await coursesAPI.enrollInCourse(courseId);
         
-        // Обновляем отображение
-        await loadCourses();
+        // Обновляем карточку на месте, без повторной загрузки списка
+        setEnrolledState(courseId, true);
         
         // Показываем уведомление
         showNotification('Курс успешно добавлен в ваше обучение!', 'success');
@@ -250,8 +372,8 @@ async function leaveCourse(courseId) {
     try {
         await coursesAPI.leaveCourse(courseId);
         
-        // Обновляем отображение
-        await loadCourses();
+        // Убираем курс из списка на месте, без повторной загрузки
+        applyEnrollmentEvent({ removed: [courseId] });
         
         // Показываем уведомление
         showNotification(`Вы покинули курс "${courseName}"`);
@@ -269,7 +391,8 @@ async function leaveCourse(courseId) {
 }
 
 function filterCourses() {
-    const searchTerm = document.getElementById('course-search')?.value.toLowerCase() || '';
+    // Результаты серверного поиска уже отобраны по тексту запроса
+    const searchTerm = usesServerSearch() ? '' : document.getElementById('course-search')?.value.toLowerCase() || '';
     const levelFilter = document.getElementById('level-filter')?.value || '';
     
     const coursesListId = getCoursesListId();
@@ -323,7 +446,7 @@ function clearFilters() {
     if (searchInput) searchInput.value = '';
     if (levelFilter) levelFilter.value = '';
     
-    filterCourses();
+    onSearchChange();
 }
 
 function showNotification(message, type = 'success') {